@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import AI_CACHE_ENABLED, AI_CACHE_MEMORY_ENTRIES, AI_CACHE_PATH, AI_CACHE_TTL, AI_CACHE_MAX_BYTES
+from metrics import registry
+
+
+def make_cache_key(model_name: str, prompt_content: list, response_mime_type: str, response_schema: dict | None) -> str:
+    """
+    يبني مفتاحا ثابتا من محتوى الطلب: النموذج، المحتوى، نوع الرد والمخطط.
+    """
+    material = json.dumps({
+        "model": model_name,
+        "contents": prompt_content,
+        "mime": response_mime_type,
+        "schema": response_schema,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    ذاكرة مؤقتة لردود Gemini على طبقتين: LRU في الذاكرة وقاعدة SQLite على القرص
+    مع مدة صلاحية وحد أقصى للحجم يحذف بعده الأقدم استخداما.
+    """
+    def __init__(self, db_path: str, memory_entries: int, ttl: int, max_bytes: int):
+        self._memory = OrderedDict()
+        self._memory_entries = memory_entries
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed_at)")
+        self._db.commit()
+
+    def _remember(self, key: str, value, stored_at: float):
+        self._memory[key] = (value, stored_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        """
+        يعيد القيمة المخزنة أو None إن لم توجد أو انتهت صلاحيتها.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] <= self._ttl:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._memory[key]
+
+            row = self._db.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self._ttl:
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            value = json.loads(row[0])
+            self._remember(key, value, row[1])
+            self.disk_hits += 1
+            return value
+
+    def put(self, key: str, value):
+        now = time.time()
+        serialized = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, value, now)
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, serialized, len(serialized.encode('utf-8')), now, now)
+            )
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now: float):
+        """
+        يحذف المنتهية صلاحيتها ثم الأقدم استخداما حتى يعود الحجم تحت الحد.
+        """
+        self.evictions += self._db.execute("DELETE FROM responses WHERE created_at < ?", (now - self._ttl,)).rowcount
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self._max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            if total <= self._max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._memory.pop(key, None)
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memoryHits": self.memory_hits,
+                "diskHits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRatio": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memoryEntries": len(self._memory),
+            }
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache | None:
+    """
+    يعيد ذاكرة الردود المشتركة، أو None إذا كانت معطلة من الإعدادات.
+    """
+    global _response_cache
+    if not AI_CACHE_ENABLED:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(AI_CACHE_PATH, AI_CACHE_MEMORY_ENTRIES, AI_CACHE_TTL, AI_CACHE_MAX_BYTES)
+        return _response_cache
+
+
+def _cache_lookup_samples() -> list:
+    stats = _response_cache.stats() if _response_cache is not None else {"memoryHits": 0, "diskHits": 0, "misses": 0}
+    return [({"result": "memory_hit"}, stats["memoryHits"]), ({"result": "disk_hit"}, stats["diskHits"]), ({"result": "miss"}, stats["misses"])]
+
+
+# العدادات موجودة في ResponseCache أصلا وتقرأ عند طلب /metrics فقط
+registry.callback("ai_cache_lookups_total", "AI response cache lookups by result.", _cache_lookup_samples, "counter")
+registry.callback("ai_cache_hit_ratio", "Share of AI response cache lookups served from memory or disk.",
+                  lambda: _response_cache.stats()["hitRatio"] if _response_cache is not None else 0.0)
@@ -1,24 +1,74 @@
 import requests
+import hashlib
 import json
-from config import GEMINI_API_KEY, IMAGEN_API_KEY
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    GEMINI_API_KEY, IMAGEN_API_KEY, AI_FORMAT_CHUNK_CHARS, AI_FORMAT_CONCURRENCY, GEMINI_API_BASE_URL, IMAGEN_API_URL, COVER_PLACEHOLDER_URL,
+    MANUSCRIPT_ANALYSIS_TOKEN_BUDGET, MANUSCRIPT_ANALYSIS_CACHE_ENTRIES
+)
+from script_chunker import split_script_into_chunks
+from ai_cache import get_response_cache, make_cache_key
+from style_index import get_style_index
+from token_budget import prompt_budget, representative_excerpt
+from http_client import post_json
+from single_flight import SingleFlight
+from rate_limit import with_request_class
 
-# نقطة نهاية API لنموذج Gemini (يمكن تغييرها الى gemini-pro اذا كنت تملك صلاحية الوصول)
+# نقطة نهاية API لنموذج Gemini معرفة في config.py (GEMINI_API_BASE_URL)
 # تاكد من ان مفتاح API الخاص بك يدعم النموذج الذي تختاره
-GEMINI_API_BASE_URL = "[https://generativelanguage.googleapis.com/v1beta/models/](https://generativelanguage.googleapis.com/v1beta/models/)"
 MODEL_NAME_TEXT = "gemini-pro" # تم التغيير الى gemini-pro لدعم النصوص الطويلة
-MODEL_NAME_IMAGE_GEN_PROMPT = "gemini-pro" # نموذج لتوليد وصف الصورة
-MODEL_NAME_STYLE_SUGGESTION = "gemini-pro" # نموذج لاقتراح الانماط
+MODEL_NAME_MANUSCRIPT_ANALYSIS = "gemini-pro" # نموذج التحليل الموحد (وصف الغلاف، نص الغلاف الخلفي، الانماط)
+MODEL_NAME_STYLE_SUGGESTION = "gemini-pro" # نموذج لاقتراح الانماط من وصف قصير للكتاب
 
-# نقطة نهاية API لنموذج Imagen (لتوليد الصور)
-IMAGEN_API_URL = "[https://generativelanguage.googleapis.com/v1beta/models/imagen-3.0-generate-002:predict](https://generativelanguage.googleapis.com/v1beta/models/imagen-3.0-generate-002:predict)"
+# نقطة نهاية API لنموذج Imagen (لتوليد الصور) معرفة في config.py (IMAGEN_API_URL)
 
-def _call_gemini_api(prompt_content: list, model_name: str, response_mime_type: str = "text/plain", response_schema: dict = None) -> str | dict:
+# صورة الغلاف البديلة عند تعذر توليد صورة معرفة في config.py (COVER_PLACEHOLDER_URL)
+
+# الرد الثابت عند فشل الدردشة مع Gemini
+CHAT_ERROR_REPLY = "عذرا، حدث خطأ اثناء الدردشة مع الذكاء الاصطناعي."
+
+# خيوط تنسيق أجزاء المخطوطة بالتوازي، حجمها يحدد درجة التوازي مع Gemini
+_format_executor = ThreadPoolExecutor(max_workers=AI_FORMAT_CONCURRENCY, thread_name_prefix="format-chunk")
+
+# الطلبات المتطابقة المتزامنة (نقرتان على "توليد"، أو الواجهة والدردشة معا) تشترك في طلب واحد
+_gemini_flight = SingleFlight("gemini")
+_imagen_flight = SingleFlight("imagen")
+
+_CODE_FENCE_RE = re.compile(r'^\s*```(?:html)?\s*|\s*```\s*$', re.IGNORECASE)
+_LEADING_H1_RE = re.compile(r'^\s*<h1[^>]*>(.*?)</h1>\s*', re.IGNORECASE | re.DOTALL)
+
+def _call_gemini_api(prompt_content: list, model_name: str, response_mime_type: str = "text/plain", response_schema: dict = None, use_cache: bool = True) -> str | dict:
     """
     وظيفة مساعدة لاستدعاء Gemini API.
+    الردود تخزن مؤقتا بمفتاح من النموذج والمحتوى ونوع الرد والمخطط، فالطلب المتكرر لا يصل إلى Gemini،
+    والطلب المطابق لطلب جار ينتظر نتيجته بدل إرسال طلب ثان.
     """
     if not GEMINI_API_KEY:
         raise ValueError(f"Gemini API key not found for model {model_name}.")
 
+    cache_key = make_cache_key(model_name, prompt_content, response_mime_type, response_schema)
+    cache = get_response_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+    return _gemini_flight.do(cache_key, _request_and_cache_gemini, cache, cache_key, prompt_content, model_name, response_mime_type, response_schema)
+
+def _request_and_cache_gemini(cache, cache_key: str, prompt_content: list, model_name: str, response_mime_type: str, response_schema: dict | None) -> str | dict:
+    result = _request_gemini(prompt_content, model_name, response_mime_type, response_schema)
+    if cache is not None:
+        cache.put(cache_key, result)
+    return result
+
+# بناء الطلبات وتحليل الردود مشترك بين هذه الوظائف المتزامنة ونسختها غير المتزامنة (ai_services_async)
+
+def _user_prompt(text: str) -> list:
+    return [{"role": "user", "parts": [{"text": text}]}]
+
+def _gemini_payload(prompt_content: list, response_mime_type: str, response_schema: dict | None) -> dict:
     payload = {"contents": prompt_content}
     if response_mime_type == "application/json" and response_schema:
         payload["generationConfig"] = {
@@ -29,26 +79,48 @@ def _call_gemini_api(prompt_content: list, model_name: str, response_mime_type:
         payload["generationConfig"] = {
             "responseMimeType": response_mime_type
         }
+    return payload
+
+def _gemini_url(model_name: str, method: str = "generateContent") -> str:
+    return f"{GEMINI_API_BASE_URL}{model_name}:{method}"
+
+def _parse_gemini_result(result: dict, model_name: str, response_mime_type: str) -> str | dict:
+    """
+    يستخرج نص الرد (أو JSON المحلل) من رد generateContent، ويرفع استثناء إن لم يحمل ردا.
+    """
+    if result.get('candidates') and result['candidates'][0].get('content') and result['candidates'][0]['content'].get('parts'):
+        text_output = result['candidates'][0]['content']['parts'][0].get('text', '').strip()
+        if response_mime_type == "application/json":
+            return json.loads(text_output)
+        return text_output
+    print(f"فشل الحصول على رد من Gemini ({model_name}): {result}")
+    # تفاصيل الخطا من API Google
+    error_details = result.get('error', {}).get('message', 'تفاصيل غير متوفرة.')
+    raise Exception(f"فشل الحصول على رد من Gemini: {error_details}")
+
+def _sse_texts(line: str) -> list:
+    """
+    الأجزاء النصية في سطر SSE واحد من streamGenerateContent ("data: {...}").
+    """
+    if not line or not line.startswith("data:"):
+        return []
+    chunk = json.loads(line[len("data:"):].strip())
+    candidates = chunk.get('candidates') or []
+    if not candidates:
+        return []
+    return [part['text'] for part in candidates[0].get('content', {}).get('parts', []) if part.get('text')]
 
-    headers = {'Content-Type': 'application/json'}
+def _request_gemini(prompt_content: list, model_name: str, response_mime_type: str, response_schema: dict | None) -> str | dict:
+    """
+    يرسل الطلب فعليا إلى Gemini API ويحلل الرد.
+    """
+    payload = _gemini_payload(prompt_content, response_mime_type, response_schema)
     params = {'key': GEMINI_API_KEY}
-    api_url = f"{GEMINI_API_BASE_URL}{model_name}:generateContent"
 
     try:
-        response = requests.post(api_url, headers=headers, params=params, data=json.dumps(payload))
-        response.raise_for_status() # رفع استثناء للاكواد 4xx/5xx
-
-        result = response.json()
-        if result.get('candidates') and result['candidates'][0].get('content') and result['candidates'][0]['content'].get('parts'):
-            text_output = result['candidates'][0]['content']['parts'][0].get('text', '').strip()
-            if response_mime_type == "application/json":
-                return json.loads(text_output)
-            return text_output
-        else:
-            print(f"فشل الحصول على رد من Gemini ({model_name}): {result}")
-            # تفاصيل الخطا من API Google
-            error_details = result.get('error', {}).get('message', 'تفاصيل غير متوفرة.')
-            raise Exception(f"فشل الحصول على رد من Gemini: {error_details}")
+        # جلسة مشتركة مع مهلات وإعادة محاولة وقاطع دائرة، وترفع استثناء للاكواد 4xx/5xx
+        response = post_json("gemini", _gemini_url(model_name), payload, params=params)
+        return _parse_gemini_result(response.json(), model_name, response_mime_type)
 
     except requests.exceptions.RequestException as e:
         print(f"خطا في الاتصال بـ Gemini API ({model_name}): {e}")
@@ -60,53 +132,35 @@ def _call_gemini_api(prompt_content: list, model_name: str, response_mime_type:
         print(f"خطا غير متوقع اثناء استدعاء Gemini API ({model_name}): {e}")
         raise Exception(f"خطا غير متوقع اثناء استدعاء Gemini API: {e}")
 
+# وصف الغلاف المستخدم عند فشل توليده
+DEFAULT_COVER_PROMPT = "A beautiful abstract book cover with subtle colors."
+
 def generate_cover_prompt_from_script(script_text: str) -> str:
     """
-    يولد وصفا لغلاف كتاب باستخدام نموذج Gemini بناء على نص الكتاب.
+    يولد وصفا لغلاف كتاب بناء على نص الكتاب، من تحليل المخطوطة الموحد.
     """
-    try:
-        prompt = f"""
-        Generate a concise, creative, and highly descriptive prompt for the FRONT book cover based on the following book script.
-        Focus on key visual themes, mood, central elements, and artistic style. This prompt will be used by an advanced AI image generation model like Imagen.
-        The prompt should be in English and directly usable.
+    analysis = analyze_manuscript(script_text)
+    return (analysis or {}).get("front_cover_prompt") or DEFAULT_COVER_PROMPT
 
-        Book script excerpt:
-        ---
-        {script_text[:10000]} # Limit input to avoid token limits. If content is longer, provide a summary.
-        ---
-        """
-        return _call_gemini_api([{"role": "user", "parts": [{"text": prompt}]}], MODEL_NAME_IMAGE_GEN_PROMPT)
-    except Exception as e:
-        print(f"Error generating front cover prompt: {e}")
-        return "A beautiful abstract book cover with subtle colors."
+def _imagen_payload(image_prompt: str) -> dict:
+    return {
+        "instances": {"prompt": image_prompt},
+        "parameters": {"sampleCount": 1}
+    }
 
-def generate_front_back_cover_prompts(book_content: str) -> dict:
-    """
-    يولد وصفا للغلاف الامامي والخلفي باستخدام نموذج Gemini بناء على محتوى الكتاب.
-    """
-    try:
-        prompt = f"""
-        You are a creative book cover designer AI. Based on the following book content, generate two distinct, concise, and compelling prompts:
-        1.  `front_cover_prompt`: A prompt suitable for an AI image generation model (like Imagen) for the FRONT cover. Focus on key visual themes, mood, and central elements.
-        2.  `back_cover_text`: A short, engaging summary or blurb for the BACK cover. This should entice readers and capture the essence of the book. It should be plain text, suitable for print.
+def _parse_imagen_result(result: dict) -> str:
+    if result.get('predictions') and result['predictions'][0].get('bytesBase64Encoded'):
+        return f"data:image/png;base64,{result['predictions'][0]['bytesBase64Encoded']}"
+    print(f"فشل في توليد الصورة من الوصف: {result}")
+    return COVER_PLACEHOLDER_URL
 
-        Provide the output as a JSON object with keys "front_cover_prompt" and "back_cover_text".
-        Book Content:
-        ---
-        {book_content[:4000]} # Limit content to avoid token limits
-        ---
-        """
-        response_schema = {
-            "type": "OBJECT",
-            "properties": {
-                "front_cover_prompt": {"type": "STRING"},
-                "back_cover_text": {"type": "STRING"}
-            }
-        }
-        return _call_gemini_api([{"role": "user", "parts": [{"text": prompt}]}], MODEL_NAME_IMAGE_GEN_PROMPT, response_mime_type="application/json", response_schema=response_schema)
-    except Exception as e:
-        print(f"Error generating front/back cover prompts: {e}")
-        return {"front_cover_prompt": "A generic front cover", "back_cover_text": "A generic back cover summary."}
+def _imagen_request_key(image_prompt: str) -> str:
+    return hashlib.sha256(f"{IMAGEN_API_URL}\n{image_prompt}".encode('utf-8')).hexdigest()
+
+def _request_image(image_prompt: str) -> str:
+    params = {'key': IMAGEN_API_KEY}
+    response = post_json("imagen", IMAGEN_API_URL, _imagen_payload(image_prompt), params=params)
+    return _parse_imagen_result(response.json())
 
 def generate_image_from_prompt(image_prompt: str) -> str:
     """
@@ -115,32 +169,17 @@ def generate_image_from_prompt(image_prompt: str) -> str:
     """
     if not IMAGEN_API_KEY:
         print("Warning: Imagen API key not found. Using placeholder image.")
-        return "[https://placehold.co/600x800/E0E0E0/333333?text=Cover+Placeholder](https://placehold.co/600x800/E0E0E0/333333?text=Cover+Placeholder)"
+        return COVER_PLACEHOLDER_URL
 
     try:
-        payload = {
-            "instances": {"prompt": image_prompt},
-            "parameters": {"sampleCount": 1}
-        }
-        headers = {'Content-Type': 'application/json'}
-        params = {'key': IMAGEN_API_KEY}
-
-        response = requests.post(IMAGEN_API_URL, headers=headers, params=params, data=json.dumps(payload))
-        response.raise_for_status()
-
-        result = response.json()
-        if result.get('predictions') and result['predictions'][0].get('bytesBase64Encoded'):
-            return f"data:image/png;base64,{result['predictions'][0]['bytesBase64Encoded']}"
-        else:
-            print(f"فشل في توليد الصورة من الوصف: {result}")
-            return "[https://placehold.co/600x800/E0E0E0/333333?text=Cover+Placeholder](https://placehold.co/600x800/E0E0E0/333333?text=Cover+Placeholder)"
+        return _imagen_flight.do(_imagen_request_key(image_prompt), _request_image, image_prompt)
 
     except requests.exceptions.RequestException as e:
         print(f"خطأ في الاتصال بـ Imagen API (generate_image_from_prompt): {e}")
-        return "[https://placehold.co/600x800/E0E0E0/333333?text=Cover+Placeholder](https://placehold.co/600x800/E0E0E0/333333?text=Cover+Placeholder)"
+        return COVER_PLACEHOLDER_URL
     except Exception as e:
         print(f"خطأ غير متوقع أثناء توليد الصورة: {e}")
-        return "[https://placehold.co/600x800/E0E0E0/333333?text=Cover+Placeholder](https://placehold.co/600x800/E0E0E0/333333?text=Cover+Placeholder)"
+        return COVER_PLACEHOLDER_URL
 
 def chat_with_gemini(message: str, chat_history: list) -> str:
     """
@@ -148,108 +187,177 @@ def chat_with_gemini(message: str, chat_history: list) -> str:
     """
     try:
         # إضافة الرسالة الجديدة إلى سجل الدردشة
-        full_chat_history = chat_history + [{"role": "user", "parts": [{"text": message}]}]
-        return _call_gemini_api(full_chat_history, MODEL_NAME_TEXT)
+        full_chat_history = chat_history + _user_prompt(message)
+        # لا نستخدم الذاكرة المؤقتة في الدردشة حتى لا تتكرر الإجابة نفسها عند إعادة السؤال
+        return _call_gemini_api(full_chat_history, MODEL_NAME_TEXT, use_cache=False)
     except Exception as e:
         print(f"Error chatting with Gemini: {e}")
-        return "عذرا، حدث خطأ اثناء الدردشة مع الذكاء الاصطناعي."
+        return CHAT_ERROR_REPLY
 
-def suggest_book_style_settings(book_description: str) -> dict:
+def _chat_transcript(turns: list) -> str:
+    return "\n".join(
+        f"{'المستخدم' if turn.get('role') == 'user' else 'المساعد'}: {''.join(part.get('text', '') for part in turn.get('parts', []))}"
+        for turn in turns
+    )
+
+def _summary_prompt(previous_summary: str, transcript: str) -> str:
+    return f"""
+        Update the running summary of a conversation between a user and a book-writing assistant.
+        Keep every fact, decision, name, preference and open request that later turns may rely on. Drop greetings and filler.
+        Write the summary in the same language as the conversation, in at most 200 words, as plain text.
+
+        Current summary (may be empty):
+        ---
+        {previous_summary}
+        ---
+
+        New turns to fold into the summary:
+        ---
+        {transcript}
+        ---
+        """
+
+def summarize_chat_turns(previous_summary: str, turns: list) -> str:
+    """
+    يدمج أدوار دردشة قديمة في ملخص موجز يحل محلها في السياق المرسل إلى Gemini.
+    """
+    transcript = _chat_transcript(turns)
+    try:
+        return _call_gemini_api(_user_prompt(_summary_prompt(previous_summary, transcript)), MODEL_NAME_TEXT)
+    except Exception as e:
+        print(f"Error summarizing chat history: {e}")
+        # عند الفشل نحتفظ بنهاية النص الحرفي بدل فقدان السياق
+        return f"{previous_summary}\n{transcript}".strip()[-2000:]
+
+def stream_chat_with_gemini(message: str, chat_history: list):
     """
-    يقترح إعدادات تصميم كتاب (ألوان، خطوط، هوامش) باستخدام نموذج Gemini
-    بناءً على وصف الكتاب.
+    يتفاعل مع نموذج Gemini للدردشة ويعيد الرد على دفعات نصية فور وصولها
+    (streamGenerateContent بصيغة SSE)، دون انتظار اكتمال الرد.
     """
+    if not GEMINI_API_KEY:
+        raise ValueError(f"Gemini API key not found for model {MODEL_NAME_TEXT}.")
+
+    full_chat_history = chat_history + _user_prompt(message)
+    params = {'key': GEMINI_API_KEY, 'alt': 'sse'}
+    api_url = _gemini_url(MODEL_NAME_TEXT, "streamGenerateContent")
+    response = post_json("gemini", api_url, {"contents": full_chat_history}, params=params, stream=True)
     try:
-        prompt = f"""
+        for line in response.iter_lines(decode_unicode=True):
+            # كل حدث SSE من Gemini سطر "data: {...}" يحمل جزءا من الرد
+            yield from _sse_texts(line)
+    finally:
+        response.close()
+
+STYLE_SETTINGS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "textColor": {"type": "STRING"},
+        "backgroundColor": {"type": "STRING"},
+        "fontFamily": {"type": "STRING"},
+        "fontSize": {"type": "STRING"},
+        "lineHeight": {"type": "STRING"},
+        "textAlign": {"type": "STRING"},
+        "titleColor": {"type": "STRING"},
+        "titleFontSize": {"type": "STRING"},
+        "pageMarginTop": {"type": "STRING"},
+        "pageMarginBottom": {"type": "STRING"},
+        "pageMarginLeft": {"type": "STRING"},
+        "pageMarginRight": {"type": "STRING"},
+        "paragraphSpacing": {"type": "STRING"},
+        "paragraphIndent": {"type": "STRING"},
+        "heading1FontSize": {"type": "STRING"},
+        "heading2FontSize": {"type": "STRING"},
+        "headingColor": {"type": "STRING"},
+        "heading1Alignment": {"type": "STRING"},
+        "heading2Alignment": {"type": "STRING"},
+        "headerFontSize": {"type": "STRING"},
+        "footerFontSize": {"type": "STRING"},
+        "headerColor": {"type": "STRING"},
+        "footerColor": {"type": "STRING"},
+        "coverWidth": {"type": "STRING"},
+        "coverHeight": {"type": "STRING"},
+        "coverBorderRadius": {"type": "STRING"},
+        "coverShadow": {"type": "STRING"},
+        "imageAlignment": {"type": "STRING"},
+        "backCoverFontSize": {"type": "STRING"},
+        "backCoverTextColor": {"type": "STRING"},
+        "backCoverBackgroundColor": {"type": "STRING"}
+    }
+}
+
+def _style_prompt(book_description: str) -> str:
+    return f"""
         Based on the following book description, suggest a JSON object containing professional design settings for a book PDF.
-        The settings should include:
-        - textColor (hex code)
-        - backgroundColor (hex code)
-        - fontFamily (e.g., 'Inter' or 'Amiri' for Arabic)
-        - fontSize (e.g., '12pt')
-        - lineHeight (e.g., '1.5')
-        - textAlign (e.g., 'right', 'left', 'center', 'justify')
-        - titleColor (hex code)
-        - titleFontSize (e.g., '36pt')
-        - pageMarginTop (e.g., '20mm')
-        - pageMarginBottom (e.g., '20mm')
-        - pageMarginLeft (e.g., '25mm')
-        - pageMarginRight (e.g., '25mm')
-        - paragraphSpacing (e.g., '1em')
-        - paragraphIndent (e.g., '1.5em')
-        - heading1FontSize (e.g., '24pt')
-        - heading2FontSize (e.g., '18pt')
-        - headingColor (hex code)
-        - heading1Alignment (e.g., 'center')
-        - heading2Alignment (e.g., 'right')
-        - headerFontSize (e.g., '10pt')
-        - footerFontSize (e.g., '10pt')
-        - headerColor (hex code)
-        - footerColor (hex code)
-        - coverWidth (e.g., '80%')
-        - coverHeight (e.g., '70%')
-        - coverBorderRadius (e.g., '15px')
-        - coverShadow (e.g., '0 10px 20px rgba(0,0,0,0.25)')
-        - imageAlignment (e.g., 'center')
-        - backCoverFontSize (e.g., '12pt')
-        - backCoverTextColor (hex code)
-        - backCoverBackgroundColor (hex code)
+        The settings should include all of these keys:
+        textColor, backgroundColor, titleColor, headingColor, headerColor, footerColor, backCoverTextColor, backCoverBackgroundColor (hex codes);
+        fontFamily (e.g., 'Inter' or 'Amiri' for Arabic); fontSize (e.g., '12pt'); lineHeight (e.g., '1.5');
+        textAlign, heading1Alignment, heading2Alignment, imageAlignment (e.g., 'right', 'left', 'center', 'justify');
+        titleFontSize (e.g., '36pt'); heading1FontSize (e.g., '24pt'); heading2FontSize (e.g., '18pt');
+        headerFontSize, footerFontSize, backCoverFontSize (e.g., '10pt');
+        pageMarginTop, pageMarginBottom, pageMarginLeft, pageMarginRight (e.g., '20mm');
+        paragraphSpacing (e.g., '1em'); paragraphIndent (e.g., '1.5em');
+        coverWidth (e.g., '80%'); coverHeight (e.g., '70%'); coverBorderRadius (e.g., '15px'); coverShadow (e.g., '0 10px 20px rgba(0,0,0,0.25)').
 
         Ensure the JSON is valid and contains all these keys.
-        Book description: "{book_description[:2000]}..." # تم زيادة حد الوصف
+        Book description: "{book_description[:2000]}..."
         """
-        response_schema = {
-            "type": "OBJECT",
-            "properties": {
-                "textColor": {"type": "STRING"},
-                "backgroundColor": {"type": "STRING"},
-                "fontFamily": {"type": "STRING"},
-                "fontSize": {"type": "STRING"},
-                "lineHeight": {"type": "STRING"},
-                "textAlign": {"type": "STRING"},
-                "titleColor": {"type": "STRING"},
-                "titleFontSize": {"type": "STRING"},
-                "pageMarginTop": {"type": "STRING"},
-                "pageMarginBottom": {"type": "STRING"},
-                "pageMarginLeft": {"type": "STRING"},
-                "pageMarginRight": {"type": "STRING"},
-                "paragraphSpacing": {"type": "STRING"},
-                "paragraphIndent": {"type": "STRING"},
-                "heading1FontSize": {"type": "STRING"},
-                "heading2FontSize": {"type": "STRING"},
-                "headingColor": {"type": "STRING"},
-                "heading1Alignment": {"type": "STRING"},
-                "heading2Alignment": {"type": "STRING"},
-                "headerFontSize": {"type": "STRING"},
-                "footerFontSize": {"type": "STRING"},
-                "headerColor": {"type": "STRING"},
-                "footerColor": {"type": "STRING"},
-                "coverWidth": {"type": "STRING"},
-                "coverHeight": {"type": "STRING"},
-                "coverBorderRadius": {"type": "STRING"},
-                "coverShadow": {"type": "STRING"},
-                "imageAlignment": {"type": "STRING"},
-                "backCoverFontSize": {"type": "STRING"},
-                "backCoverTextColor": {"type": "STRING"},
-                "backCoverBackgroundColor": {"type": "STRING"}
-            }
-        }
-        return _call_gemini_api([{"role": "user", "parts": [{"text": prompt}]}], MODEL_NAME_STYLE_SUGGESTION, response_mime_type="application/json", response_schema=response_schema)
+
+def _indexed_style(index_text: str, suggest) -> dict:
+    """
+    إعدادات نص قريب من نص سابق من الفهرس المحلي دون طلب Gemini، وإلا suggest() ثم حفظها في الفهرس.
+    """
+    style_index = get_style_index()
+    if style_index is not None:
+        cached_settings = style_index.lookup(index_text)
+        if cached_settings is not None:
+            return cached_settings
+
+    settings = suggest()
+    if style_index is not None and settings:
+        style_index.add(index_text, settings)
+    return settings
+
+def _described_style(book_description: str) -> dict:
+    try:
+        settings = _call_gemini_api(_user_prompt(_style_prompt(book_description)), MODEL_NAME_STYLE_SUGGESTION, response_mime_type="application/json", response_schema=STYLE_SETTINGS_SCHEMA)
+        return settings if isinstance(settings, dict) else {}
     except Exception as e:
         print(f"Error suggesting style settings: {e}")
         return {}
 
-def format_book_script_with_ai(raw_script: str) -> str:
+def suggest_book_style_settings(book_description: str) -> dict:
     """
-    يأخذ نصًا خامًا ويقوم بتنسيقه إلى HTML منظم باستخدام نموذج Gemini.
+    يقترح إعدادات تصميم كتاب (ألوان، خطوط، هوامش) باستخدام نموذج Gemini بناءً على وصف قصير للكتاب.
+    الأوصاف القريبة من وصف سابق تعاد إعداداته من الفهرس المحلي دون طلب Gemini.
     """
-    if not GEMINI_API_KEY:
-        print("Warning: Gemini API key not found. Cannot format script with AI.")
-        return f"<div dir='rtl' style='text-align: right;'><p>{raw_script}</p></div>"
+    return _indexed_style(book_description, lambda: _described_style(book_description))
 
-    try:
-        # تم توسيع التعليمات لنموذج الذكاء الاصطناعي لإنتاج HTML أفضل
-        prompt = f"""
+def suggest_style_from_manuscript(manuscript: str) -> dict:
+    """
+    مثل suggest_book_style_settings لنص الكتاب كاملا: الإعدادات من تحليل المخطوطة الموحد،
+    فطلب النمط وأوصاف الغلاف للكتاب نفسه يخدمهما طلب Gemini واحد.
+    """
+    # الفهرس يقارن المقتطف المضغوط لا الكتاب كله، فيبقى البحث سريعا لأي طول
+    excerpt = _analysis_excerpt(manuscript)
+    return _indexed_style(excerpt, lambda: _analysis_style(analyze_manuscript(manuscript, excerpt)))
+
+def _build_format_prompt(script_text: str, chapter_title: str = "", continues_chapter: bool = False) -> str:
+    """
+    يبني تعليمات تنسيق جزء من النص إلى HTML.
+    عند continues_chapter تضاف ملاحظة تحافظ على تسلسل العناوين عبر حدود الأجزاء.
+    """
+    continuation_note = ""
+    if continues_chapter and chapter_title:
+        continuation_note = (
+            f'Note: this excerpt continues the chapter titled "{chapter_title}" from the previous part of the book. '
+            f'Do NOT start with an `<h1>` for that chapter and do not repeat its title; continue directly with `<h2>`, `<h3>` and `<p>` as appropriate.\n\n        '
+        )
+    elif continues_chapter:
+        continuation_note = (
+            'Note: this excerpt continues from the previous part of the book. Do NOT invent a chapter title for it.\n\n        '
+        )
+    # تم توسيع التعليمات لنموذج الذكاء الاصطناعي لإنتاج HTML أفضل
+    return f"""
         You are a highly skilled professional book formatter and layout designer.
         Your task is to convert the following raw book script into perfectly structured and semantically rich HTML, optimized for PDF generation.
         Follow these strict guidelines:
@@ -270,9 +378,9 @@ def format_book_script_with_ai(raw_script: str) -> str:
         6.  **Remove any markdown-like backticks or formatting indicators:** Ensure the output is pure HTML.
         7.  **Handle line breaks:** Convert significant double line breaks into new paragraphs, and single line breaks within paragraphs should be treated as soft breaks (or just part of the flow).
 
-        Raw Book Script (limit to first 5000 characters for processing):
+        {continuation_note}Raw Book Script:
         ---
-        {raw_script[:5000]}
+        {script_text}
         ---
 
         Example of desired HTML structure:
@@ -300,39 +408,189 @@ def format_book_script_with_ai(raw_script: str) -> str:
         }}
         </code></pre>
         """
-        return _call_gemini_api([{"role": "user", "parts": [{"text": prompt}]}], MODEL_NAME_TEXT)
+
+# سمة تميز النص المغلف دون تنسيق (عند فشل Gemini أو غياب المفتاح)، فلا يحفظ كتاب منه كنتيجة دائمة
+UNFORMATTED_MARKER = "data-unformatted"
+
+def _plain_html_fallback(raw_script: str) -> str:
+    return f"<div dir='rtl' {UNFORMATTED_MARKER} style='text-align: right;'><p>{raw_script}</p></div>"
+
+def is_unformatted_html(html: str) -> bool:
+    """
+    هل HTML (كله أو أحد أجزائه) نص خام مغلف بدل نتيجة تنسيق من AI.
+    """
+    return f"<div dir='rtl' {UNFORMATTED_MARKER} " in html
+
+def _strip_code_fences(html: str) -> str:
+    """
+    يزيل علامات ```html التي قد يحيط بها النموذج الناتج رغم التعليمات.
+    """
+    return _CODE_FENCE_RE.sub('', html).strip()
+
+def _drop_repeated_chapter_heading(html: str, chapter_title: str) -> str:
+    """
+    يحذف <h1> مكررا لعنوان الفصل في بداية جزء يكمل ذلك الفصل.
+    """
+    match = _LEADING_H1_RE.match(html)
+    if match and chapter_title and re.sub(r'<[^>]+>', '', match.group(1)).strip() == chapter_title:
+        return html[match.end():].lstrip()
+    return html
+
+def _chunk_prompt(chunk: dict) -> list:
+    return _user_prompt(_build_format_prompt(chunk["text"], chunk["chapter_title"], chunk["continues_chapter"]))
+
+def _finish_formatted_chunk(chunk: dict, html: str) -> str:
+    html = _strip_code_fences(html)
+    if chunk["continues_chapter"]:
+        html = _drop_repeated_chapter_heading(html, chunk["chapter_title"])
+    return html
+
+def _single_chunk(raw_script: str) -> dict:
+    return {"index": 0, "text": raw_script, "chapter_title": "", "continues_chapter": False}
+
+def _format_chunk(chunk: dict) -> str:
+    """
+    ينسق جزءا واحدا من المخطوطة، ويعود للنص الخام المغلف عند الفشل حتى لا يضيع المحتوى.
+    """
+    try:
+        return _finish_formatted_chunk(chunk, _call_gemini_api(_chunk_prompt(chunk), MODEL_NAME_TEXT))
     except Exception as e:
-        print(f"خطأ في الاتصال بـ Gemini API (format_book_script_with_ai): {e}")
-        return f"<div dir='rtl' style='text-align: right;'><p>{raw_script}</p></div>"
+        print(f"خطأ في تنسيق الجزء {chunk['index']} (format_book_script_with_ai): {e}")
+        return _plain_html_fallback(chunk["text"])
 
-def generate_front_back_cover_prompts(book_content: str) -> dict:
+def format_book_script_with_ai(raw_script: str) -> str:
     """
-    يولد وصفًا للغلاف الأمامي والخلفي باستخدام نموذج Gemini بناءً على محتوى الكتاب.
+    يأخذ نصًا خامًا ويقوم بتنسيقه إلى HTML منظم باستخدام نموذج Gemini.
+    المخطوطات الطويلة تقسم إلى أجزاء على حدود الفصول والفقرات وتنسق بالتوازي ثم تجمع بالترتيب.
     """
     if not GEMINI_API_KEY:
-        print("Warning: Gemini API key not found. Cannot generate cover descriptions.")
-        return {"front_cover_prompt": "A generic front cover", "back_cover_text": "A generic back cover summary."}
+        print("Warning: Gemini API key not found. Cannot format script with AI.")
+        return _plain_html_fallback(raw_script)
 
-    try:
-        prompt = f"""
-        You are a creative book cover designer AI. Based on the following book content, generate two distinct, concise, and compelling prompts:
-        1.  `front_cover_prompt`: A prompt suitable for an AI image generation model (like Imagen) for the FRONT cover. Focus on key visual themes, mood, and central elements.
+    chunks = split_script_into_chunks(raw_script, AI_FORMAT_CHUNK_CHARS)
+    if len(chunks) <= 1:
+        return _format_chunk(_single_chunk(raw_script))
+
+    # executor.map يحافظ على ترتيب الأجزاء مهما كان ترتيب انتهائها
+    formatted_chunks = list(_format_executor.map(with_request_class(_format_chunk), chunks))
+    return "\n".join(formatted_chunks)
+
+# أوصاف الغلافين المستخدمة عند فشل توليدها
+DEFAULT_COVER_PROMPTS = {"front_cover_prompt": "A generic front cover", "back_cover_text": "A generic back cover summary."}
+
+FRONT_BACK_COVER_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "front_cover_prompt": {"type": "STRING"},
+        "back_cover_text": {"type": "STRING"}
+    }
+}
+
+# مخطط التحليل الموحد: وصفا الغلافين وإعدادات التصميم في رد واحد
+MANUSCRIPT_ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        **FRONT_BACK_COVER_SCHEMA["properties"],
+        "style": STYLE_SETTINGS_SCHEMA
+    }
+}
+
+# التحليلات الناجحة حسب بصمة المخطوطة (الأحدث استخداما في النهاية)، مشتركة مع ai_services_async
+_analysis_cache = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+def _analysis_excerpt(manuscript: str) -> str:
+    """
+    مقتطف ممثل للمخطوطة كلها (عناوين وبدايات الفصول وأغنى المقاطع) ضمن ميزانية التحليل.
+    """
+    budget = prompt_budget(MANUSCRIPT_ANALYSIS_TOKEN_BUDGET, _manuscript_analysis_prompt(""))
+    return representative_excerpt(manuscript, budget)
+
+def _analysis_key(manuscript: str) -> str:
+    material = f"{MANUSCRIPT_ANALYSIS_TOKEN_BUDGET}\n{manuscript}"
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+def _cached_analysis(key: str) -> dict | None:
+    with _analysis_cache_lock:
+        analysis = _analysis_cache.get(key)
+        if analysis is not None:
+            _analysis_cache.move_to_end(key)
+        return analysis
+
+def _remember_analysis(key: str, analysis) -> dict | None:
+    """
+    يحفظ التحليل إن كان صالحا (كائن فيه وصف الغلاف أو إعدادات التصميم) ويعيده، وإلا None.
+    """
+    if not isinstance(analysis, dict) or not (analysis.get("front_cover_prompt") or _analysis_style(analysis)):
+        return None
+    with _analysis_cache_lock:
+        _analysis_cache[key] = analysis
+        _analysis_cache.move_to_end(key)
+        while len(_analysis_cache) > MANUSCRIPT_ANALYSIS_CACHE_ENTRIES:
+            _analysis_cache.popitem(last=False)
+    return analysis
+
+def _analysis_style(analysis: dict | None) -> dict:
+    style = (analysis or {}).get("style")
+    return dict(style) if isinstance(style, dict) else {}
+
+def _manuscript_analysis_prompt(excerpt: str) -> str:
+    return f"""
+        You are a creative book designer AI. Based on the following book content, produce a single JSON object with:
+        1.  `front_cover_prompt`: A concise, creative, and highly descriptive prompt for the FRONT cover, suitable for an AI image generation model (like Imagen). Focus on key visual themes, mood, central elements, and artistic style. It should be in English and directly usable.
         2.  `back_cover_text`: A short, engaging summary or blurb for the BACK cover. This should entice readers and capture the essence of the book. It should be plain text, suitable for print.
+        3.  `style`: Professional design settings for the book PDF, with all of these keys:
+            textColor, backgroundColor, titleColor, headingColor, headerColor, footerColor, backCoverTextColor, backCoverBackgroundColor (hex codes);
+            fontFamily (e.g., 'Inter' or 'Amiri' for Arabic); fontSize (e.g., '12pt'); lineHeight (e.g., '1.5');
+            textAlign, heading1Alignment, heading2Alignment, imageAlignment (e.g., 'right', 'left', 'center', 'justify');
+            titleFontSize (e.g., '36pt'); heading1FontSize (e.g., '24pt'); heading2FontSize (e.g., '18pt');
+            headerFontSize, footerFontSize, backCoverFontSize (e.g., '10pt');
+            pageMarginTop, pageMarginBottom, pageMarginLeft, pageMarginRight (e.g., '20mm');
+            paragraphSpacing (e.g., '1em'); paragraphIndent (e.g., '1.5em');
+            coverWidth (e.g., '80%'); coverHeight (e.g., '70%'); coverBorderRadius (e.g., '15px'); coverShadow (e.g., '0 10px 20px rgba(0,0,0,0.25)').
 
-        Provide the output as a JSON object with keys "front_cover_prompt" and "back_cover_text".
+        Ensure the JSON is valid and contains all these keys.
+        The book content below is a representative excerpt sampled across the whole book (chapter headings, chapter openings
+        and key passages); "[...]" marks omitted text.
         Book Content:
         ---
-        {book_content[:4000]} # Limit content to avoid token limits
+        {excerpt}
         ---
         """
-        response_schema = {
-            "type": "OBJECT",
-            "properties": {
-                "front_cover_prompt": {"type": "STRING"},
-                "back_cover_text": {"type": "STRING"}
-            }
-        }
-        return _call_gemini_api([{"role": "user", "parts": [{"text": prompt}]}], MODEL_NAME_IMAGE_GEN_PROMPT, response_mime_type="application/json", response_schema=response_schema)
+
+def analyze_manuscript(manuscript: str, excerpt: str = None) -> dict | None:
+    """
+    يحلل المخطوطة في طلب Gemini واحد (وصف الغلاف الأمامي، نص الغلاف الخلفي، إعدادات التصميم)
+    من مقتطف ممثل لها، ويحفظ التحليل حسب بصمتها فتخدم وظائف الغلاف والنمط منه دون طلبات إضافية.
+    excerpt مقتطف محسوب مسبقا من _analysis_excerpt. يعيد None عند الفشل.
+    """
+    key = _analysis_key(manuscript)
+    analysis = _cached_analysis(key)
+    if analysis is not None:
+        return analysis
+    if excerpt is None:
+        excerpt = _analysis_excerpt(manuscript)
+    try:
+        analysis = _call_gemini_api(_user_prompt(_manuscript_analysis_prompt(excerpt)), MODEL_NAME_MANUSCRIPT_ANALYSIS,
+                                    response_mime_type="application/json", response_schema=MANUSCRIPT_ANALYSIS_SCHEMA)
     except Exception as e:
-        print(f"خطأ في الاتصال بـ Gemini API (generate_front_back_cover_prompts): {e}")
-        return {"front_cover_prompt": "A generic front cover", "back_cover_text": "A generic back cover summary."}
\ No newline at end of file
+        print(f"Error analyzing manuscript: {e}")
+        return None
+    return _remember_analysis(key, analysis)
+
+def _analysis_cover_prompts(analysis: dict | None) -> dict:
+    if not analysis or not analysis.get("front_cover_prompt"):
+        return dict(DEFAULT_COVER_PROMPTS)
+    return {
+        "front_cover_prompt": analysis["front_cover_prompt"],
+        "back_cover_text": analysis.get("back_cover_text") or DEFAULT_COVER_PROMPTS["back_cover_text"],
+    }
+
+def generate_front_back_cover_prompts(book_content: str) -> dict:
+    """
+    يولد وصفًا للغلاف الأمامي والخلفي بناءً على محتوى الكتاب، من تحليل المخطوطة الموحد.
+    """
+    if not GEMINI_API_KEY:
+        print("Warning: Gemini API key not found. Cannot generate cover descriptions.")
+        return dict(DEFAULT_COVER_PROMPTS)
+    return _analysis_cover_prompts(analyze_manuscript(book_content))
@@ -0,0 +1,209 @@
+"""
+نسخ غير متزامنة (async) من وظائف ai_services على عميل httpx مشترك، لوضع ASGI (asgi_app.py):
+آلاف طلبات Gemini المنتظرة تعمل على حلقة أحداث واحدة بدل خيط لكل طلب.
+التعليمات والمخططات وتحليل الردود مشتركة مع ai_services، فالنسختان ترسلان الطلبات نفسها وتتشاركان الذاكرة المؤقتة.
+"""
+import asyncio
+import json
+import httpx
+from config import GEMINI_API_KEY, IMAGEN_API_KEY, AI_FORMAT_CHUNK_CHARS, AI_FORMAT_CONCURRENCY, IMAGEN_API_URL, COVER_PLACEHOLDER_URL
+from script_chunker import split_script_into_chunks
+from ai_cache import get_response_cache, make_cache_key
+from style_index import get_style_index
+from http_client_async import async_post_json
+from ai_services import (
+    MODEL_NAME_TEXT, MODEL_NAME_MANUSCRIPT_ANALYSIS, MODEL_NAME_STYLE_SUGGESTION, STYLE_SETTINGS_SCHEMA, CHAT_ERROR_REPLY, DEFAULT_COVER_PROMPT, DEFAULT_COVER_PROMPTS, MANUSCRIPT_ANALYSIS_SCHEMA,
+    _gemini_flight, _imagen_flight, _imagen_request_key, _user_prompt, _gemini_payload, _gemini_url, _parse_gemini_result, _sse_texts,
+    _analysis_excerpt, _analysis_key, _cached_analysis, _remember_analysis, _analysis_style, _analysis_cover_prompts, _manuscript_analysis_prompt,
+    _imagen_payload, _parse_imagen_result, _chat_transcript, _summary_prompt, _style_prompt,
+    _chunk_prompt, _finish_formatted_chunk, _single_chunk, _plain_html_fallback
+)
+
+
+async def _off_loop(fn, *args):
+    """
+    ينفذ عملا متزامنا (قراءة وكتابة SQLite، حساب المقتطف أو المتجهات) في خيط، فلا يوقف قرص بطيء
+    أو حساب طويل كل طلبات الدردشة والبث على حلقة الأحداث.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+async def call_gemini_api(prompt_content: list, model_name: str, response_mime_type: str = "text/plain", response_schema: dict = None, use_cache: bool = True) -> str | dict:
+    """
+    مثل ai_services._call_gemini_api، والذاكرة المؤقتة تقرأ وتكتب خارج حلقة الأحداث.
+    """
+    if not GEMINI_API_KEY:
+        raise ValueError(f"Gemini API key not found for model {model_name}.")
+
+    cache_key = make_cache_key(model_name, prompt_content, response_mime_type, response_schema)
+    cache = get_response_cache() if use_cache else None
+    if cache is not None:
+        cached = await _off_loop(cache.get, cache_key)
+        if cached is not None:
+            return cached
+    return await _gemini_flight.do_async(cache_key, _request_and_cache_gemini, cache, cache_key, prompt_content, model_name, response_mime_type, response_schema)
+
+
+async def _request_and_cache_gemini(cache, cache_key: str, prompt_content: list, model_name: str, response_mime_type: str, response_schema: dict | None) -> str | dict:
+    result = await _request_gemini(prompt_content, model_name, response_mime_type, response_schema)
+    if cache is not None:
+        # put قد يحذف الأقدم (مسح SQLite كامل) عند تجاوز الحجم
+        await _off_loop(cache.put, cache_key, result)
+    return result
+
+
+async def _request_gemini(prompt_content: list, model_name: str, response_mime_type: str, response_schema: dict | None) -> str | dict:
+    payload = _gemini_payload(prompt_content, response_mime_type, response_schema)
+    try:
+        response = await async_post_json("gemini", _gemini_url(model_name), payload, params={'key': GEMINI_API_KEY})
+        return _parse_gemini_result(response.json(), model_name, response_mime_type)
+    except httpx.HTTPError as e:
+        print(f"خطا في الاتصال بـ Gemini API ({model_name}): {e}")
+        raise Exception(f"خطا في الاتصال بـ Gemini API: {e}")
+    except json.JSONDecodeError as e:
+        print(f"خطا في تحليل JSON من Gemini ({model_name}): {e}")
+        raise Exception(f"خطا في تحليل JSON من Gemini: {e}")
+
+
+async def analyze_manuscript(manuscript: str, excerpt: str = None) -> dict | None:
+    """
+    مثل ai_services.analyze_manuscript، والتحليلات المحفوظة مشتركة بين النسختين.
+    """
+    key = _analysis_key(manuscript)
+    analysis = _cached_analysis(key)
+    if analysis is not None:
+        return analysis
+    if excerpt is None:
+        # بناء المقتطف من كتاب كامل يأخذ عشرات الميلي ثانية
+        excerpt = await _off_loop(_analysis_excerpt, manuscript)
+    try:
+        analysis = await call_gemini_api(_user_prompt(_manuscript_analysis_prompt(excerpt)), MODEL_NAME_MANUSCRIPT_ANALYSIS,
+                                         response_mime_type="application/json", response_schema=MANUSCRIPT_ANALYSIS_SCHEMA)
+    except Exception as e:
+        print(f"Error analyzing manuscript: {e}")
+        return None
+    return _remember_analysis(key, analysis)
+
+
+async def generate_cover_prompt_from_script(script_text: str) -> str:
+    analysis = await analyze_manuscript(script_text)
+    return (analysis or {}).get("front_cover_prompt") or DEFAULT_COVER_PROMPT
+
+
+async def generate_front_back_cover_prompts(book_content: str) -> dict:
+    if not GEMINI_API_KEY:
+        print("Warning: Gemini API key not found. Cannot generate cover descriptions.")
+        return dict(DEFAULT_COVER_PROMPTS)
+    return _analysis_cover_prompts(await analyze_manuscript(book_content))
+
+
+async def _request_image(image_prompt: str) -> str:
+    response = await async_post_json("imagen", IMAGEN_API_URL, _imagen_payload(image_prompt), params={'key': IMAGEN_API_KEY})
+    return _parse_imagen_result(response.json())
+
+
+async def generate_image_from_prompt(image_prompt: str) -> str:
+    if not IMAGEN_API_KEY:
+        print("Warning: Imagen API key not found. Using placeholder image.")
+        return COVER_PLACEHOLDER_URL
+    try:
+        return await _imagen_flight.do_async(_imagen_request_key(image_prompt), _request_image, image_prompt)
+    except Exception as e:
+        print(f"خطأ أثناء توليد الصورة (generate_image_from_prompt): {e}")
+        return COVER_PLACEHOLDER_URL
+
+
+async def chat_with_gemini(message: str, chat_history: list) -> str:
+    try:
+        return await call_gemini_api(chat_history + _user_prompt(message), MODEL_NAME_TEXT, use_cache=False)
+    except Exception as e:
+        print(f"Error chatting with Gemini: {e}")
+        return CHAT_ERROR_REPLY
+
+
+async def summarize_chat_turns(previous_summary: str, turns: list) -> str:
+    transcript = _chat_transcript(turns)
+    try:
+        return await call_gemini_api(_user_prompt(_summary_prompt(previous_summary, transcript)), MODEL_NAME_TEXT)
+    except Exception as e:
+        print(f"Error summarizing chat history: {e}")
+        return f"{previous_summary}\n{transcript}".strip()[-2000:]
+
+
+async def stream_chat_with_gemini(message: str, chat_history: list):
+    """
+    مولد غير متزامن يعيد أجزاء رد Gemini فور وصولها (streamGenerateContent بصيغة SSE).
+    """
+    if not GEMINI_API_KEY:
+        raise ValueError(f"Gemini API key not found for model {MODEL_NAME_TEXT}.")
+
+    params = {'key': GEMINI_API_KEY, 'alt': 'sse'}
+    response = await async_post_json("gemini", _gemini_url(MODEL_NAME_TEXT, "streamGenerateContent"),
+                                     {"contents": chat_history + _user_prompt(message)}, params=params, stream=True)
+    try:
+        async for line in response.aiter_lines():
+            for text in _sse_texts(line):
+                yield text
+    finally:
+        await response.aclose()
+
+
+async def _indexed_style(index_text: str, suggest) -> dict:
+    style_index = get_style_index()
+    if style_index is not None:
+        # البحث والإضافة في فهرس الأنماط قراءة SQLite وحساب متجهات
+        cached_settings = await _off_loop(style_index.lookup, index_text)
+        if cached_settings is not None:
+            return cached_settings
+    settings = await suggest()
+    if style_index is not None and settings:
+        await _off_loop(style_index.add, index_text, settings)
+    return settings
+
+
+async def _described_style(book_description: str) -> dict:
+    try:
+        settings = await call_gemini_api(_user_prompt(_style_prompt(book_description)), MODEL_NAME_STYLE_SUGGESTION,
+                                         response_mime_type="application/json", response_schema=STYLE_SETTINGS_SCHEMA)
+        return settings if isinstance(settings, dict) else {}
+    except Exception as e:
+        print(f"Error suggesting style settings: {e}")
+        return {}
+
+
+async def suggest_book_style_settings(book_description: str) -> dict:
+    return await _indexed_style(book_description, lambda: _described_style(book_description))
+
+
+async def suggest_style_from_manuscript(manuscript: str) -> dict:
+    excerpt = await _off_loop(_analysis_excerpt, manuscript)
+
+    async def from_analysis() -> dict:
+        return _analysis_style(await analyze_manuscript(manuscript, excerpt))
+    return await _indexed_style(excerpt, from_analysis)
+
+
+async def _format_chunk(chunk: dict, semaphore: asyncio.Semaphore) -> str:
+    async with semaphore:
+        try:
+            return _finish_formatted_chunk(chunk, await call_gemini_api(_chunk_prompt(chunk), MODEL_NAME_TEXT))
+        except Exception as e:
+            print(f"خطأ في تنسيق الجزء {chunk['index']} (format_book_script_with_ai): {e}")
+            return _plain_html_fallback(chunk["text"])
+
+
+async def format_book_script_with_ai(raw_script: str) -> str:
+    """
+    مثل ai_services.format_book_script_with_ai: الأجزاء تنسق بالتوازي (حتى AI_FORMAT_CONCURRENCY لكل مخطوطة)
+    وتجمع بالترتيب.
+    """
+    if not GEMINI_API_KEY:
+        print("Warning: Gemini API key not found. Cannot format script with AI.")
+        return _plain_html_fallback(raw_script)
+
+    chunks = split_script_into_chunks(raw_script, AI_FORMAT_CHUNK_CHARS)
+    semaphore = asyncio.Semaphore(AI_FORMAT_CONCURRENCY)
+    if len(chunks) <= 1:
+        return await _format_chunk(_single_chunk(raw_script), semaphore)
+    # gather يحافظ على ترتيب الأجزاء مهما كان ترتيب انتهائها
+    return "\n".join(await asyncio.gather(*(_format_chunk(chunk, semaphore) for chunk in chunks)))
@@ -1,86 +1,226 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 import os
-import uuid
-from config import GEMINI_API_KEY # تم تصحيح استيراد مفتاح API
-from ai_services import generate_cover_prompt_from_script, generate_image_from_prompt, chat_with_gemini, suggest_book_style_settings, format_book_script_with_ai, generate_front_back_cover_prompts
-from pdf_generator import create_book_html, generate_pdf_from_html
+import json
+import mimetypes
+import re
+import time
+import zipfile
+from urllib.parse import urljoin
+from config import GEMINI_API_KEY, UPLOAD_FOLDER, USE_X_SENDFILE, X_ACCEL_REDIRECT_PREFIX, BATCH_MAX_BOOKS # تم تصحيح استيراد مفتاح API
+from ai_services import CHAT_ERROR_REPLY, chat_with_gemini, stream_chat_with_gemini, suggest_book_style_settings, suggest_style_from_manuscript, format_book_script_with_ai, generate_front_back_cover_prompts
+from book_pipeline import BOOK_STAGES, BookPipelineError, stored_pdf_path, book_spec_from_request, run_book_pipeline, iter_book_batch, run_book_batch
+from jobs import JobQueueFull, get_job_backend
+from chat_sessions import chat_session_store
+from cover_store import cover_path
+from drafts import save_formatted_draft, save_cover_draft
+from metrics import HTTP_SECONDS, registry
+from rate_limit import request_class_for, set_request_class
 
 app = Flask(__name__)
+app.config['USE_X_SENDFILE'] = USE_X_SENDFILE
 CORS(app)
 
-PDF_OUTPUT_DIR = os.path.join(UPLOAD_FOLDER, 'pdfs')
-if not os.path.exists(PDF_OUTPUT_DIR):
-    os.makedirs(PDF_OUTPUT_DIR)
+@app.before_request
+def start_request_timer():
+    g.request_started_at = time.perf_counter()
+    # هوية العميل وأولوية المسار لطابور حد معدل الخدمات الخارجية
+    set_request_class(*request_class_for(request.path, request.headers.get('X-Client-Id') or request.remote_addr))
+
+@app.after_request
+def record_request_metrics(response):
+    started_at = g.pop('request_started_at', None)
+    if started_at is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_SECONDS.observe(time.perf_counter() - started_at, endpoint=endpoint, method=request.method, status=str(response.status_code))
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    مقاييس الخادم بصيغة Prometheus: مدد المراحل وطلبات الخدمات الخارجية ونسب الذاكرة المؤقتة وأطوال الطوابير.
+    """
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route('/generate-book', methods=['POST'])
 def generate_book():
     """
     نقطة نهاية API لتوليد غلاف الكتاب وملف PDF.
+    عند تمرير "async": true (أو ?mode=job) تعاد هوية مهمة فورا ويتم التوليد في الخلفية.
     """
     data = request.json
-    ebook_title = data.get('ebookTitle', 'كتاب بدون عنوان')
-    raw_book_script = data.get('bookScript', '') # الآن نستقبل النص الخام
-    user_cover_prompt = data.get('coverPrompt', '')
-    user_provided_cover_url = data.get('userProvidedCoverUrl', '')
-    back_cover_text = data.get('backCoverText', '') # نص الغلاف الخلفي الجديد
-    settings = data.get('settings', {})
-
-    if not raw_book_script:
+    spec = book_spec_from_request(data)
+
+    if not spec["bookScript"]:
         return jsonify({"error": "الرجاء توفير نص الكتاب."}), 400
 
-    generated_cover_url = ""
+    if data.get('async') or request.args.get('mode') == 'job':
+        try:
+            job = get_job_backend().submit(run_book_pipeline, spec, stages=BOOK_STAGES)
+        except JobQueueFull as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "30"}
+        return jsonify({
+            "jobId": job.id,
+            "statusUrl": f"/jobs/{job.id}",
+            "resultUrl": f"/jobs/{job.id}/result",
+        }), 202
+
     try:
-        # الخطوة 1: تنسيق النص الخام إلى HTML بواسطة AI
-        # هذا هو التغيير الكبير: AI يقوم بالتنسيق قبل إرساله إلى PDF
-        formatted_script_html = format_book_script_with_ai(raw_book_script)
-        if not formatted_script_html:
-            return jsonify({"error": "فشل الذكاء الاصطناعي في تنسيق نص الكتاب."}), 500
-
-        if user_provided_cover_url:
-            generated_cover_url = user_provided_cover_url
-        else:
-            if not user_cover_prompt:
-                ai_generated_prompt = generate_cover_prompt_from_script(raw_book_script) # نستخدم النص الخام لتوليد وصف الغلاف
-                cover_prompt_to_use = ai_generated_prompt
-            else:
-                cover_prompt_to_use = user_cover_prompt
+        return jsonify(_with_absolute_cover_url(run_book_pipeline(spec))), 200
+    except BookPipelineError as e:
+        headers = {"Retry-After": str(e.retry_after)} if e.retry_after else {}
+        return jsonify({"error": e.message}), e.status_code, headers
+    except Exception as e:
+        print(f"Error in book generation process: {e}")
+        return jsonify({"error": f"حدث خطأ أثناء توليد الكتاب: {str(e)}"}), 500
+
+@app.route('/generate-books', methods=['POST'])
+def generate_books():
+    """
+    نقطة نهاية API لتوليد دفعة كتب: {"books": [مواصفات كل كتاب كما في /generate-book], "output": "manifest" | "zip"}.
+    التنسيق والأغلفة المتطابقة بين الكتب تنفذ مرة واحدة. "manifest" (الافتراضي) يعيد روابط كل كتاب،
+    و "zip" يبث ملفا مضغوطا يضاف إليه كل كتاب فور انتهائه، و "async": true ينفذ الدفعة كمهمة خلفية.
+    """
+    data = request.json or {}
+    books = data.get('books') or []
+    if not isinstance(books, list) or not books:
+        return jsonify({"error": "الرجاء توفير قائمة الكتب."}), 400
+    if len(books) > BATCH_MAX_BOOKS:
+        return jsonify({"error": f"الحد الأقصى لعدد الكتب في الدفعة الواحدة هو {BATCH_MAX_BOOKS}."}), 400
+    specs = [book_spec_from_request(book) for book in books]
 
-            generated_cover_url = generate_image_from_prompt(cover_prompt_to_use)
+    if data.get('async') or request.args.get('mode') == 'job':
+        try:
+            job = get_job_backend().submit(run_book_batch, specs, stages=[f"book-{i}" for i in range(len(specs))])
+        except JobQueueFull as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "30"}
+        return jsonify({
+            "jobId": job.id,
+            "statusUrl": f"/jobs/{job.id}",
+            "resultUrl": f"/jobs/{job.id}/result",
+        }), 202
 
-        # الخطوة 3: إنشاء محتوى HTML للكتاب مع الغلاف والإعدادات (باستخدام النص المنسق بواسطة AI)
-        # تمرير نص الغلاف الخلفي ايضا
-        html_content = create_book_html(ebook_title, formatted_script_html, generated_cover_url, back_cover_text, settings)
+    if data.get('output', request.args.get('output')) == 'zip':
+        return Response(stream_with_context(_stream_batch_zip(specs)), mimetype='application/zip',
+                        headers={"Content-Disposition": 'attachment; filename="books.zip"'})
 
-        # الخطوة 4: توليد ملف PDF من محتوى HTML
-        unique_filename = f"book_{uuid.uuid4().hex}.pdf"
-        pdf_path = os.path.join(PDF_OUTPUT_DIR, unique_filename)
-        generate_pdf_from_html(html_content, pdf_path)
+    return jsonify(_with_absolute_cover_url(run_book_batch(specs))), 200
 
-        return jsonify({
-            "pdfUrl": f"/download-pdf/{unique_filename}",
-            "coverUrl": generated_cover_url,
-            "message": "تم توليد الكتاب بنجاح!"
-        }), 200
+class _ZipStream:
+    """
+    هدف كتابة لـ zipfile يجمع البايتات لتبث ثم تفرغ؛ غياب tell/seek يجعل zipfile يكتب بصيغة البث.
+    """
+    def __init__(self):
+        self._chunks = []
 
-    except Exception as e:
-        print(f"Error in book generation process: {e}")
-        return jsonify({"error": f"حدث خطأ أثناء توليد الكتاب: {str(e)}"}), 500
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def _stream_batch_zip(specs: list):
+    """
+    يبث ملف ZIP يضاف إليه PDF كل كتاب فور انتهائه، ثم manifest.json في النهاية.
+    """
+    stream = _ZipStream()
+    manifest = [None] * len(specs)
+    # ملفات PDF مضغوطة أصلا، فتخزن دون ضغط إضافي
+    with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for result in iter_book_batch(specs):
+            if result["status"] == "succeeded":
+                safe_title = re.sub(r'[^\w\- ]+', '', result["ebookTitle"]).strip() or "book"
+                arcname = f"{result['index'] + 1:03d}-{safe_title}.pdf"
+                archive.write(stored_pdf_path(os.path.basename(result["pdfUrl"])), arcname)
+                result["file"] = arcname
+            manifest[result["index"]] = _with_absolute_cover_url(result)
+            yield stream.drain()
+        archive.writestr("manifest.json", json.dumps({"books": manifest}, ensure_ascii=False, indent=2))
+    yield stream.drain()
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    نقطة نهاية API لمتابعة حالة مهمة توليد كتاب وتقدم كل مرحلة.
+    """
+    job = get_job_backend().get(job_id)
+    if job is None:
+        return jsonify({"error": "المهمة غير موجودة."}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """
+    نقطة نهاية API لجلب نتيجة مهمة توليد كتاب بعد انتهائها.
+    """
+    job = get_job_backend().get(job_id)
+    if job is None:
+        return jsonify({"error": "المهمة غير موجودة."}), 404
+    if job.status == "succeeded":
+        return jsonify(_with_absolute_cover_url(job.result)), 200
+    if job.status == "failed":
+        return jsonify({"error": job.error}), job.error_status_code
+    return jsonify(job.to_dict()), 202
+
+def _send_stored_file(path: str, filename: str, mimetype: str, as_attachment: bool, max_age: int):
+    """
+    يرسل ملفا محفوظا دون قراءته كاملا في الذاكرة: دعم Range و ETag/Last-Modified (304)،
+    وتسليمه للخادم الأمامي عبر X-Sendfile أو X-Accel-Redirect إن كانا مفعلين.
+    """
+    if path is None or not os.path.isfile(path):
+        return None
+    if X_ACCEL_REDIRECT_PREFIX:
+        # nginx يقرأ الملف بنفسه ويتولى Range والطلبات الشرطية
+        response = Response(mimetype=mimetype or mimetypes.guess_type(path)[0])
+        response.headers['X-Accel-Redirect'] = f"{X_ACCEL_REDIRECT_PREFIX.rstrip('/')}/{os.path.relpath(path, os.path.abspath(UPLOAD_FOLDER))}"
+        if as_attachment:
+            response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    return send_file(path, mimetype=mimetype, as_attachment=as_attachment, conditional=True, etag=True, max_age=max_age)
+
+def _with_absolute_cover_url(result: dict) -> dict:
+    """
+    يحول رابط الغلاف المحفوظ على الخادم (/covers/...) إلى رابط كامل تستطيع الواجهة عرضه مباشرة.
+    نتائج الدفعات ("books") تحول كتابا كتابا.
+    """
+    if "books" in result:
+        return {**result, "books": [_with_absolute_cover_url(book) for book in result["books"]]}
+    cover_url = result.get("coverUrl", "")
+    if cover_url.startswith("/"):
+        return {**result, "coverUrl": urljoin(request.host_url, cover_url.lstrip("/"))}
+    return result
 
 @app.route('/download-pdf/<filename>', methods=['GET'])
 def download_pdf(filename):
     """
     نقطة نهاية API لتحميل ملف PDF.
     """
-    pdf_path = os.path.join(PDF_OUTPUT_DIR, filename)
-    if os.path.exists(pdf_path):
-        return send_file(pdf_path, as_attachment=True, mimetype='application/pdf')
+    response = _send_stored_file(stored_pdf_path(filename), filename, 'application/pdf', as_attachment=True, max_age=3600)
+    if response is not None:
+        return response
     return jsonify({"error": "ملف PDF غير موجود."}), 404
 
+@app.route('/covers/<filename>', methods=['GET'])
+def download_cover(filename):
+    """
+    نقطة نهاية API لعرض صورة غلاف محفوظة. الاسم مشتق من المحتوى، فيمكن تخزينها مؤقتا بلا حد.
+    """
+    response = _send_stored_file(cover_path(filename), filename, None, as_attachment=False, max_age=31536000)
+    if response is not None:
+        return response
+    return jsonify({"error": "صورة الغلاف غير موجودة."}), 404
+
 @app.route('/chat', methods=['POST'])
 def chat():
     """
     نقطة نهاية API للدردشة مع نموذج Gemini.
+    عند إرسال sessionId (أو useSession) يحفظ السجل على الخادم ولا حاجة لإرسال history.
     """
     data = request.json
     user_message = data.get('message')
@@ -90,25 +230,83 @@ def chat():
         return jsonify({"error": "الرجاء توفير رسالة."}), 400
 
     try:
+        if 'sessionId' in data or data.get('useSession'):
+            session = chat_session_store.get_or_create(data.get('sessionId'))
+            with session.lock:
+                ai_response = chat_with_gemini(user_message, session.context())
+                if ai_response != CHAT_ERROR_REPLY:
+                    session.append("user", user_message)
+                    session.append("model", ai_response)
+            return jsonify({"response": ai_response, "sessionId": session.id}), 200
+
         ai_response = chat_with_gemini(user_message, chat_history)
         return jsonify({"response": ai_response}), 200
     except Exception as e:
         print(f"Error in chat endpoint: {e}")
         return jsonify({"error": f"حدث خطأ أثناء الدردشة: {str(e)}"}), 500
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    نقطة نهاية API للدردشة مع نموذج Gemini بنقل الرد تدريجيا عبر Server-Sent Events.
+    كل جزء نصي يرسل كحدث {"text": ...} ثم حدث done في النهاية. تبقى /chat كبديل غير متدفق.
+    """
+    data = request.json
+    user_message = data.get('message')
+    chat_history = data.get('history', [])
+
+    if not user_message:
+        return jsonify({"error": "الرجاء توفير رسالة."}), 400
+
+    session = None
+    if 'sessionId' in data or data.get('useSession'):
+        session = chat_session_store.get_or_create(data.get('sessionId'))
+
+    def generate_events():
+        try:
+            if session is None:
+                for text in stream_chat_with_gemini(user_message, chat_history):
+                    yield f"data: {json.dumps({'text': text}, ensure_ascii=False)}\n\n"
+                yield "event: done\ndata: {}\n\n"
+                return
+
+            with session.lock:
+                reply_parts = []
+                for text in stream_chat_with_gemini(user_message, session.context()):
+                    reply_parts.append(text)
+                    yield f"data: {json.dumps({'text': text}, ensure_ascii=False)}\n\n"
+                # يحفظ الدور في الجلسة فقط بعد اكتمال الرد
+                session.append("user", user_message)
+                session.append("model", "".join(reply_parts))
+            yield f"event: done\ndata: {json.dumps({'sessionId': session.id})}\n\n"
+        except Exception as e:
+            print(f"Error in chat stream endpoint: {e}")
+            error = {"error": f"حدث خطأ أثناء الدردشة: {str(e)}"}
+            yield f"event: error\ndata: {json.dumps(error, ensure_ascii=False)}\n\n"
+
+    return Response(stream_with_context(generate_events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no', # منع الوكيل العكسي من تخزين الأحداث مؤقتا
+    })
+
 @app.route('/suggest-style', methods=['POST'])
 def suggest_style():
     """
     نقطة نهاية API لاقتراح إعدادات تصميم الكتاب باستخدام AI.
+    bookDescription وصف قصير للكتاب؛ أو manuscript نص الكتاب كاملا، فيخدم تحليل واحد النمط وأوصاف الغلاف.
     """
     data = request.json
+    manuscript = data.get('manuscript', '')
     book_description = data.get('bookDescription', '')
 
-    if not book_description:
+    if not manuscript and not book_description:
         return jsonify({"error": "الرجاء توفير وصف للكتاب لاقتراح النمط."}), 400
 
     try:
-        suggested_settings = suggest_book_style_settings(book_description)
+        if manuscript:
+            suggested_settings = suggest_style_from_manuscript(manuscript)
+        else:
+            suggested_settings = suggest_book_style_settings(book_description)
         return jsonify({"settings": suggested_settings}), 200
     except Exception as e:
         print(f"Error in style suggestion endpoint: {e}")
@@ -118,6 +316,7 @@ def suggest_style():
 def format_script_endpoint():
     """
     نقطة نهاية API لتنسيق نص الكتاب الخام إلى HTML بواسطة AI.
+    draftId المعاد يرسل مع /generate-book فلا يعاد التنسيق.
     """
     data = request.json
     raw_script = data.get('rawScript', '')
@@ -127,7 +326,7 @@ def format_script_endpoint():
 
     try:
         formatted_html = format_book_script_with_ai(raw_script)
-        return jsonify({"formattedHtml": formatted_html}), 200
+        return jsonify({"formattedHtml": formatted_html, "draftId": save_formatted_draft(raw_script, formatted_html)}), 200
     except Exception as e:
         print(f"Error in format script endpoint: {e}")
         return jsonify({"error": f"حدث خطأ أثناء تنسيق النص بواسطة الذكاء الاصطناعي: {str(e)}"}), 500
@@ -136,9 +335,10 @@ def format_script_endpoint():
 def generate_cover_descriptions_endpoint():
     """
     نقطة نهاية API لتوليد وصف الغلاف الأمامي والخلفي بواسطة AI.
+    coverDraftId المعاد يرسل مع /generate-book بدل الوصفين. manuscript (نص الكتاب كاملا) بديل bookContent.
     """
     data = request.json
-    book_content = data.get('bookContent', '')
+    book_content = data.get('manuscript') or data.get('bookContent', '')
 
     if not book_content:
         return jsonify({"error": "الرجاء توفير محتوى الكتاب لتوليد أوصاف الغلاف."}), 400
@@ -146,7 +346,7 @@ def generate_cover_descriptions_endpoint():
     try:
         # هنا نستدعي دالة AI الجديدة
         cover_descriptions = generate_front_back_cover_prompts(book_content)
-        return jsonify(cover_descriptions), 200
+        return jsonify({**cover_descriptions, "coverDraftId": save_cover_draft(book_content, cover_descriptions)}), 200
     except Exception as e:
         print(f"Error in generate cover descriptions endpoint: {e}")
         return jsonify({"error": f"حدث خطأ أثناء توليد أوصاف الغلاف: {str(e)}"}), 500
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from config import ARTIFACT_DIR, ARTIFACT_MAX_BYTES, ARTIFACT_TTL, ARTIFACT_EVICT_INTERVAL
+from metrics import registry
+
+# أسماء الملفات المخزنة: بصمة sha256 ثم الامتداد
+ARTIFACT_NAME_RE = re.compile(r'^([0-9a-f]{64})\.([a-z0-9]{1,5})$')
+
+ARTIFACT_LOOKUPS = registry.counter("artifact_lookups_total", "Artifact store lookups by kind and result.", ("kind", "result"))
+
+
+def make_artifact_key(*parts) -> str:
+    """
+    بصمة ثابتة لمدخلات الملف الناتج (مثل مواصفات الكتاب والإعدادات)، تستخدم اسما له.
+    """
+    material = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class ArtifactStore:
+    """
+    مخزن الملفات الناتجة (PDF والأغلفة): كل ملف يسمى ببصمة مدخلاته ويوضع في مجلدات فرعية
+    (kind/ab/cd/<hash>.ext) حتى لا يكبر مجلد واحد، مع فهرس SQLite للحجم والعمر وعدد مرات الاستخدام.
+    الحذف بانتهاء الصلاحية وتجاوز الحصة (الأقدم استخداما أولا) يتم في خيط خلفي.
+    """
+    def __init__(self, root: str, max_bytes: int, ttl: int):
+        self.root = os.path.abspath(root)
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self.evictions = 0
+        if not os.path.exists(self.root):
+            os.makedirs(self.root, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(self.root, 'index.sqlite3'), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS artifacts ("
+            " name TEXT NOT NULL, kind TEXT NOT NULL, size INTEGER NOT NULL, meta TEXT,"
+            " created_at REAL NOT NULL, accessed_at REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (kind, name))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS artifacts_accessed ON artifacts(accessed_at)")
+        self._db.commit()
+
+    def path_for(self, kind: str, name: str) -> str | None:
+        """
+        المسار المقسم لملف باسم <hash>.ext، أو None إن لم يكن الاسم بالصيغة المتوقعة.
+        """
+        match = ARTIFACT_NAME_RE.match(name)
+        if not match:
+            return None
+        digest = match.group(1)
+        return os.path.join(self.root, kind, digest[:2], digest[2:4], name)
+
+    def get(self, kind: str, name: str) -> dict | None:
+        """
+        يعيد {"name", "path", "meta"} للملف المخزن باسم <hash>.ext، أو None إن لم يوجد أو انتهت صلاحيته.
+        كل قراءة تحدث وقت آخر استخدام، فلا يحذف ملف ما زال يطلب.
+        """
+        path = self.path_for(kind, name)
+        if path is None:
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT meta, created_at FROM artifacts WHERE kind = ? AND name = ?", (kind, name)).fetchone()
+            if row is None or now - row[1] > self._ttl or not os.path.exists(path):
+                ARTIFACT_LOOKUPS.inc(kind=kind, result="miss")
+                return None
+            self._db.execute("UPDATE artifacts SET accessed_at = ?, hits = hits + 1 WHERE kind = ? AND name = ?", (now, kind, name))
+            self._db.commit()
+        ARTIFACT_LOOKUPS.inc(kind=kind, result="hit")
+        return {"name": name, "path": path, "meta": json.loads(row[0]) if row[0] else None}
+
+    def find(self, kind: str, key: str) -> dict | None:
+        """
+        مثل get لكن بالبصمة وحدها، لملفات لا يعرف امتدادها قبل إنتاجها (مثل صورة قد تحفظ JPEG أو PNG).
+        """
+        with self._lock:
+            row = self._db.execute("SELECT name FROM artifacts WHERE kind = ? AND name > ? AND name < ? LIMIT 1",
+                                   (kind, f"{key}.", f"{key}/")).fetchone()
+        if row is None:
+            ARTIFACT_LOOKUPS.inc(kind=kind, result="miss")
+            return None
+        return self.get(kind, row[0])
+
+    def temp_path(self, kind: str, name: str) -> str:
+        """
+        مسار مؤقت في مجلد الملف النهائي نفسه، يكتب فيه الملف ثم ينقل بـ commit (نقل ذري).
+        """
+        path = self.path_for(kind, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def commit(self, kind: str, name: str, temp_path: str, meta: dict = None) -> str:
+        """
+        ينقل الملف المكتوب في temp_path إلى مكانه ويسجله في الفهرس، ويعيد اسمه.
+        """
+        path = self.path_for(kind, name)
+        os.replace(temp_path, path)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO artifacts (name, kind, size, meta, created_at, accessed_at, hits) VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (name, kind, os.path.getsize(path), json.dumps(meta, ensure_ascii=False) if meta is not None else None, now, now)
+            )
+            self._db.commit()
+        return name
+
+    def put_bytes(self, kind: str, name: str, data: bytes, meta: dict = None) -> str:
+        """
+        يحفظ بيانات ثنائية كملف مخزن ويعيد اسمه؛ إن كان موجودا يعاد اسمه دون كتابة.
+        """
+        if self.get(kind, name) is not None:
+            return name
+        temp_path = self.temp_path(kind, name)
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        return self.commit(kind, name, temp_path, meta)
+
+    def evict(self) -> int:
+        """
+        يحذف الملفات المنتهية صلاحيتها ثم الأقدم استخداما حتى يعود الحجم الكلي تحت الحصة.
+        """
+        now = time.time()
+        removed = []
+        with self._lock:
+            removed.extend(self._db.execute("SELECT kind, name FROM artifacts WHERE created_at < ?", (now - self._ttl,)).fetchall())
+            self._db.execute("DELETE FROM artifacts WHERE created_at < ?", (now - self._ttl,))
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+            if total > self._max_bytes:
+                for kind, name, size in self._db.execute("SELECT kind, name, size FROM artifacts ORDER BY accessed_at").fetchall():
+                    if total <= self._max_bytes:
+                        break
+                    self._db.execute("DELETE FROM artifacts WHERE kind = ? AND name = ?", (kind, name))
+                    removed.append((kind, name))
+                    total -= size
+            self._db.commit()
+            self.evictions += len(removed)
+
+        # حذف الملفات خارج القفل؛ الفهرس لم يعد يشير إليها
+        for kind, name in removed:
+            try:
+                os.remove(self.path_for(kind, name))
+            except OSError:
+                pass
+        if removed:
+            print(f"Artifact store evicted {len(removed)} files.")
+        return len(removed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._db.execute("SELECT kind, COUNT(*), COALESCE(SUM(size), 0) FROM artifacts GROUP BY kind").fetchall()
+        return {kind: {"files": count, "bytes": size} for kind, count, size in rows}
+
+
+def _eviction_loop(store: ArtifactStore, interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            store.evict()
+        except Exception as e:
+            print(f"خطأ أثناء تنظيف مخزن الملفات: {e}")
+
+
+_artifact_store = None
+_artifact_store_lock = threading.Lock()
+
+
+def get_artifact_store() -> ArtifactStore:
+    """
+    يعيد مخزن الملفات المشترك، وينشئه مع خيط التنظيف الخلفي عند أول استخدام.
+    """
+    global _artifact_store
+    with _artifact_store_lock:
+        if _artifact_store is None:
+            _artifact_store = ArtifactStore(ARTIFACT_DIR, ARTIFACT_MAX_BYTES, ARTIFACT_TTL)
+            _artifact_store.evict()
+            threading.Thread(target=_eviction_loop, args=(_artifact_store, ARTIFACT_EVICT_INTERVAL),
+                             daemon=True, name="artifact-eviction").start()
+        return _artifact_store
+
+
+def _artifact_samples(field: str) -> list:
+    if _artifact_store is None:
+        return []
+    return [({"kind": kind}, values[field]) for kind, values in _artifact_store.stats().items()]
+
+
+registry.callback("artifact_store_files", "Files held in the artifact store.", lambda: _artifact_samples("files"))
+registry.callback("artifact_store_bytes", "Bytes held in the artifact store.", lambda: _artifact_samples("bytes"))
@@ -0,0 +1,198 @@
+"""
+وضع ASGI للخادم: نقاط نهاية الذكاء الاصطناعي (الدردشة، اقتراح النمط، التنسيق، أوصاف الغلاف) تعمل في Quart
+على حلقة أحداث واحدة، فآلاف الطلبات المنتظرة لـ Gemini لا تحجز خيطا لكل منها.
+باقي النقاط (توليد الكتب والمهام والتنزيل والمقاييس) يخدمها تطبيق Flask نفسه في خيوط منفصلة،
+فيبقى توليد PDF الثقيل خارج حلقة الأحداث.
+
+hypercorn asgi_app:asgi_app --bind 0.0.0.0:5000
+"""
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from quart import Quart, Response, g, jsonify, request
+from config import ASGI_MAX_BODY_BYTES
+from app import app as flask_app
+from chat_sessions import chat_session_store
+from drafts import save_formatted_draft, save_cover_draft
+from http_client_async import close_async_client
+from metrics import HTTP_SECONDS
+from rate_limit import request_class_for, set_request_class
+import ai_services_async as ai
+
+quart_app = Quart(__name__)
+quart_app.config['MAX_CONTENT_LENGTH'] = ASGI_MAX_BODY_BYTES
+
+# المسارات التي يخدمها Quart؛ طلبات OPTIONS (CORS) تبقى لـ flask_cors
+ASYNC_PATHS = {"/chat", "/chat/stream", "/suggest-style", "/format-script-with-ai", "/generate-cover-descriptions"}
+
+@quart_app.before_request
+async def start_request_timer():
+    g.request_started_at = time.perf_counter()
+    set_request_class(*request_class_for(request.path, request.headers.get('X-Client-Id') or request.remote_addr))
+
+@quart_app.after_request
+async def finish_request(response):
+    response.headers.setdefault('Access-Control-Allow-Origin', '*')
+    started_at = g.pop('request_started_at', None)
+    if started_at is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_SECONDS.observe(time.perf_counter() - started_at, endpoint=endpoint, method=request.method, status=str(response.status_code))
+    return response
+
+@quart_app.after_serving
+async def close_http_client():
+    await close_async_client()
+
+@asynccontextmanager
+async def _session_locked(session):
+    """
+    يحجز قفل الجلسة (threading.Lock مشترك مع وضع Flask) دون إيقاف حلقة الأحداث أثناء الانتظار.
+    """
+    if not session.lock.acquire(blocking=False):
+        acquiring = asyncio.get_running_loop().run_in_executor(None, session.lock.acquire)
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # الطلب ألغي أثناء الانتظار: يحرر القفل حين يحصل عليه الخيط
+            acquiring.add_done_callback(lambda _: session.lock.release())
+            raise
+    try:
+        yield
+    finally:
+        session.lock.release()
+
+@quart_app.route('/chat', methods=['POST'])
+async def chat():
+    data = await request.get_json()
+    user_message = data.get('message')
+    chat_history = data.get('history', [])
+
+    if not user_message:
+        return jsonify({"error": "الرجاء توفير رسالة."}), 400
+
+    try:
+        if 'sessionId' in data or data.get('useSession'):
+            session = chat_session_store.get_or_create(data.get('sessionId'))
+            async with _session_locked(session):
+                ai_response = await ai.chat_with_gemini(user_message, await session.async_context())
+                if ai_response != ai.CHAT_ERROR_REPLY:
+                    session.append("user", user_message)
+                    session.append("model", ai_response)
+            return jsonify({"response": ai_response, "sessionId": session.id}), 200
+
+        ai_response = await ai.chat_with_gemini(user_message, chat_history)
+        return jsonify({"response": ai_response}), 200
+    except Exception as e:
+        print(f"Error in chat endpoint: {e}")
+        return jsonify({"error": f"حدث خطأ أثناء الدردشة: {str(e)}"}), 500
+
+@quart_app.route('/chat/stream', methods=['POST'])
+async def chat_stream():
+    data = await request.get_json()
+    user_message = data.get('message')
+    chat_history = data.get('history', [])
+
+    if not user_message:
+        return jsonify({"error": "الرجاء توفير رسالة."}), 400
+
+    session = None
+    if 'sessionId' in data or data.get('useSession'):
+        session = chat_session_store.get_or_create(data.get('sessionId'))
+
+    async def generate_events():
+        try:
+            if session is None:
+                async for text in ai.stream_chat_with_gemini(user_message, chat_history):
+                    yield f"data: {json.dumps({'text': text}, ensure_ascii=False)}\n\n"
+                yield "event: done\ndata: {}\n\n"
+                return
+
+            async with _session_locked(session):
+                reply_parts = []
+                async for text in ai.stream_chat_with_gemini(user_message, await session.async_context()):
+                    reply_parts.append(text)
+                    yield f"data: {json.dumps({'text': text}, ensure_ascii=False)}\n\n"
+                session.append("user", user_message)
+                session.append("model", "".join(reply_parts))
+            yield f"event: done\ndata: {json.dumps({'sessionId': session.id})}\n\n"
+        except Exception as e:
+            print(f"Error in chat stream endpoint: {e}")
+            error = {"error": f"حدث خطأ أثناء الدردشة: {str(e)}"}
+            yield f"event: error\ndata: {json.dumps(error, ensure_ascii=False)}\n\n"
+
+    response = Response(generate_events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    response.timeout = None # الرد المتدفق قد يطول أكثر من مهلة Quart الافتراضية
+    return response
+
+@quart_app.route('/suggest-style', methods=['POST'])
+async def suggest_style():
+    data = await request.get_json()
+    manuscript = data.get('manuscript', '')
+    book_description = data.get('bookDescription', '')
+
+    if not manuscript and not book_description:
+        return jsonify({"error": "الرجاء توفير وصف للكتاب لاقتراح النمط."}), 400
+
+    try:
+        if manuscript:
+            return jsonify({"settings": await ai.suggest_style_from_manuscript(manuscript)}), 200
+        return jsonify({"settings": await ai.suggest_book_style_settings(book_description)}), 200
+    except Exception as e:
+        print(f"Error in style suggestion endpoint: {e}")
+        return jsonify({"error": f"حدث خطأ أثناء اقتراح النمط: {str(e)}"}), 500
+
+@quart_app.route('/format-script-with-ai', methods=['POST'])
+async def format_script_endpoint():
+    data = await request.get_json()
+    raw_script = data.get('rawScript', '')
+
+    if not raw_script:
+        return jsonify({"error": "الرجاء توفير نص خام للتنسيق."}), 400
+
+    try:
+        formatted_html = await ai.format_book_script_with_ai(raw_script)
+        return jsonify({"formattedHtml": formatted_html, "draftId": save_formatted_draft(raw_script, formatted_html)}), 200
+    except Exception as e:
+        print(f"Error in format script endpoint: {e}")
+        return jsonify({"error": f"حدث خطأ أثناء تنسيق النص بواسطة الذكاء الاصطناعي: {str(e)}"}), 500
+
+@quart_app.route('/generate-cover-descriptions', methods=['POST'])
+async def generate_cover_descriptions_endpoint():
+    data = await request.get_json()
+    book_content = data.get('manuscript') or data.get('bookContent', '')
+
+    if not book_content:
+        return jsonify({"error": "الرجاء توفير محتوى الكتاب لتوليد أوصاف الغلاف."}), 400
+
+    try:
+        cover_descriptions = await ai.generate_front_back_cover_prompts(book_content)
+        return jsonify({**cover_descriptions, "coverDraftId": save_cover_draft(book_content, cover_descriptions)}), 200
+    except Exception as e:
+        print(f"Error in generate cover descriptions endpoint: {e}")
+        return jsonify({"error": f"حدث خطأ أثناء توليد أوصاف الغلاف: {str(e)}"}), 500
+
+
+# تطبيق Flask يعمل في خيوط المنفذ الافتراضي لحلقة الأحداث
+_flask_asgi = AsyncioWSGIMiddleware(flask_app, max_body_size=ASGI_MAX_BODY_BYTES)
+
+async def asgi_app(scope, receive, send):
+    """
+    يوزع الطلبات: مسارات الذكاء الاصطناعي إلى Quart، والباقي إلى Flask. أحداث lifespan لـ Quart.
+    """
+    if scope["type"] == "lifespan" or (scope["type"] == "http" and scope["path"] in ASYNC_PATHS and scope["method"] != "OPTIONS"):
+        await quart_app(scope, receive, send)
+    else:
+        await _flask_asgi(scope, receive, send)
+
+
+if __name__ == '__main__':
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+    config = Config()
+    config.bind = ["0.0.0.0:5000"]
+    asyncio.run(serve(asgi_app, config))
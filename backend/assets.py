@@ -0,0 +1,188 @@
+import hashlib
+import mimetypes
+import os
+import pathlib
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+try:
+    from weasyprint.urls import URLFetcher, URLFetcherResponse
+except ImportError:
+    # إصدارات WeasyPrint الأقدم من واجهة URLFetcher تقبل دالة url_fetcher تعيد قاموسا
+    from weasyprint import default_url_fetcher
+    URLFetcher = None
+from config import UPLOAD_FOLDER, ARTIFACT_DIR, COVER_PLACEHOLDER_URL, ASSET_CACHE_MAX_BYTES, ASSET_REMOTE_MAX_BYTES, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+# بادئة روابط الأصول المحلية في HTML و CSS (مثال: asset:fonts/Amiri-Regular.ttf)
+ASSET_SCHEME = "asset:"
+
+# الأصول المسموح بتقديمها من مجلد static، أي ملف آخر يرفض
+# ملفات الخطوط (رخصة OFL) توضع في static/fonts؛ إن غابت يستخدم WeasyPrint خطوط النظام دون أي اتصال شبكي
+ALLOWED_ASSETS = {
+    "fonts/Amiri-Regular.ttf",
+    "fonts/Amiri-Bold.ttf",
+    "fonts/Inter-Regular.ttf",
+    "fonts/Inter-SemiBold.ttf",
+    "fonts/Inter-Bold.ttf",
+    "cover_placeholder.png",
+}
+
+# روابط خارجية معروفة تقدم من نسخة محلية بدل تنزيلها
+URL_ALIASES = {
+    COVER_PLACEHOLDER_URL: "cover_placeholder.png",
+}
+
+# مجلد الأصول الخارجية المنزلة مسبقا (مثل أغلفة المستخدمين)
+REMOTE_ASSET_DIR = os.path.join(os.path.abspath(UPLOAD_FOLDER), 'assets')
+
+# مجلدات يسمح بقراءة ملفاتها عبر file:// أثناء التوليد
+ALLOWED_FILE_ROOTS = [STATIC_DIR, os.path.abspath(UPLOAD_FOLDER), os.path.abspath(ARTIFACT_DIR)]
+
+# قواعد @font-face تشير إلى الخطوط المحلية بدل Google Fonts
+FONT_FACE_CSS = """
+            @font-face { font-family: 'Amiri'; font-weight: 400; src: url(asset:fonts/Amiri-Regular.ttf); }
+            @font-face { font-family: 'Amiri'; font-weight: 700; src: url(asset:fonts/Amiri-Bold.ttf); }
+            @font-face { font-family: 'Inter'; font-weight: 400; src: url(asset:fonts/Inter-Regular.ttf); }
+            @font-face { font-family: 'Inter'; font-weight: 600; src: url(asset:fonts/Inter-SemiBold.ttf); }
+            @font-face { font-family: 'Inter'; font-weight: 700; src: url(asset:fonts/Inter-Bold.ttf); }
+"""
+
+
+class AssetCache:
+    """
+    ذاكرة مؤقتة للأصول (الخطوط والصور) بحد أقصى للحجم، تحذف الأقدم استخداما عند تجاوزه.
+    """
+    def __init__(self, max_bytes: int):
+        self._entries = OrderedDict()
+        self._max_bytes = max_bytes
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, data: bytes, mime_type: str):
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key)[0])
+            self._entries[key] = (data, mime_type)
+            self._size += len(data)
+            while self._size > self._max_bytes and len(self._entries) > 1:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+
+asset_cache = AssetCache(ASSET_CACHE_MAX_BYTES)
+
+
+def _guess_mime_type(name: str) -> str:
+    if name.endswith('.ttf'):
+        return 'font/ttf'
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def _load_static_asset(name: str) -> tuple:
+    cached = asset_cache.get(ASSET_SCHEME + name)
+    if cached is not None:
+        return cached
+    with open(os.path.join(STATIC_DIR, name), 'rb') as f:
+        data = f.read()
+    asset_cache.put(ASSET_SCHEME + name, data, _guess_mime_type(name))
+    return data, _guess_mime_type(name)
+
+
+def is_allowed_file(path: str) -> bool:
+    """
+    هل المسار داخل أحد المجلدات المسموح بقراءتها أثناء التوليد (ALLOWED_FILE_ROOTS)، بعد حل الروابط الرمزية.
+    """
+    real_path = os.path.realpath(path)
+    return any(real_path.startswith(os.path.realpath(root) + os.sep) for root in ALLOWED_FILE_ROOTS)
+
+
+def _resolve_asset(url: str) -> tuple | None:
+    """
+    يعيد (البيانات، النوع) للأصول المقدمة من static والذاكرة، أو None لروابط data: وملفات المجلدات
+    المسموحة التي يجلبها WeasyPrint بنفسه، ويرفع ValueError لأي رابط آخر.
+    """
+    if url in URL_ALIASES:
+        return _load_static_asset(URL_ALIASES[url])
+
+    if url.startswith(ASSET_SCHEME):
+        name = url[len(ASSET_SCHEME):].lstrip('/')
+        if name not in ALLOWED_ASSETS:
+            raise ValueError(f"Asset not in allow-list: {url}")
+        return _load_static_asset(name)
+
+    scheme = urlparse(url).scheme.lower()
+    if scheme == 'data':
+        return None
+    if scheme == 'file' and is_allowed_file(url2pathname(urlparse(url).path)):
+        return None
+
+    raise ValueError(f"Network access is disabled during PDF rendering: {url}")
+
+
+if URLFetcher is not None:
+    class LocalAssetFetcher(URLFetcher):
+        """
+        جالب روابط لـ WeasyPrint لا يتصل بالشبكة إطلاقا: يقدم الأصول المسموحة من static والذاكرة،
+        وملفات مجلدي static و uploads، وروابط data:، ويرفض أي رابط آخر.
+        """
+        def fetch(self, url, headers=None):
+            asset = _resolve_asset(url)
+            if asset is None:
+                return super().fetch(url, headers)
+            data, mime_type = asset
+            return URLFetcherResponse(url, data, {'Content-Type': mime_type})
+else:
+    class LocalAssetFetcher:
+        """
+        مثل LocalAssetFetcher أعلاه لإصدارات WeasyPrint الأقدم: دالة url_fetcher تعيد قاموسا.
+        """
+        def __call__(self, url):
+            asset = _resolve_asset(url)
+            if asset is None:
+                return default_url_fetcher(url)
+            data, mime_type = asset
+            return {'string': data, 'mime_type': mime_type, 'redirected_url': url}
+
+
+def prefetch_remote_asset(url: str) -> str:
+    """
+    ينزل أصلا خارجيا (مثل صورة غلاف من رابط المستخدم) مرة واحدة قبل التوليد ويحفظه في uploads/assets،
+    ويعيد رابط file:// المحلي ليستخدم في HTML فلا يحتاج WeasyPrint (ولا عمال التوليد) إلى الشبكة.
+    يعيد الرابط الأصلي كما هو إذا لم يكن خارجيا أو تعذر تنزيله.
+    """
+    if urlparse(url).scheme.lower() not in ('http', 'https') or url in URL_ALIASES:
+        return url
+    extension = os.path.splitext(urlparse(url).path)[1][:5] or '.img'
+    local_path = os.path.join(REMOTE_ASSET_DIR, hashlib.sha256(url.encode('utf-8')).hexdigest() + extension)
+    if os.path.exists(local_path):
+        return pathlib.Path(local_path).as_uri()
+
+    # استيراد متأخر: عمال التوليد لا يحتاجون عميل HTTP
+    from http_client import get_session
+    try:
+        with get_session().get(url, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT), stream=True) as response:
+            response.raise_for_status()
+            data = response.raw.read(ASSET_REMOTE_MAX_BYTES + 1, decode_content=True)
+        if len(data) > ASSET_REMOTE_MAX_BYTES:
+            print(f"Remote asset too large, skipping: {url}")
+            return url
+        if not os.path.exists(REMOTE_ASSET_DIR):
+            os.makedirs(REMOTE_ASSET_DIR, exist_ok=True)
+        temp_path = f"{local_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, local_path)
+        return pathlib.Path(local_path).as_uri()
+    except Exception as e:
+        print(f"خطأ في تنزيل الأصل الخارجي {url}: {e}")
+        return url
@@ -0,0 +1,95 @@
+"""
+مقارنة زمن وذاكرة استخراج العناوين وإضافة IDs: المرور الواحد (add_heading_ids)
+مقابل التنفيذ السابق بـ BeautifulSoup (تحليل كامل ثم str(soup)).
+
+python benchmarks/bench_headings.py --chapters 200 --repeat 5
+"""
+import argparse
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_generator import add_heading_ids # noqa: E402
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:  # beautifulsoup4 متطلب تطوير فقط (requirements-dev.txt)
+    BeautifulSoup = None
+
+
+def add_heading_ids_bs4(script_content: str, id_prefix: str = "section-") -> tuple:
+    """
+    التنفيذ السابق كما كان في create_book_html، للمقارنة فقط.
+    """
+    soup = BeautifulSoup(script_content, 'html.parser')
+    toc_entries = []
+    for i, heading in enumerate(soup.find_all(['h1', 'h2', 'h3'])):
+        if not heading.has_attr('id'):
+            heading_id_text = re.sub(r'[^a-zA-Z0-9_]', '', heading.get_text().strip())
+            heading_id = f"{id_prefix}{i}-{heading_id_text[:30]}"
+            heading['id'] = heading_id
+        else:
+            heading_id = heading['id']
+        toc_entries.append({'level': int(heading.name[1]), 'text': heading.get_text().strip(), 'id': heading_id})
+    return str(soup), toc_entries
+
+
+def make_script(chapters: int, sections: int = 4, paragraphs: int = 6) -> str:
+    """
+    نص كتاب منسق اصطناعي بالشكل الذي يعيده الذكاء الاصطناعي (عربي وإنجليزي).
+    """
+    paragraph = ("<p>هذه فقرة تجريبية من نص الكتاب تحتوي على <strong>كلمات مهمة</strong> "
+                 "and some English words &amp; entities for mixed content.</p>")
+    parts = ['<div dir="rtl">']
+    for chapter in range(chapters):
+        parts.append(f"<h1>الفصل {chapter + 1} Chapter {chapter + 1}</h1>")
+        for section in range(sections):
+            parts.append(f"<h2>Section {chapter + 1}.{section + 1}</h2>")
+            parts.extend([paragraph] * paragraphs)
+            parts.append(f"<h3>ملاحظة {section + 1}</h3><ul><li>عنصر</li><li>item</li></ul>")
+    parts.append("</div>")
+    return "\n".join(parts)
+
+
+def measure(func, script: str, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(script)
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    func(script)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"best_s": min(timings), "mean_s": sum(timings) / len(timings), "peak_kb": peak / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chapters", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    script = make_script(args.chapters)
+    print(f"Script: {len(script) / 1024:.0f} KB, {args.chapters} chapters")
+
+    single_pass = measure(add_heading_ids, script, args.repeat)
+    print(f"single pass   best {single_pass['best_s'] * 1000:8.1f} ms  mean {single_pass['mean_s'] * 1000:8.1f} ms  peak {single_pass['peak_kb']:10.0f} KB")
+    if BeautifulSoup is None:
+        print("beautifulsoup4 is not installed; skipping the comparison.")
+        return
+    soup = measure(add_heading_ids_bs4, script, args.repeat)
+    print(f"BeautifulSoup best {soup['best_s'] * 1000:8.1f} ms  mean {soup['mean_s'] * 1000:8.1f} ms  peak {soup['peak_kb']:10.0f} KB")
+    print(f"speedup x{soup['best_s'] / single_pass['best_s']:.1f}, memory x{soup['peak_kb'] / single_pass['peak_kb']:.1f}")
+    html, toc_entries = add_heading_ids(script)
+    expected_html, expected_toc = add_heading_ids_bs4(script)
+    if toc_entries != expected_toc or str(BeautifulSoup(html, 'html.parser')) != expected_html:
+        print("WARNING: output differs between implementations")
+
+
+if __name__ == "__main__":
+    main()
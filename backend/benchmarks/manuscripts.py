@@ -0,0 +1,59 @@
+"""
+مخطوطات اصطناعية (عربية وإنجليزية) بعدد صفحات محدد لقياس الأداء.
+النص الخام بالشكل الذي يرسله المستخدم: عناوين فصول وفقرات مفصولة بأسطر فارغة.
+"""
+import random
+
+# عدد الكلمات التقريبي في صفحة A4 بالإعدادات الافتراضية
+WORDS_PER_PAGE = 300
+WORDS_PER_PARAGRAPH = 60
+PAGES_PER_CHAPTER = 10
+
+_ARABIC_WORDS = (
+    "الكتاب المعرفة الطريق المدينة البحر الزمن الذاكرة الضوء الحكاية الرحلة الصباح "
+    "القلب السؤال الجواب البيت النافذة الحلم الصمت الكلمة الصفحة الفكرة التاريخ "
+    "كان يقول في على من إلى عن مع هذا ذلك التي الذي ثم لكن حين بعد قبل عند"
+).split()
+
+_ENGLISH_WORDS = (
+    "the book knowledge road city sea time memory light story journey morning heart "
+    "question answer house window dream silence word page idea history was said in on "
+    "from to about with this that which then but when after before at"
+).split()
+
+LANGUAGES = ("ar", "en")
+
+
+def _sentence(rng: random.Random, words: list, terminator: str) -> str:
+    sentence = " ".join(rng.choice(words) for _ in range(rng.randint(8, 16)))
+    return sentence[0].upper() + sentence[1:] + terminator
+
+
+def _paragraph(rng: random.Random, language: str) -> str:
+    words = _ARABIC_WORDS if language == "ar" else _ENGLISH_WORDS
+    terminator = "." if language == "en" else rng.choice([".", ".", "؟"])
+    sentences = []
+    count = 0
+    while count < WORDS_PER_PARAGRAPH:
+        sentence = _sentence(rng, words, terminator)
+        count += sentence.count(" ") + 1
+        sentences.append(sentence)
+    return " ".join(sentences)
+
+
+def make_manuscript(pages: int, language: str = "ar", seed: int = 1) -> str:
+    """
+    يولد نصا خاما بطول تقريبي pages صفحة، بفصل كل PAGES_PER_CHAPTER صفحات وعناوين فرعية.
+    النتيجة ثابتة لنفس المعاملات، فتبقى المقارنة بين التشغيلات عادلة.
+    """
+    rng = random.Random(f"{language}:{pages}:{seed}")
+    paragraphs_per_page = max(1, WORDS_PER_PAGE // WORDS_PER_PARAGRAPH)
+    lines = []
+    for page in range(pages):
+        if page % PAGES_PER_CHAPTER == 0:
+            chapter = page // PAGES_PER_CHAPTER + 1
+            lines.append(f"الفصل {chapter}: {rng.choice(_ARABIC_WORDS)}" if language == "ar" else f"Chapter {chapter}: The {rng.choice(_ENGLISH_WORDS)}")
+        elif page % 3 == 0:
+            lines.append(f"## {_sentence(rng, _ARABIC_WORDS if language == 'ar' else _ENGLISH_WORDS, '')[:40]}")
+        lines.extend(_paragraph(rng, language) for _ in range(paragraphs_per_page))
+    return "\n\n".join(lines) + "\n"
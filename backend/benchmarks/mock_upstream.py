@@ -0,0 +1,185 @@
+"""
+خادم محلي يحاكي Gemini و Imagen لقياس الأداء دون اتصال حقيقي، مع تأخير قابل للضبط.
+
+python benchmarks/mock_upstream.py --port 8765 --latency-ms 800 --per-kchar-ms 40
+
+ثم: GEMINI_API_BASE_URL=http://127.0.0.1:8765/v1beta/models/
+     IMAGEN_API_URL=http://127.0.0.1:8765/v1beta/models/imagen:predict
+"""
+import argparse
+import base64
+import html
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_SCRIPT_RE = re.compile(r"Raw Book Script:\s*---\n(.*?)\n\s*---", re.DOTALL)
+_CHAPTER_RE = re.compile(r"^(?:#\s+|(?:الفصل|الباب|الجزء)\s+|(?:chapter|part)\s+)", re.IGNORECASE)
+
+_PLACEHOLDER_PNG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static", "cover_placeholder.png")
+
+
+def format_script_as_html(script: str) -> str:
+    """
+    تنسيق حتمي بسيط يحاكي رد نموذج التنسيق: عناوين الفصول h1، و ## عناوين h2، والباقي فقرات.
+    """
+    blocks = []
+    for block in re.split(r"\n\s*\n", script.strip()):
+        block = block.strip()
+        if not block:
+            continue
+        if block.startswith("## "):
+            blocks.append(f"<h2>{html.escape(block[3:])}</h2>")
+        elif _CHAPTER_RE.match(block):
+            blocks.append(f"<h1>{html.escape(block.lstrip('# '))}</h1>")
+        else:
+            blocks.append(f"<p>{html.escape(block)}</p>")
+    return '<div dir="rtl">\n' + "\n".join(blocks) + "\n</div>"
+
+
+def _schema_example(schema: dict):
+    schema_type = schema.get("type", "STRING").upper()
+    if schema_type == "OBJECT":
+        return {name: _schema_example(prop) for name, prop in schema.get("properties", {}).items()}
+    if schema_type == "ARRAY":
+        return [_schema_example(schema.get("items", {}))]
+    if schema_type in ("NUMBER", "INTEGER"):
+        return 1
+    if schema_type == "BOOLEAN":
+        return True
+    return "mock"
+
+
+class MockUpstream:
+    """
+    يشغل الخادم في خيط خلفي. latency_ms تأخير ثابت لكل طلب، و per_kchar_ms تأخير إضافي لكل 1000 حرف في الرد
+    (يحاكي زمن توليد الرموز). يحصي الطلبات لكل نوع.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0, per_kchar_ms: float = 0):
+        self.latency_ms = latency_ms
+        self.per_kchar_ms = per_kchar_ms
+        self.request_counts = {}
+        self._lock = threading.Lock()
+        # طابور اتصالات أطول من الافتراضي (5) لقياس آلاف الطلبات المتزامنة في وضع ASGI
+        ThreadingHTTPServer.request_queue_size = 1024
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def environment(self) -> dict:
+        """
+        متغيرات البيئة التي توجه ai_services إلى هذا الخادم.
+        """
+        return {
+            "GEMINI_API_BASE_URL": f"{self.base_url}/v1beta/models/",
+            "IMAGEN_API_URL": f"{self.base_url}/v1beta/models/imagen:predict",
+            "GEMINI_API_KEY": "mock-key",
+            "IMAGEN_API_KEY": "mock-key",
+            # الخادم الوهمي بلا حصة؛ حد المعدل يبطئ القياس فقط
+            "GEMINI_REQUESTS_PER_MINUTE": "0",
+            "IMAGEN_REQUESTS_PER_MINUTE": "0",
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, kind: str):
+        with self._lock:
+            self.request_counts[kind] = self.request_counts.get(kind, 0) + 1
+
+    def _delay(self, response_chars: int):
+        time.sleep((self.latency_ms + self.per_kchar_ms * response_chars / 1000) / 1000)
+
+    def _handler_class(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, body: dict):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                path = self.path.split("?")[0]
+
+                if path.endswith(":predict"):
+                    upstream._count("imagen")
+                    with open(_PLACEHOLDER_PNG, "rb") as f:
+                        image = base64.b64encode(f.read()).decode("ascii")
+                    upstream._delay(0)
+                    self._send_json({"predictions": [{"bytesBase64Encoded": image}]})
+                    return
+
+                prompt = "".join(part.get("text", "") for content in payload.get("contents", []) for part in content.get("parts", []))
+                if path.endswith(":streamGenerateContent"):
+                    upstream._count("stream")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+                    for word in ("هذا", "رد", "تجريبي", "من", "الخادم", "المحاكي."):
+                        upstream._delay(len(word))
+                        chunk = {"candidates": [{"content": {"parts": [{"text": word + " "}]}}]}
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                    self.close_connection = True
+                    return
+
+                upstream._count("generate")
+                generation_config = payload.get("generationConfig", {})
+                match = _SCRIPT_RE.search(prompt)
+                if generation_config.get("responseSchema"):
+                    text = json.dumps(_schema_example(generation_config["responseSchema"]), ensure_ascii=False)
+                elif match:
+                    text = format_script_as_html(match.group(1))
+                else:
+                    text = "A mock response describing a calm illustrated book cover."
+                upstream._delay(len(text))
+                self._send_json({"candidates": [{"content": {"parts": [{"text": text}]}}]})
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--per-kchar-ms", type=float, default=0)
+    args = parser.parse_args()
+    upstream = MockUpstream(args.host, args.port, args.latency_ms, args.per_kchar_ms)
+    print(f"Mock upstream listening on {upstream.base_url}")
+    for name, value in upstream.environment().items():
+        print(f"  {name}={value}")
+    try:
+        upstream._server.serve_forever()
+    except KeyboardInterrupt:
+        upstream.stop()
+
+
+if __name__ == "__main__":
+    main()
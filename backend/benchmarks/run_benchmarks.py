@@ -0,0 +1,215 @@
+"""
+قياس زمن وذاكرة مراحل توليد الكتاب على مخطوطات اصطناعية، مع خادم Gemini/Imagen محاكي.
+
+المراحل: format (format_book_script_with_ai)، html (create_book_html)، pdf (generate_pdf_from_html)،
+و e2e (طلب POST إلى /generate-book عبر Flask test client).
+
+python benchmarks/run_benchmarks.py --pages 1 10 100 --languages ar en --latency-ms 500 --output results.json
+python benchmarks/run_benchmarks.py --pages 1 10 100 --compare results.json --threshold 0.2
+
+مع --compare يعود البرنامج بالرمز 1 إذا أبطأت أي مرحلة بأكثر من threshold مقارنة بالنتائج السابقة.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from manuscripts import LANGUAGES, make_manuscript # noqa: E402
+from mock_upstream import MockUpstream # noqa: E402
+
+STAGES = ("format", "html", "pdf", "e2e")
+
+
+def _current_rss_kb() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # بدون /proc (macOS): أعلى استهلاك منذ بدء العملية، بالبايت على macOS وبالكيلوبايت على Linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss // 1024 if sys.platform == "darwin" else max_rss
+
+
+class PeakRSS:
+    """
+    يراقب الذاكرة المقيمة (RSS) للعملية في خيط خلفي أثناء تنفيذ مرحلة، ويسجل أعلى قيمة.
+    """
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.start_kb = 0
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_kb = max(self.peak_kb, _current_rss_kb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.start_kb = self.peak_kb = _current_rss_kb()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_kb = max(self.peak_kb, _current_rss_kb())
+
+
+def _measure(func, repeat: int) -> tuple:
+    """
+    ينفذ func عدة مرات ويعيد (أفضل زمن، أعلى RSS، أكبر زيادة في RSS، نتيجة آخر تنفيذ).
+    """
+    best = None
+    peak_kb = 0
+    delta_kb = 0
+    result = None
+    for _ in range(repeat):
+        with PeakRSS() as rss:
+            started = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+        peak_kb = max(peak_kb, rss.peak_kb)
+        delta_kb = max(delta_kb, rss.peak_kb - rss.start_kb)
+    return best, peak_kb, delta_kb, result
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def run(args) -> dict:
+    upstream = MockUpstream(latency_ms=args.latency_ms, per_kchar_ms=args.per_kchar_ms).start()
+    os.environ.update(upstream.environment())
+    # كل تشغيل يجب أن يصل إلى الخادم المحاكي، والتوليد في العملية نفسها حتى تقاس ذاكرته
+    os.environ.setdefault("AI_CACHE_ENABLED", "false")
+    os.environ.setdefault("RENDER_POOL_WORKERS", str(args.render_workers))
+    # uploads و ذاكرة الردود تنشأ في مجلد مؤقت بدل مجلد المشروع
+    os.chdir(tempfile.mkdtemp(prefix="book-bench-"))
+
+    # الاستيراد بعد ضبط البيئة: config يقرأ المتغيرات عند تحميله
+    from ai_services import format_book_script_with_ai
+    from pdf_generator import create_book_html, generate_pdf_from_html
+    from app import app
+
+    client = app.test_client()
+    settings = {}
+    results = []
+    for language in args.languages:
+        for pages in args.pages:
+            script = make_manuscript(pages, language)
+            title = "كتاب تجريبي" if language == "ar" else "Benchmark Book"
+            record = {"language": language, "pages": pages, "script_chars": len(script)}
+
+            seconds, peak_kb, delta_kb, formatted = _measure(lambda: format_book_script_with_ai(script), args.repeat)
+            results.append(dict(record, stage="format", seconds=seconds, peak_rss_mb=peak_kb / 1024, rss_delta_mb=delta_kb / 1024))
+
+            seconds, peak_kb, delta_kb, html_content = _measure(
+                lambda: create_book_html(title, formatted, "", "", settings, inline_css=False), args.repeat)
+            results.append(dict(record, stage="html", seconds=seconds, peak_rss_mb=peak_kb / 1024, rss_delta_mb=delta_kb / 1024))
+
+            pdf_path = os.path.abspath(f"bench_{language}_{pages}.pdf")
+            seconds, peak_kb, delta_kb, _ = _measure(lambda: generate_pdf_from_html(html_content, pdf_path, settings), args.repeat)
+            results.append(dict(record, stage="pdf", seconds=seconds, peak_rss_mb=peak_kb / 1024, rss_delta_mb=delta_kb / 1024,
+                                pdf_bytes=os.path.getsize(pdf_path)))
+
+            def end_to_end():
+                response = client.post("/generate-book", json={"ebookTitle": title, "bookScript": script, "settings": settings})
+                if response.status_code != 200:
+                    raise RuntimeError(f"/generate-book returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+                return response.get_json()
+            seconds, peak_kb, delta_kb, _ = _measure(end_to_end, args.repeat)
+            results.append(dict(record, stage="e2e", seconds=seconds, peak_rss_mb=peak_kb / 1024, rss_delta_mb=delta_kb / 1024))
+
+            for result in results[-len(STAGES):]:
+                print(f"{language} {pages:4d}p {result['stage']:7s} {result['seconds']:9.3f}s  peak {result['peak_rss_mb']:8.1f} MB  +{result['rss_delta_mb']:7.1f} MB")
+
+    upstream.stop()
+    return {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "latency_ms": args.latency_ms,
+            "per_kchar_ms": args.per_kchar_ms,
+            "repeat": args.repeat,
+            "render_workers": args.render_workers,
+            "upstream_requests": upstream.request_counts,
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float, min_delta: float = 0.01) -> list:
+    """
+    يقارن أزمنة المراحل بنتائج سابقة ويعيد قائمة التراجعات (أبطأ من الأساس بأكثر من threshold).
+    الفروق الأصغر من min_delta ثانية تتجاهل، فلا تعد المراحل القصيرة جدا تراجعا بسبب التذبذب.
+    """
+    baseline_index = {(r["language"], r["pages"], r["stage"]): r for r in baseline.get("results", [])}
+    regressions = []
+    print(f"\nComparison against {baseline.get('meta', {}).get('commit') or 'baseline'} (threshold {threshold:.0%}):")
+    for result in current["results"]:
+        previous = baseline_index.get((result["language"], result["pages"], result["stage"]))
+        if previous is None or not previous["seconds"]:
+            continue
+        change = result["seconds"] / previous["seconds"] - 1
+        marker = "REGRESSION" if change > threshold and result["seconds"] - previous["seconds"] > min_delta else ""
+        print(f"{result['language']} {result['pages']:4d}p {result['stage']:7s} {previous['seconds']:9.3f}s -> {result['seconds']:9.3f}s ({change:+.1%}) {marker}")
+        if marker:
+            regressions.append(dict(result, baseline_seconds=previous["seconds"], change=change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--languages", nargs="+", choices=LANGUAGES, default=list(LANGUAGES))
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=0, help="تأخير ثابت لكل طلب إلى الخادم المحاكي")
+    parser.add_argument("--per-kchar-ms", type=float, default=0, help="تأخير إضافي لكل 1000 حرف في الرد")
+    parser.add_argument("--render-workers", type=int, default=0, help="RENDER_POOL_WORKERS أثناء القياس (0 لقياس ذاكرة التوليد)")
+    parser.add_argument("--output", help="ملف JSON لحفظ النتائج")
+    parser.add_argument("--compare", help="ملف JSON لنتائج سابقة للمقارنة")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--min-delta", type=float, default=0.01, help="أصغر فرق (بالثواني) يعد تراجعا")
+    args = parser.parse_args()
+    for path in ("output", "compare"):
+        if getattr(args, path):
+            setattr(args, path, os.path.abspath(getattr(args, path)))
+
+    report = run(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold, args.min_delta):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import hashlib
+import re
+from html.parser import HTMLParser
+
+# عناصر لا تغلق، فلا تدخل في مكدس العناصر المفتوحة
+VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+# عناصر يغلقها <h1> تلقائيا في HTML5، فلا تغلق يدويا ولا يعاد فتحها في الفصل التالي
+AUTO_CLOSED_BY_H1 = {"p"}
+
+_TAG_RE = re.compile(r"<[^>]+>")
+
+
+class _ChapterBoundaryParser(HTMLParser):
+    """
+    يجد مواضع بداية كل <h1> في النص، والعناصر المفتوحة (مثل <div dir="rtl">) عند كل موضع.
+    """
+    def __init__(self, html: str):
+        super().__init__(convert_charrefs=False)
+        # getpos يعد الأسطر بـ \n فقط، بخلاف splitlines التي تقسم أيضا عند U+2028 و U+0085 و \r وغيرها
+        self._line_offsets = [0]
+        for line in html.split('\n'):
+            self._line_offsets.append(self._line_offsets[-1] + len(line) + 1)
+        self.open_elements = [] # (اسم العنصر، نص وسم البداية)
+        self.boundaries = [] # (الموضع، العناصر المفتوحة عنده)
+
+    def _offset(self) -> int:
+        line, column = self.getpos()
+        return self._line_offsets[line - 1] + column
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "h1":
+            self.boundaries.append((self._offset(), list(self.open_elements)))
+        if tag not in VOID_ELEMENTS:
+            self.open_elements.append((tag, self.get_starttag_text()))
+
+    def handle_endtag(self, tag):
+        for i in range(len(self.open_elements) - 1, -1, -1):
+            if self.open_elements[i][0] == tag:
+                del self.open_elements[i:]
+                break
+
+
+def split_book_chapters(script_html: str) -> list:
+    """
+    يقسم HTML الكتاب المنسق إلى فصول عند حدود <h1>، مع بصمة محتوى (sha256) لكل فصل.
+    ما قبل أول <h1> (إن وجد) يكون فصلا مستقلا. العناصر المفتوحة عند الحد تغلق في نهاية الفصل
+    وتفتح من جديد في بداية الفصل التالي، فيبقى كل فصل HTML صالحا بمفرده.
+    """
+    parser = _ChapterBoundaryParser(script_html)
+    parser.feed(script_html)
+    parser.close()
+
+    boundaries = [(0, [])] + parser.boundaries
+    if len(boundaries) > 1:
+        preamble = script_html[:boundaries[1][0]]
+        if not _TAG_RE.sub("", preamble).strip() and "<img" not in preamble:
+            boundaries.pop(0) # لا مقدمة قبل أول فصل (فقط وسوم فتح مثل <div dir="rtl">)
+
+    chapters = []
+    for i, (start, open_elements) in enumerate(boundaries):
+        end, closing_elements = boundaries[i + 1] if i + 1 < len(boundaries) else (len(script_html), [])
+        prefix = "".join(start_tag for tag, start_tag in open_elements if tag not in AUTO_CLOSED_BY_H1)
+        suffix = "".join(f"</{tag}>" for tag, _ in reversed(closing_elements) if tag not in AUTO_CLOSED_BY_H1)
+        chapter_html = prefix + script_html[start:end] + suffix
+        chapters.append({
+            "index": len(chapters),
+            "html": chapter_html,
+            "hash": hashlib.sha256(chapter_html.encode("utf-8")).hexdigest(),
+        })
+    return chapters
@@ -0,0 +1,378 @@
+import hashlib
+import os
+import time
+import uuid
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from config import (
+    UPLOAD_FOLDER, STAGE_WORKERS, STAGE_TIMEOUT_FORMAT, STAGE_TIMEOUT_COVER, INCREMENTAL_RENDER,
+    BATCH_RENDER_CONCURRENCY, BATCH_RENDER_RETRIES
+)
+from ai_services import generate_cover_prompt_from_script, generate_image_from_prompt, format_book_script_with_ai, is_unformatted_html, COVER_PLACEHOLDER_URL
+from pdf_generator import create_book_html, generate_pdf_from_html
+from incremental_render import build_book_parts, render_book_parts
+from assets import prefetch_remote_asset
+from image_pipeline import prepare_html_images, print_image_uri
+from cover_store import COVER_ARTIFACT_KIND, store_data_uri_cover, cover_file_uri
+from artifact_store import get_artifact_store, make_artifact_key
+from drafts import formatted_draft_id, load_formatted_draft, load_cover_draft, is_valid_formatted_html
+from render_pool import RenderQueueFull, RenderTimeout, run_render_job
+from metrics import STAGE_SECONDS, BOOK_PAGES, BATCH_DEDUPLICATED, span
+from rate_limit import with_request_class
+
+# مجلد ملفات PDF القديم (book_<uuid>.pdf)؛ الملفات الجديدة تحفظ في مخزن الملفات باسم بصمة مدخلاتها
+PDF_OUTPUT_DIR = os.path.join(UPLOAD_FOLDER, 'pdfs')
+
+PDF_ARTIFACT_KIND = "pdfs"
+# يرفع عند تغيير شكل الكتاب المولد، فلا تعاد ملفات مولدة بالشكل السابق لنفس المدخلات
+BOOK_ARTIFACT_VERSION = 1
+
+# مراحل توليد الكتاب بالترتيب، تستخدم لتقارير التقدم في المهام الخلفية
+BOOK_STAGES = ["format", "cover", "html", "pdf"]
+
+# خيوط مشتركة لتنفيذ فرعي التنسيق والغلاف بالتوازي
+_stage_executor = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="book-stage")
+
+
+class BookPipelineError(Exception):
+    """
+    خطأ متوقع في إحدى مراحل توليد الكتاب، رسالته موجهة للمستخدم.
+    """
+    def __init__(self, message: str, status_code: int = 500, retry_after: int = None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.retry_after = retry_after # ثوان يقترح انتظارها قبل إعادة المحاولة (مع 503)
+
+
+def book_spec_from_request(data: dict) -> dict:
+    """
+    يستخلص مواصفات الكتاب من جسم طلب /generate-book.
+    draftId (من /format-script-with-ai) أو formattedHtml يغنيان عن تنسيق النص بواسطة AI،
+    و coverDraftId (من /generate-cover-descriptions) يملأ وصف الغلاف ونص الغلاف الخلفي إن لم يرسلا.
+    """
+    book_script = data.get('bookScript', '') # النص الخام
+    cover_prompt = data.get('coverPrompt', '')
+    back_cover_text = data.get('backCoverText', '') # نص الغلاف الخلفي
+    cover_draft = load_cover_draft(data.get('coverDraftId'))
+    if cover_draft is not None:
+        cover_prompt = cover_prompt or cover_draft.get('front_cover_prompt', '')
+        back_cover_text = back_cover_text or cover_draft.get('back_cover_text', '')
+    return {
+        "ebookTitle": data.get('ebookTitle', 'كتاب بدون عنوان'),
+        "bookScript": book_script,
+        "formattedHtml": _formatted_html_from_request(data, book_script),
+        "coverPrompt": cover_prompt,
+        "userProvidedCoverUrl": data.get('userProvidedCoverUrl', ''),
+        "backCoverText": back_cover_text,
+        "settings": data.get('settings', {}),
+    }
+
+
+def _formatted_html_from_request(data: dict, book_script: str) -> str:
+    """
+    HTML منسق مسبقا لهذا الكتاب، أو "" إن لزم التنسيق.
+    المسودة تستخدم فقط إن كانت لنص الكتاب المرسل نفسه (خاما أو بعد استبداله بالنص المنسق في الواجهة).
+    """
+    draft_id = data.get('draftId')
+    if draft_id:
+        draft_html = load_formatted_draft(draft_id)
+        if draft_html is not None and (book_script == draft_html or draft_id == formatted_draft_id(book_script)):
+            return draft_html
+        print("Warning: formatted draft is missing or does not match the book script. Formatting with AI.")
+
+    formatted_html = data.get('formattedHtml', '')
+    if formatted_html:
+        if is_valid_formatted_html(formatted_html):
+            return formatted_html
+        print("Warning: rejected client formatted HTML. Formatting with AI.")
+    return ""
+
+
+def _noop_stage(stage: str, status: str):
+    pass
+
+
+def _book_artifact_name(spec: dict) -> str:
+    return f"{make_artifact_key('book', BOOK_ARTIFACT_VERSION, spec)}.pdf"
+
+
+def _stored_book(spec: dict) -> dict | None:
+    """
+    نتيجة كتاب ولد سابقا من المواصفات نفسها، أو None. الغلاف المحفوظ يقرأ معه حتى لا يحذف قبله.
+    """
+    store = get_artifact_store()
+    stored = store.get(PDF_ARTIFACT_KIND, _book_artifact_name(spec))
+    if stored is None or not stored["meta"]:
+        return None
+    cover_url = stored["meta"].get("coverUrl", "")
+    if cover_url.startswith("/covers/") and store.get(COVER_ARTIFACT_KIND, cover_url[len("/covers/"):]) is None:
+        return None
+    return stored["meta"]
+
+
+def stored_pdf_path(filename: str) -> str | None:
+    """
+    مسار ملف PDF على القرص (في المخزن، أو في المجلد القديم)، أو None إن لم يوجد.
+    """
+    stored = get_artifact_store().get(PDF_ARTIFACT_KIND, filename)
+    if stored is not None:
+        return stored["path"]
+    legacy_path = os.path.join(os.path.abspath(PDF_OUTPUT_DIR), os.path.basename(filename))
+    return legacy_path if os.path.isfile(legacy_path) else None
+
+
+def _format_stage(raw_book_script: str, on_stage) -> str:
+    """
+    الخطوة 1: تنسيق النص الخام إلى HTML بواسطة AI.
+    """
+    on_stage("format", "running")
+    with span(STAGE_SECONDS, stage="format") as fields:
+        fields["script_chars"] = len(raw_book_script)
+        formatted_script_html = format_book_script_with_ai(raw_book_script)
+        if not formatted_script_html:
+            raise BookPipelineError("فشل الذكاء الاصطناعي في تنسيق نص الكتاب.")
+    on_stage("format", "done")
+    return formatted_script_html
+
+
+def _submit_format_stage(spec: dict, on_stage) -> Future:
+    """
+    يبدأ مرحلة التنسيق، أو يعيد نتيجة جاهزة إن وصل HTML منسق مع الطلب (لا طلب AI).
+    """
+    if not spec["formattedHtml"]:
+        return _stage_executor.submit(with_request_class(_format_stage), spec["bookScript"], on_stage)
+    on_stage("format", "done")
+    future = Future()
+    future.set_result(spec["formattedHtml"])
+    return future
+
+
+def _cover_stage(spec: dict, on_stage) -> tuple:
+    """
+    الخطوة 2: تحديد الغلاف (رابط المستخدم أو صورة مولدة من الوصف).
+    يعيد (الرابط المعاد للعميل، الرابط المستخدم في HTML عند التوليد).
+    """
+    on_stage("cover", "running")
+    with span(STAGE_SECONDS, stage="cover"):
+        urls = _resolve_cover(spec)
+    on_stage("cover", "done")
+    return urls
+
+
+def _resolve_cover(spec: dict) -> tuple:
+    if spec["userProvidedCoverUrl"]:
+        cover_url = spec["userProvidedCoverUrl"]
+    else:
+        cover_prompt_to_use = spec["coverPrompt"]
+        if not cover_prompt_to_use:
+            cover_prompt_to_use = generate_cover_prompt_from_script(spec["bookScript"]) # نستخدم النص الخام لتوليد وصف الغلاف
+        cover_url = generate_image_from_prompt(cover_prompt_to_use)
+
+    # صور base64 تفك مرة واحدة وتحفظ كملف: HTML والرد يحملان رابطا قصيرا بدل عدة ميغابايت
+    cover_filename = store_data_uri_cover(cover_url) if cover_url.startswith('data:') else None
+    if cover_filename:
+        # العميل يحصل على الصورة الأصلية، و PDF يستخدم نسخة مصغرة بدقة الطباعة
+        return f"/covers/{cover_filename}", print_image_uri(cover_file_uri(cover_filename))
+
+    # ننزل الغلاف الخارجي مرة واحدة هنا، فلا يتصل WeasyPrint بالشبكة أثناء التوليد
+    return cover_url, print_image_uri(prefetch_remote_asset(cover_url))
+
+
+def _await_stage(future, stage: str, deadline: float, on_stage):
+    """
+    ينتظر نتيجة مرحلة متوازية حتى موعدها النهائي، ويلغيها إن تجاوزته.
+    """
+    try:
+        return future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except (FutureTimeoutError, CancelledError):
+        # لا يمكن إيقاف خيط قيد التنفيذ، لكن الإلغاء يمنع بدء المرحلة إن لم تبدأ بعد
+        # وتتجاهل نتيجتها المتأخرة. في الدفعات قد يلغي المرحلة المشتركة كتاب آخر انتهت مهلته في الموعد نفسه
+        future.cancel()
+        on_stage(stage, "timed_out")
+        raise FutureTimeoutError()
+
+
+def run_book_pipeline(spec: dict, on_stage=None) -> dict:
+    """
+    ينفذ كامل مراحل توليد الكتاب ويعيد روابط الـ PDF والغلاف.
+    on_stage(stage, status) يستدعى عند بدء كل مرحلة وانتهائها لتتبع التقدم.
+    """
+    on_stage = on_stage or _noop_stage
+    raw_book_script = spec["bookScript"]
+    if not raw_book_script:
+        raise BookPipelineError("الرجاء توفير نص الكتاب.", 400)
+
+    # المواصفات المتطابقة تعيد الملف المولد سابقا دون طلبات AI أو توليد
+    stored = _stored_book(spec)
+    if stored is not None:
+        for stage in BOOK_STAGES:
+            on_stage(stage, "done")
+        return stored
+
+    # الخطوتان 1 و 2 مستقلتان: تنسيق النص بواسطة AI وتجهيز الغلاف يعملان بالتوازي
+    # ثم ننتظر كليهما قبل بناء HTML، فيصبح الزمن الكلي زمن الفرع الأبطأ فقط
+    started_at = time.monotonic()
+    format_future = _submit_format_stage(spec, on_stage)
+    cover_future = _stage_executor.submit(with_request_class(_cover_stage), spec, on_stage)
+    return _complete_book(spec, format_future, cover_future, started_at, on_stage)
+
+
+def _complete_book(spec: dict, format_future, cover_future, started_at: float, on_stage, owns_futures: bool = True) -> dict:
+    """
+    ينتظر مرحلتي التنسيق والغلاف ثم يبني HTML ويولد ملف PDF.
+    owns_futures=False للمراحل المشتركة بين كتب الدفعة: لا يلغي الغلاف إن فشل تنسيق هذا الكتاب.
+    """
+    try:
+        formatted_script_html = _await_stage(format_future, "format", started_at + STAGE_TIMEOUT_FORMAT, on_stage)
+    except FutureTimeoutError:
+        if owns_futures:
+            cover_future.cancel()
+        raise BookPipelineError("انتهت المهلة المحددة لتنسيق نص الكتاب بواسطة الذكاء الاصطناعي.", 504)
+    except Exception:
+        if owns_futures:
+            cover_future.cancel() # لا فائدة من انتظار الغلاف إذا فشل التنسيق
+        raise
+
+    try:
+        generated_cover_url, render_cover_url = _await_stage(cover_future, "cover", started_at + STAGE_TIMEOUT_COVER, on_stage)
+    except FutureTimeoutError:
+        print("Warning: cover stage timed out. Using placeholder image.")
+        generated_cover_url = render_cover_url = COVER_PLACEHOLDER_URL
+
+    # الخطوة 3: إنشاء محتوى HTML للكتاب مع الغلاف والإعدادات
+    on_stage("html", "running")
+    # الأنماط لا تضمن في HTML بل تمرر كورقة أنماط محللة مسبقا ومخزنة لكل ملف إعدادات
+    with span(STAGE_SECONDS, stage="html"):
+        # الصور داخل النص تفك وتصغر مرة واحدة هنا بدل تضمينها بحجمها الكامل في كل توليد
+        formatted_script_html = prepare_html_images(formatted_script_html)
+        if INCREMENTAL_RENDER:
+            # الكتاب يقسم إلى فصول بـ HTML وبصمة لكل منها، فلا يعاد تخطيط إلا ما تغير
+            book_parts = build_book_parts(spec["ebookTitle"], formatted_script_html, render_cover_url, spec["backCoverText"], spec["settings"])
+        else:
+            html_content = create_book_html(spec["ebookTitle"], formatted_script_html, render_cover_url, spec["backCoverText"], spec["settings"], inline_css=False)
+    on_stage("html", "done")
+
+    # الخطوة 4: توليد ملف PDF من محتوى HTML
+    on_stage("pdf", "running")
+    if generated_cover_url == COVER_PLACEHOLDER_URL or is_unformatted_html(formatted_script_html):
+        # كتاب بغلاف بديل أو بنص غير منسق (تعذر التوليد أو التنسيق) لا يعاد لطلبات لاحقة:
+        # يحفظ باسم عشوائي ويحذف بالتنظيف العادي
+        pdf_filename = f"{hashlib.sha256(uuid.uuid4().bytes).hexdigest()}.pdf"
+    else:
+        pdf_filename = _book_artifact_name(spec)
+    store = get_artifact_store()
+    pdf_path = store.temp_path(PDF_ARTIFACT_KIND, pdf_filename)
+    page_count = None
+    # التوليد يتم في عمليات عمال منفصلة (خارج GIL) إن كانت مفعلة
+    try:
+        with span(STAGE_SECONDS, stage="pdf") as fields:
+            if INCREMENTAL_RENDER:
+                page_count = run_render_job(render_book_parts, book_parts, pdf_path)
+            else:
+                page_count = run_render_job(generate_pdf_from_html, html_content, pdf_path, spec["settings"])
+            fields["pages"] = page_count
+    except RenderQueueFull as e:
+        raise BookPipelineError(str(e), 503, retry_after=e.retry_after)
+    except RenderTimeout as e:
+        raise BookPipelineError(str(e), 504)
+    finally:
+        if page_count is None and os.path.exists(pdf_path):
+            os.remove(pdf_path)
+    BOOK_PAGES.observe(page_count)
+
+    result = {
+        "pdfUrl": f"/download-pdf/{pdf_filename}",
+        "coverUrl": generated_cover_url,
+        "message": "تم توليد الكتاب بنجاح!"
+    }
+    store.commit(PDF_ARTIFACT_KIND, pdf_filename, pdf_path, meta=result)
+    on_stage("pdf", "done")
+    return result
+
+
+def _cover_dedupe_key(spec: dict, script_key: str) -> tuple:
+    """
+    كتب الدفعة التي تعطي الغلاف نفسه: نفس رابط المستخدم، أو نفس الوصف، أو نفس النص (يولد منه الوصف).
+    """
+    if spec["userProvidedCoverUrl"]:
+        return ("url", spec["userProvidedCoverUrl"])
+    if spec["coverPrompt"]:
+        return ("prompt", spec["coverPrompt"])
+    return ("script", script_key)
+
+
+def _complete_batch_book(spec: dict, format_future, cover_future, started_at: float) -> dict:
+    # الطابور قد يمتلئ بطلبات أخرى؛ الدفعة تنتظر وتعيد المحاولة بدل إفشال الكتاب
+    for attempt in range(BATCH_RENDER_RETRIES + 1):
+        try:
+            return _complete_book(spec, format_future, cover_future, started_at, _noop_stage, owns_futures=False)
+        except BookPipelineError as e:
+            if e.status_code != 503 or not e.retry_after or attempt == BATCH_RENDER_RETRIES:
+                raise
+            time.sleep(e.retry_after)
+
+
+def iter_book_batch(specs: list):
+    """
+    يولد دفعة كتب ويعيد نتيجة كل كتاب فور انتهائه (بترتيب الانتهاء لا ترتيب الطلب).
+    التنسيق والغلاف ينفذان مرة واحدة لكل نص أو غلاف متطابق في الدفعة، والتوليد يوزع على عمال PDF
+    بعدد لا يتجاوز BATCH_RENDER_CONCURRENCY حتى لا تملأ الدفعة وحدها طابور التوليد.
+    كل نتيجة تحمل index و ebookTitle و status ("succeeded" أو "failed").
+    """
+    started_at = time.monotonic()
+    format_futures = {}
+    cover_futures = {}
+    pending = []
+    for index, spec in enumerate(specs):
+        if not spec["bookScript"]:
+            yield {"index": index, "ebookTitle": spec["ebookTitle"], "status": "failed", "error": "الرجاء توفير نص الكتاب."}
+            continue
+        stored = _stored_book(spec)
+        if stored is not None:
+            yield {"index": index, "ebookTitle": spec["ebookTitle"], "status": "succeeded", **stored}
+            continue
+        script_key = hashlib.sha256(spec["bookScript"].encode("utf-8")).hexdigest()
+        format_key = (script_key, spec["formattedHtml"])
+        if format_key not in format_futures:
+            format_futures[format_key] = _submit_format_stage(spec, _noop_stage)
+        cover_key = _cover_dedupe_key(spec, script_key)
+        if cover_key not in cover_futures:
+            cover_futures[cover_key] = _stage_executor.submit(with_request_class(_cover_stage), spec, _noop_stage)
+        pending.append((index, spec, format_futures[format_key], cover_futures[cover_key]))
+
+    BATCH_DEDUPLICATED.inc(len(pending) - len(format_futures), kind="format")
+    BATCH_DEDUPLICATED.inc(len(pending) - len(cover_futures), kind="cover")
+
+    # خيوط خاصة بالدفعة: تنتظر مراحل _stage_executor، فلا يجوز أن تشغل خيوطه نفسها
+    with ThreadPoolExecutor(max_workers=BATCH_RENDER_CONCURRENCY, thread_name_prefix="book-batch") as executor:
+        futures = {
+            executor.submit(_complete_batch_book, spec, format_future, cover_future, started_at): (index, spec)
+            for index, spec, format_future, cover_future in pending
+        }
+        for future in as_completed(futures):
+            index, spec = futures[future]
+            entry = {"index": index, "ebookTitle": spec["ebookTitle"]}
+            try:
+                yield {**entry, "status": "succeeded", **future.result()}
+            except BookPipelineError as e:
+                yield {**entry, "status": "failed", "error": e.message}
+            except Exception as e:
+                print(f"Error in batch book {index}: {e}")
+                yield {**entry, "status": "failed", "error": f"حدث خطأ أثناء توليد الكتاب: {str(e)}"}
+
+
+def run_book_batch(specs: list, on_stage=None) -> dict:
+    """
+    يولد دفعة كتب كاملة ويعيد بيانها (manifest) بترتيب الطلب.
+    on_stage("book-<index>", status) يستدعى عند انتهاء كل كتاب لتتبع التقدم في المهام الخلفية.
+    """
+    on_stage = on_stage or _noop_stage
+    books = [None] * len(specs)
+    for result in iter_book_batch(specs):
+        books[result["index"]] = result
+        on_stage(f"book-{result['index']}", "done" if result["status"] == "succeeded" else "failed")
+    return {
+        "books": books,
+        "succeeded": sum(1 for book in books if book["status"] == "succeeded"),
+        "failed": sum(1 for book in books if book["status"] == "failed"),
+    }
@@ -0,0 +1,118 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from config import CHAT_SESSION_TTL, CHAT_MAX_SESSIONS, CHAT_RECENT_TURNS, CHAT_CONTEXT_MAX_CHARS, CHAT_SUMMARY_MAX_CHARS, CHAT_MAX_SESSION_TURNS
+from metrics import registry
+from ai_services import summarize_chat_turns
+
+
+def _turn_text(turn: dict) -> str:
+    return "".join(part.get("text", "") for part in turn.get("parts", []))
+
+
+class ChatSession:
+    """
+    جلسة دردشة محفوظة على الخادم: الأدوار التي لم تدمج بعد، وملخص للأدوار القديمة التي خرجت من نافذة السياق.
+    """
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.turns = []
+        self.summary = ""
+        self.last_access = time.time()
+        self.lock = threading.Lock()
+
+    def append(self, role: str, text: str):
+        self.turns.append({"role": role, "parts": [{"text": text}]})
+        if len(self.turns) > CHAT_MAX_SESSION_TURNS:
+            # حد أمان لذاكرة الجلسة؛ التلخيص في context يبقيها عادة أقصر بكثير
+            del self.turns[:len(self.turns) - CHAT_MAX_SESSION_TURNS]
+            while self.turns and self.turns[0]["role"] != "user":
+                del self.turns[0]
+
+    def _window_start(self) -> int:
+        """
+        بداية الأدوار التي ترسل حرفيا: آخر CHAT_RECENT_TURNS دورا ضمن حد الأحرف،
+        وتبدأ دائما بدور للمستخدم كما يتطلب Gemini.
+        """
+        start = max(0, len(self.turns) - CHAT_RECENT_TURNS)
+        total = sum(len(_turn_text(turn)) for turn in self.turns[start:])
+        while start < len(self.turns) - 1 and total > CHAT_CONTEXT_MAX_CHARS:
+            total -= len(_turn_text(self.turns[start]))
+            start += 1
+        while start < len(self.turns) and self.turns[start]["role"] != "user":
+            start += 1
+        return start
+
+    def context(self) -> list:
+        """
+        يبني السياق المرسل إلى Gemini: الملخص المخزن ثم الأدوار الحديثة حرفيا.
+        الأدوار التي تخرج من النافذة تدمج في الملخص مرة واحدة ثم تحذف، فيبقى حجم الطلب والجلسة محدودا مهما طالت المحادثة.
+        """
+        start = self._window_start()
+        if start > 0:
+            self.summary = summarize_chat_turns(self.summary, self.turns[:start])[:CHAT_SUMMARY_MAX_CHARS]
+            del self.turns[:start]
+        return self._history()
+
+    async def async_context(self) -> list:
+        """
+        مثل context لوضع ASGI: تلخيص الأدوار القديمة لا يحجز حلقة الأحداث.
+        """
+        # استيراد متأخر: وضع Flask لا يحتاج httpx
+        from ai_services_async import summarize_chat_turns as summarize_chat_turns_async
+        start = self._window_start()
+        if start > 0:
+            self.summary = (await summarize_chat_turns_async(self.summary, self.turns[:start]))[:CHAT_SUMMARY_MAX_CHARS]
+            del self.turns[:start]
+        return self._history()
+
+    def _history(self) -> list:
+        history = []
+        if self.summary:
+            history.append({"role": "user", "parts": [{"text": f"ملخص ما سبق من المحادثة:\n{self.summary}"}]})
+            history.append({"role": "model", "parts": [{"text": "حسنا، سأتابع المحادثة بناء على هذا الملخص."}]})
+        return history + self.turns
+
+
+class ChatSessionStore:
+    """
+    مخزن جلسات الدردشة في الذاكرة مع حذف الجلسات الخاملة والأقدم استخداما عند تجاوز الحد.
+    """
+    def __init__(self, max_sessions: int = CHAT_MAX_SESSIONS, ttl: int = CHAT_SESSION_TTL):
+        self._sessions = OrderedDict()
+        self._max_sessions = max_sessions
+        self._ttl = ttl
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float):
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if len(self._sessions) <= self._max_sessions and now - oldest.last_access <= self._ttl:
+                break
+            self._sessions.popitem(last=False)
+
+    def get_or_create(self, session_id: str | None) -> ChatSession:
+        """
+        يعيد الجلسة المطلوبة، أو جلسة جديدة إذا لم يرسل معرف أو انتهت صلاحية الجلسة.
+        """
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id) if session_id else None
+            if session is not None and now - session.last_access > self._ttl:
+                session = None
+            if session is None:
+                session = ChatSession(uuid.uuid4().hex)
+                self._sessions[session.id] = session
+            session.last_access = now
+            self._sessions.move_to_end(session.id)
+            self._evict(now)
+            return session
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+chat_session_store = ChatSessionStore()
+
+registry.callback("chat_sessions_active", "Chat sessions held in memory.", lambda: len(chat_session_store))
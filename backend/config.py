@@ -17,4 +17,167 @@ ALLOWED_EXTENSIONS = {'txt', 'pdf'}
 
 # تأكد من وجود مجلد التحميل
 if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
\ No newline at end of file
+    os.makedirs(UPLOAD_FOLDER)
+
+# إعدادات طابور المهام الخلفية لتوليد الكتب
+# عدد العمال الذين ينفذون مهام توليد الكتب بالتوازي
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# الحد الأقصى لعدد المهام المنتظرة قبل رفض مهام جديدة
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "20"))
+# مدة الاحتفاظ بنتيجة المهمة المنتهية (بالثواني)
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "3600"))
+
+# تنفيذ مراحل الذكاء الاصطناعي المستقلة (التنسيق والغلاف) بالتوازي
+# عدد الخيوط المشتركة لتنفيذ المراحل المتوازية
+STAGE_WORKERS = int(os.getenv("STAGE_WORKERS", "8"))
+# المهلة القصوى لمرحلة تنسيق النص (بالثواني)
+STAGE_TIMEOUT_FORMAT = float(os.getenv("STAGE_TIMEOUT_FORMAT", "300"))
+# المهلة القصوى لمرحلة الغلاف (وصف + صورة) قبل استخدام الصورة البديلة
+STAGE_TIMEOUT_COVER = float(os.getenv("STAGE_TIMEOUT_COVER", "120"))
+
+# تقسيم المخطوطات الطويلة إلى أجزاء لتنسيقها بالتوازي بواسطة AI
+# الحد الأقصى لعدد أحرف كل جزء يرسل إلى Gemini
+AI_FORMAT_CHUNK_CHARS = int(os.getenv("AI_FORMAT_CHUNK_CHARS", "6000"))
+# عدد الأجزاء التي تنسق في الوقت نفسه
+AI_FORMAT_CONCURRENCY = int(os.getenv("AI_FORMAT_CONCURRENCY", "4"))
+
+# ذاكرة مؤقتة لردود Gemini لتجنب إعادة الطلبات المتطابقة
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# عدد الردود المحفوظة في الذاكرة (الطبقة الأسرع)
+AI_CACHE_MEMORY_ENTRIES = int(os.getenv("AI_CACHE_MEMORY_ENTRIES", "256"))
+# مسار قاعدة بيانات الطبقة الدائمة على القرص
+AI_CACHE_PATH = os.getenv("AI_CACHE_PATH", os.path.join(UPLOAD_FOLDER, 'cache', 'ai_responses.sqlite3'))
+# مدة صلاحية الرد المخزن (بالثواني)، الافتراضي 7 أيام
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", str(7 * 24 * 3600)))
+# الحجم الأقصى للطبقة الدائمة (بالبايت) قبل حذف الأقدم استخداما
+AI_CACHE_MAX_BYTES = int(os.getenv("AI_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+# تحليل المخطوطة الموحد: وصف الغلاف ونص الغلاف الخلفي وإعدادات التصميم في طلب Gemini واحد
+# ميزانية المقتطف المرسل للتحليل (بالرموز tokens)، يؤخذ من الكتاب كله لا من بدايته فقط
+MANUSCRIPT_ANALYSIS_TOKEN_BUDGET = int(os.getenv("MANUSCRIPT_ANALYSIS_TOKEN_BUDGET", "1500"))
+# عدد التحليلات المحفوظة في الذاكرة
+MANUSCRIPT_ANALYSIS_CACHE_ENTRIES = int(os.getenv("MANUSCRIPT_ANALYSIS_CACHE_ENTRIES", "256"))
+
+# حد مدخلات نموذج Gemini (بالرموز)؛ ميزانيات المقتطفات لا تتجاوزه بعد التعليمات ومساحة الرد
+GEMINI_INPUT_TOKEN_LIMIT = int(os.getenv("GEMINI_INPUT_TOKEN_LIMIT", "30720"))
+
+# عناوين خدمات Google AI (يمكن توجيهها إلى خادم محاكاة محلي في الاختبارات)
+GEMINI_API_BASE_URL = os.getenv("GEMINI_API_BASE_URL", "https://generativelanguage.googleapis.com/v1beta/models/")
+IMAGEN_API_URL = os.getenv("IMAGEN_API_URL", "https://generativelanguage.googleapis.com/v1beta/models/imagen-3.0-generate-002:predict")
+
+# إعدادات عميل HTTP المشترك لخدمات Gemini و Imagen
+# عدد الاتصالات المحفوظة (keep-alive) لكل مضيف
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+# الحد الأقصى للاتصالات المفتوحة في الوقت نفسه في وضع ASGI (asgi_app.py)؛ ما زاد ينتظر اتصالا حرا
+HTTP_ASYNC_MAX_CONNECTIONS = int(os.getenv("HTTP_ASYNC_MAX_CONNECTIONS", "500"))
+# مهلة إنشاء الاتصال ومهلة انتظار الرد (بالثواني)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+# عدد مرات إعادة المحاولة على 429 و 5xx وأعطال الشبكة
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+# أساس وسقف التأخير الأسي بين المحاولات (بالثواني)
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "20"))
+# عدد الأعطال المتتالية التي تفتح الدائرة، ومدة بقائها مفتوحة قبل طلب تجريبي
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+# حدود معدل الطلبات إلى خدمات AI: دلو رموز لكل نموذج، وطابور عادل بين المستخدمين عند نفاده
+# طلبات Gemini في الدقيقة لكل نموذج، وطلبات Imagen في الدقيقة؛ 0 يعطل الحد
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "60"))
+IMAGEN_REQUESTS_PER_MINUTE = float(os.getenv("IMAGEN_REQUESTS_PER_MINUTE", "10"))
+# حدود خاصة لنماذج بعينها بصيغة "model=rpm,model=rpm" (مثال: gemini-pro=120,imagen-3.0-generate-002=20)
+UPSTREAM_MODEL_RATE_LIMITS = os.getenv("UPSTREAM_MODEL_RATE_LIMITS", "")
+# عدد الطلبات المسموح بها دفعة واحدة قبل التقيد بالمعدل (سعة الدلو)
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "5"))
+# أقصى مدة انتظار في الطابور قبل إفشال الطلب (بالثواني)
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "120"))
+# وزن الطلبات التفاعلية (الدردشة واقتراح النمط) مقابل وزن 1 للطلبات الكبيرة (تنسيق الكتب)
+RATE_LIMIT_INTERACTIVE_WEIGHT = float(os.getenv("RATE_LIMIT_INTERACTIVE_WEIGHT", "8"))
+
+# جلسات الدردشة على الخادم ونافذة السياق
+# مدة بقاء الجلسة الخاملة (بالثواني) والحد الأقصى لعدد الجلسات في الذاكرة
+CHAT_SESSION_TTL = int(os.getenv("CHAT_SESSION_TTL", str(6 * 3600)))
+CHAT_MAX_SESSIONS = int(os.getenv("CHAT_MAX_SESSIONS", "1000"))
+# عدد الأدوار الأخيرة المرسلة حرفيا، وحد أحرفها؛ ما قبلها يدمج في ملخص
+CHAT_RECENT_TURNS = int(os.getenv("CHAT_RECENT_TURNS", "10"))
+CHAT_CONTEXT_MAX_CHARS = int(os.getenv("CHAT_CONTEXT_MAX_CHARS", "12000"))
+# الحد الأقصى لطول ملخص المحادثة (بالأحرف)
+CHAT_SUMMARY_MAX_CHARS = int(os.getenv("CHAT_SUMMARY_MAX_CHARS", "2000"))
+# الحد الأقصى لعدد الأدوار المحفوظة في الجلسة الواحدة (غير المدمجة في الملخص)
+CHAT_MAX_SESSION_TURNS = int(os.getenv("CHAT_MAX_SESSION_TURNS", "100"))
+
+# الأصول المحلية أثناء توليد PDF (بدون أي اتصال شبكي)
+# صورة الغلاف البديلة عند تعذر توليد صورة، تقدم من static/cover_placeholder.png عند التوليد
+COVER_PLACEHOLDER_URL = "https://placehold.co/600x800/E0E0E0/333333?text=Cover+Placeholder"
+# الحجم الأقصى لذاكرة الأصول (الخطوط والصور) بالبايت
+ASSET_CACHE_MAX_BYTES = int(os.getenv("ASSET_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# الحجم الأقصى لصورة خارجية تنزل مسبقا (مثل غلاف من رابط المستخدم)
+ASSET_REMOTE_MAX_BYTES = int(os.getenv("ASSET_REMOTE_MAX_BYTES", str(10 * 1024 * 1024)))
+
+# مجموعة عمليات توليد PDF (WeasyPrint) خارج قفل GIL
+# عدد العمليات الدائمة؛ 0 يعني التوليد في الخيط نفسه
+RENDER_POOL_WORKERS = int(os.getenv("RENDER_POOL_WORKERS", "2"))
+# عدد المهام المسموح بانتظارها قبل الرد بـ 503
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", "8"))
+# المهلة القصوى لتوليد ملف واحد (بالثواني)
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "180"))
+# عدد المهام التي ينفذها العامل قبل استبداله بعملية جديدة
+RENDER_MAX_JOBS_PER_WORKER = int(os.getenv("RENDER_MAX_JOBS_PER_WORKER", "50"))
+# حد الذاكرة لكل عامل (بالميغابايت)؛ 0 يعني بدون حد
+RENDER_MEMORY_LIMIT_MB = int(os.getenv("RENDER_MEMORY_LIMIT_MB", "2048"))
+# القيمة المقترحة لترويسة Retry-After عند امتلاء الطابور (بالثواني)
+RENDER_RETRY_AFTER = int(os.getenv("RENDER_RETRY_AFTER", "15"))
+
+# تسليم الملفات الكبيرة (PDF والأغلفة) للخادم الأمامي بدل بثها من Flask
+# USE_X_SENDFILE لخوادم Apache/lighttpd، و X_ACCEL_REDIRECT_PREFIX لمسار internal في nginx يشير إلى مجلد uploads
+USE_X_SENDFILE = os.getenv("USE_X_SENDFILE", "false").lower() in ("1", "true", "yes")
+X_ACCEL_REDIRECT_PREFIX = os.getenv("X_ACCEL_REDIRECT_PREFIX", "")
+
+# إعادة التوليد التزايدي: كل فصل يخطط كمستند مستقل وتعاد صفحاته المخزنة إن لم يتغير
+INCREMENTAL_RENDER = os.getenv("INCREMENTAL_RENDER", "true").lower() in ("1", "true", "yes")
+# عدد أجزاء الكتاب (فصول، غلاف، فهرس) المخططة التي يحتفظ بها كل عامل توليد
+INCREMENTAL_RENDER_CACHE_PARTS = int(os.getenv("INCREMENTAL_RENDER_CACHE_PARTS", "128"))
+# الحد الأقصى للحجم التقديري للأجزاء المخططة في ذاكرة كل عامل (بالميغابايت)، ويحسب ضمن RENDER_MEMORY_LIMIT_MB
+INCREMENTAL_RENDER_CACHE_MB = int(os.getenv("INCREMENTAL_RENDER_CACHE_MB", "256"))
+
+# المراقبة: مقاييس Prometheus على /metrics وسجلات JSON منظمة اختيارية
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+METRICS_JSON_LOGS = os.getenv("METRICS_JSON_LOGS", "false").lower() in ("1", "true", "yes")
+
+# توليد الكتب على دفعات (/generate-books)
+# الحد الأقصى لعدد الكتب في الطلب الواحد
+BATCH_MAX_BOOKS = int(os.getenv("BATCH_MAX_BOOKS", "50"))
+# عدد كتب الدفعة التي تولد في الوقت نفسه (افتراضيا عدد عمال التوليد)
+BATCH_RENDER_CONCURRENCY = int(os.getenv("BATCH_RENDER_CONCURRENCY", str(max(1, RENDER_POOL_WORKERS))))
+# عدد مرات إعادة محاولة توليد كتاب عند امتلاء طابور التوليد
+BATCH_RENDER_RETRIES = int(os.getenv("BATCH_RENDER_RETRIES", "3"))
+
+# مخزن الملفات الناتجة (PDF والأغلفة) بأسماء مشتقة من مدخلاتها
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", os.path.join(UPLOAD_FOLDER, 'artifacts'))
+# الحجم الكلي الأقصى (بالبايت) قبل حذف الأقدم استخداما، الافتراضي 5 غيغابايت
+ARTIFACT_MAX_BYTES = int(os.getenv("ARTIFACT_MAX_BYTES", str(5 * 1024 * 1024 * 1024)))
+# مدة صلاحية الملف (بالثواني)، الافتراضي 30 يوما
+ARTIFACT_TTL = int(os.getenv("ARTIFACT_TTL", str(30 * 24 * 3600)))
+# الفاصل بين جولات التنظيف في الخيط الخلفي (بالثواني)
+ARTIFACT_EVICT_INTERVAL = float(os.getenv("ARTIFACT_EVICT_INTERVAL", "600"))
+
+# تجهيز الصور (الغلاف والصور داخل النص) قبل التوليد: تصغير إلى دقة الطباعة وإعادة ضغط
+IMAGE_OPTIMIZE_ENABLED = os.getenv("IMAGE_OPTIMIZE_ENABLED", "true").lower() in ("1", "true", "yes")
+# دقة الطباعة المستهدفة (نقطة لكل بوصة)؛ لا تكبر الصورة عن صفحة A4 بهذه الدقة
+IMAGE_PRINT_DPI = int(os.getenv("IMAGE_PRINT_DPI", "300"))
+# جودة ضغط JPEG للصور غير الشفافة
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+# فهرس اقتراحات التصميم: الأوصاف المتشابهة تعيد إعدادات وصف سابق دون طلب Gemini
+STYLE_INDEX_ENABLED = os.getenv("STYLE_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+# مسار قاعدة بيانات الأوصاف والإعدادات المحفوظة
+STYLE_INDEX_PATH = os.getenv("STYLE_INDEX_PATH", os.path.join(UPLOAD_FOLDER, 'cache', 'style_index.sqlite3'))
+# عدد خانات متجه الوصف (تجزئة المقاطع)، وعدد الأوصاف المحفوظة قبل حذف الأقدم استخداما
+STYLE_INDEX_DIMENSIONS = int(os.getenv("STYLE_INDEX_DIMENSIONS", "4096"))
+STYLE_INDEX_MAX_ENTRIES = int(os.getenv("STYLE_INDEX_MAX_ENTRIES", "2000"))
+# أدنى تشابه (جيب التمام بين 0 و 1) لإعادة إعدادات وصف سابق
+STYLE_INDEX_SIMILARITY_THRESHOLD = float(os.getenv("STYLE_INDEX_SIMILARITY_THRESHOLD", "0.7"))
+
+# وضع ASGI (asgi_app.py): الحد الأقصى لحجم جسم الطلب (بالبايت)
+ASGI_MAX_BODY_BYTES = int(os.getenv("ASGI_MAX_BODY_BYTES", str(64 * 1024 * 1024)))
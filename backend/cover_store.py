@@ -0,0 +1,49 @@
+import base64
+import binascii
+import hashlib
+import pathlib
+import re
+from artifact_store import get_artifact_store
+
+COVER_ARTIFACT_KIND = "covers"
+
+_DATA_URI_RE = re.compile(r'^data:image/(png|jpeg|jpg|webp|gif);base64,', re.IGNORECASE)
+
+
+def store_cover_bytes(data: bytes, extension: str) -> str:
+    """
+    يحفظ صورة الغلاف كملف ثنائي باسم مشتق من محتواها ويعيد اسم الملف.
+    المحتوى المتطابق يحفظ مرة واحدة فقط.
+    """
+    filename = f"{hashlib.sha256(data).hexdigest()}.{extension}"
+    return get_artifact_store().put_bytes(COVER_ARTIFACT_KIND, filename, data)
+
+
+def store_data_uri_cover(data_uri: str) -> str | None:
+    """
+    يفك رابط data:image/...;base64 مرة واحدة ويحفظه كملف، ويعيد اسم الملف أو None إن لم يكن رابط صورة صالحا.
+    """
+    match = _DATA_URI_RE.match(data_uri)
+    if not match:
+        return None
+    try:
+        data = base64.b64decode(data_uri[match.end():], validate=False)
+    except (binascii.Error, ValueError):
+        return None
+    extension = match.group(1).lower().replace('jpg', 'jpeg')
+    return store_cover_bytes(data, extension)
+
+
+def cover_path(filename: str) -> str | None:
+    """
+    مسار الغلاف المحفوظ في مخزن الملفات، أو None إن لم يوجد.
+    """
+    stored = get_artifact_store().get(COVER_ARTIFACT_KIND, filename)
+    return stored["path"] if stored is not None else None
+
+
+def cover_file_uri(filename: str) -> str:
+    """
+    رابط file:// للغلاف المحفوظ، يستخدم داخل HTML عند توليد PDF.
+    """
+    return pathlib.Path(cover_path(filename) or get_artifact_store().path_for(COVER_ARTIFACT_KIND, filename)).as_uri()
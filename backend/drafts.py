@@ -0,0 +1,110 @@
+import json
+import re
+from html.parser import HTMLParser
+from artifact_store import get_artifact_store, make_artifact_key
+
+# مسودات نتائج AI (النص المنسق وأوصاف الغلاف) تحفظ في مخزن الملفات، ويعاد استخدامها بهويتها
+# في /generate-book بدل طلب التنسيق أو الأوصاف من Gemini مرة أخرى
+DRAFT_ARTIFACT_KIND = "drafts"
+
+_DRAFT_ID_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# وسوم لا مكان لها في نص الكتاب المنسق (تنفيذ أو تضمين موارد أو تغيير أساس الروابط)
+_FORBIDDEN_TAGS = {"script", "iframe", "object", "embed", "link", "meta", "base", "form", "frame", "frameset"}
+_URL_ATTRIBUTES = {"src", "href", "srcset", "poster", "data"}
+
+
+def formatted_draft_id(raw_script: str) -> str:
+    """
+    هوية مسودة التنسيق لنص خام: بصمته، فالنص نفسه يعطي الهوية نفسها.
+    """
+    return make_artifact_key("formatted", raw_script)
+
+
+def _cover_draft_id(book_content: str) -> str:
+    return make_artifact_key("cover-descriptions", book_content)
+
+
+def _read_draft(name: str) -> str | None:
+    stored = get_artifact_store().get(DRAFT_ARTIFACT_KIND, name)
+    if stored is None:
+        return None
+    try:
+        with open(stored["path"], 'r', encoding='utf-8') as f:
+            return f.read()
+    except OSError:
+        return None # حذف بالتنظيف بين قراءة الفهرس وفتح الملف
+
+
+def save_formatted_draft(raw_script: str, formatted_html: str) -> str:
+    """
+    يحفظ HTML المنسق لنص خام ويعيد هوية المسودة (بصمة النص الخام).
+    """
+    draft_id = formatted_draft_id(raw_script)
+    get_artifact_store().put_bytes(DRAFT_ARTIFACT_KIND, f"{draft_id}.html", formatted_html.encode('utf-8'))
+    return draft_id
+
+
+def load_formatted_draft(draft_id: str) -> str | None:
+    """
+    يعيد HTML المنسق المحفوظ بهذه الهوية، أو None إن لم توجد المسودة أو انتهت صلاحيتها.
+    """
+    if not isinstance(draft_id, str) or not _DRAFT_ID_RE.match(draft_id):
+        return None
+    return _read_draft(f"{draft_id}.html")
+
+
+def save_cover_draft(book_content: str, cover_descriptions: dict) -> str:
+    """
+    يحفظ أوصاف الغلافين المولدة لمحتوى كتاب ويعيد هوية المسودة.
+    """
+    draft_id = _cover_draft_id(book_content)
+    data = json.dumps(cover_descriptions, ensure_ascii=False).encode('utf-8')
+    get_artifact_store().put_bytes(DRAFT_ARTIFACT_KIND, f"{draft_id}.json", data)
+    return draft_id
+
+
+def load_cover_draft(draft_id: str) -> dict | None:
+    """
+    يعيد أوصاف الغلافين المحفوظة بهذه الهوية، أو None.
+    """
+    if not isinstance(draft_id, str) or not _DRAFT_ID_RE.match(draft_id):
+        return None
+    data = _read_draft(f"{draft_id}.json")
+    if data is None:
+        return None
+    try:
+        descriptions = json.loads(data)
+    except json.JSONDecodeError:
+        return None
+    return descriptions if isinstance(descriptions, dict) else None
+
+
+class _FormattedHtmlValidator(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.valid = True
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _FORBIDDEN_TAGS:
+            self.valid = False
+        for name, value in attrs:
+            if name.startswith("on"):
+                self.valid = False
+            elif name in _URL_ATTRIBUTES and value and re.sub(r'\s+', '', value).lower().startswith(("javascript:", "file:")):
+                self.valid = False
+
+    handle_startendtag = handle_starttag
+
+
+def is_valid_formatted_html(html: str) -> bool:
+    """
+    يتحقق من HTML منسق يرسله العميل قبل استخدامه مباشرة بدل التنسيق: بلا وسوم تنفيذ أو تضمين،
+    بلا سمات أحداث (on*)، وبلا روابط javascript: أو file:.
+    """
+    if not isinstance(html, str) or not html.strip():
+        return False
+    validator = _FormattedHtmlValidator()
+    validator.feed(html)
+    validator.close()
+    return validator.valid
@@ -0,0 +1,214 @@
+import json
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from config import (
+    HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_MAX_RETRIES,
+    HTTP_BACKOFF_BASE, HTTP_BACKOFF_MAX, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT
+)
+from metrics import UPSTREAM_SECONDS, UPSTREAM_REQUESTS, UPSTREAM_BYTES, log_event
+from rate_limit import RateLimitTimeout, acquire_upstream_slot, penalize_upstream
+
+# أكواد الحالة التي تعتبر أعطالا مؤقتة تستحق إعادة المحاولة
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """
+    يرفع فورا دون اتصال عندما تكون دائرة الخدمة مفتوحة بعد أعطال متتالية.
+    """
+
+
+class CircuitBreaker:
+    """
+    قاطع دائرة بسيط: بعد عدد من الأعطال المتتالية يرفض الطلبات لفترة،
+    ثم يسمح بطلب تجريبي واحد (نصف مفتوح) ليقرر الإغلاق أو إعادة الفتح.
+    """
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed" # closed | open | half_open
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def _rejection(self) -> str | None:
+        if self.state == "open" and time.monotonic() - self._opened_at < self.reset_timeout:
+            return f"الخدمة {self.name} غير متاحة مؤقتا (الدائرة مفتوحة)."
+        if self.state == "half_open":
+            # طلب تجريبي واحد فقط في كل مرة
+            return f"الخدمة {self.name} قيد الاختبار بعد عطل، حاول لاحقا."
+        return None
+
+    def check(self):
+        """
+        يرفع CircuitOpenError إن كانت before_call سترفض الطلب الآن، دون تغيير الحالة.
+        """
+        with self._lock:
+            message = self._rejection()
+        if message:
+            raise CircuitOpenError(message)
+
+    def before_call(self):
+        with self._lock:
+            message = self._rejection()
+            if message:
+                raise CircuitOpenError(message)
+            if self.state == "open":
+                self.state = "half_open"
+
+    def release(self):
+        """
+        ينهي طلبا توقف دون حكم على الخدمة (مثل انتهاء مهلة طابور حد المعدل المحلي): لا يعد عطلا،
+        والطلب التجريبي المتروك يعيد الدائرة مفتوحة ويسمح بتجربة جديدة فورا.
+        """
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+                self._opened_at = time.monotonic() - self.reset_timeout
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+_session = None
+_session_lock = threading.Lock()
+_breakers = {}
+
+
+def get_session() -> requests.Session:
+    """
+    يعيد جلسة HTTP مشتركة تعيد استخدام الاتصالات (keep-alive) بدل مصافحة TCP+TLS لكل طلب.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def get_circuit_breaker(upstream: str) -> CircuitBreaker:
+    with _session_lock:
+        if upstream not in _breakers:
+            _breakers[upstream] = CircuitBreaker(upstream)
+        return _breakers[upstream]
+
+
+def _backoff_delay(attempt: int, response: requests.Response | None) -> float:
+    """
+    تأخير أسي مع عشوائية كاملة، ويحترم ترويسة Retry-After إن أرسلها الخادم.
+    """
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), HTTP_BACKOFF_MAX)
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+
+def _model_from_url(url: str) -> str:
+    """
+    اسم النموذج من رابط مثل .../models/gemini-pro:generateContent، لتسميات المقاييس.
+    """
+    name = url.rsplit("/models/", 1)[-1] if "/models/" in url else url.rsplit("/", 1)[-1]
+    return name.split(":", 1)[0]
+
+
+def _record_attempt(upstream: str, model: str, started: float, status: str, bytes_out: int, response: requests.Response | None, stream: bool):
+    duration = time.perf_counter() - started
+    bytes_in = len(response.content) if response is not None and not stream and response.status_code < 400 else 0
+    UPSTREAM_SECONDS.observe(duration, upstream=upstream, model=model)
+    UPSTREAM_REQUESTS.inc(upstream=upstream, model=model, status=status)
+    UPSTREAM_BYTES.inc(bytes_out, upstream=upstream, model=model, direction="out")
+    if bytes_in:
+        UPSTREAM_BYTES.inc(bytes_in, upstream=upstream, model=model, direction="in")
+    log_event("upstream_request", upstream=upstream, model=model, status=status, duration_ms=round(duration * 1000, 2), bytes_out=bytes_out, bytes_in=bytes_in)
+
+
+def post_json(upstream: str, url: str, payload: dict, params: dict = None, timeout: tuple = None, stream: bool = False) -> requests.Response:
+    """
+    يرسل طلب POST بصيغة JSON عبر الجلسة المشتركة مع مهلات اتصال/قراءة،
+    وإعادة المحاولة على 429 و 5xx وأعطال الشبكة، وقاطع دائرة لكل خدمة.
+    مع stream=True يعاد الرد دون قراءة جسمه (إعادة المحاولة تشمل مرحلة الاتصال والحالة فقط)،
+    وعلى المستدعي إغلاقه بعد الانتهاء.
+    كل محاولة تنتظر دورها في حد معدل النموذج أولا (rate_limit)، وزمن الانتظار لا يحسب من زمن الخدمة.
+    يعيد الرد الناجح أو يرفع requests.exceptions.RequestException / CircuitOpenError / RateLimitTimeout.
+    """
+    model = _model_from_url(url)
+    breaker = get_circuit_breaker(upstream)
+    # الدائرة المفتوحة ترفض فورا دون انتظار في الطابور أو استهلاك رمز؛
+    # وتجربة الدائرة (before_call) بعد الانتظار، فلا تبقى نصف مفتوحة إن انتهت مهلة الطابور
+    breaker.check()
+    acquire_upstream_slot(upstream, model)
+    breaker.before_call()
+    timeout = timeout or (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+    headers = {'Content-Type': 'application/json'}
+    body = json.dumps(payload)
+
+    bytes_out = len(body.encode('utf-8'))
+
+    # كل خروج يسجل نتيجة، فلا تبقى الدائرة نصف مفتوحة إلى الأبد وترفض كل الطلبات بعدها:
+    # الخطأ غير المتوقع يعد عطلا، وإيقاف العامل (KeyboardInterrupt/SystemExit) ينهي الطلب دون حكم على الخدمة
+    recorded = False
+    try:
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            response = None
+            started = time.perf_counter()
+            try:
+                response = get_session().post(url, headers=headers, params=params, data=body, timeout=timeout, stream=stream)
+                _record_attempt(upstream, model, started, str(response.status_code), bytes_out, response, stream)
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    response.raise_for_status() # أخطاء 4xx الأخرى لا تعاد ولا تعد عطلا في الخدمة
+                    breaker.record_success()
+                    recorded = True
+                    return response
+                if response.status_code == 429:
+                    penalize_upstream(upstream, model)
+                error = requests.exceptions.HTTPError(f"{response.status_code} from {upstream}", response=response)
+                response.close()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                _record_attempt(upstream, model, started, type(e).__name__, bytes_out, None, stream)
+                error = e
+            except requests.exceptions.HTTPError:
+                breaker.record_success()
+                recorded = True
+                raise
+            except requests.exceptions.RequestException as e:
+                _record_attempt(upstream, model, started, type(e).__name__, bytes_out, None, stream)
+                raise
+
+            if attempt < HTTP_MAX_RETRIES:
+                delay = _backoff_delay(attempt, response)
+                print(f"Retrying {upstream} request after error ({error}), attempt {attempt + 1}/{HTTP_MAX_RETRIES}, sleeping {delay:.2f}s")
+                time.sleep(delay)
+                try:
+                    acquire_upstream_slot(upstream, model)
+                except RateLimitTimeout as e:
+                    # الانتظار في الطابور المحلي ليس عطلا في الخدمة
+                    breaker.release()
+                    recorded = True
+                    raise e from error
+
+        raise error
+    except BaseException as e:
+        if not recorded:
+            if isinstance(e, Exception):
+                breaker.record_failure()
+            else:
+                breaker.release()
+        raise
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import time
+import weakref
+import httpx
+from config import HTTP_POOL_SIZE, HTTP_ASYNC_MAX_CONNECTIONS, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_MAX_RETRIES
+from http_client import RETRYABLE_STATUS_CODES, get_circuit_breaker, _backoff_delay, _model_from_url, _record_attempt
+from rate_limit import RateLimitTimeout, async_acquire_upstream_slot, penalize_upstream
+
+# عميل لكل حلقة أحداث: اتصالات httpx مرتبطة بالحلقة التي أنشأتها
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    يعيد عميل HTTP غير متزامن مشتركا لحلقة الأحداث الحالية، يعيد استخدام الاتصالات (keep-alive).
+    الطلبات التي تتجاوز HTTP_ASYNC_MAX_CONNECTIONS تنتظر اتصالا حرا دون مهلة، فلا تفشل تحت الضغط.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=HTTP_ASYNC_MAX_CONNECTIONS, max_keepalive_connections=HTTP_POOL_SIZE),
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT, pool=None),
+        )
+        _clients[loop] = client
+    return client
+
+
+async def close_async_client():
+    """
+    يغلق عميل الحلقة الحالية واتصالاته، عند إيقاف الخادم.
+    """
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def async_post_json(upstream: str, url: str, payload: dict, params: dict = None, timeout: tuple = None, stream: bool = False) -> httpx.Response:
+    """
+    النسخة غير المتزامنة من http_client.post_json: نفس المهلات وإعادة المحاولة وقواطع الدوائر والمقاييس،
+    لكن الانتظار لا يحجز خيطا. مع stream=True يعاد الرد دون قراءة جسمه، وعلى المستدعي إغلاقه بـ aclose().
+    يعيد الرد الناجح أو يرفع httpx.HTTPError / CircuitOpenError / RateLimitTimeout.
+    """
+    model = _model_from_url(url)
+    breaker = get_circuit_breaker(upstream)
+    breaker.check()
+    await async_acquire_upstream_slot(upstream, model)
+    breaker.before_call()
+    connect_timeout, read_timeout = timeout or (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+    headers = {'Content-Type': 'application/json'}
+    body = json.dumps(payload)
+
+    bytes_out = len(body.encode('utf-8'))
+    client = get_async_client()
+
+    # كل خروج يسجل نتيجة، فلا تبقى الدائرة نصف مفتوحة إلى الأبد وترفض كل الطلبات بعدها:
+    # الخطأ غير المتوقع يعد عطلا، وإلغاء المهمة (انقطاع العميل) ينهي الطلب دون حكم على الخدمة
+    recorded = False
+    try:
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            response = None
+            started = time.perf_counter()
+            try:
+                request = client.build_request("POST", url, headers=headers, params=params, content=body,
+                                               timeout=httpx.Timeout(read_timeout, connect=connect_timeout, pool=None))
+                response = await client.send(request, stream=stream)
+                _record_attempt(upstream, model, started, str(response.status_code), bytes_out, response, stream)
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    if response.is_error:
+                        await response.aclose()
+                    response.raise_for_status() # أخطاء 4xx الأخرى لا تعاد ولا تعد عطلا في الخدمة
+                    breaker.record_success()
+                    recorded = True
+                    return response
+                if response.status_code == 429:
+                    penalize_upstream(upstream, model)
+                error = httpx.HTTPStatusError(f"{response.status_code} from {upstream}", request=request, response=response)
+                await response.aclose()
+            except httpx.TransportError as e:
+                _record_attempt(upstream, model, started, type(e).__name__, bytes_out, None, stream)
+                error = e
+            except httpx.HTTPStatusError:
+                breaker.record_success()
+                recorded = True
+                raise
+
+            if attempt < HTTP_MAX_RETRIES:
+                delay = _backoff_delay(attempt, response)
+                print(f"Retrying {upstream} request after error ({type(error).__name__}: {error}), attempt {attempt + 1}/{HTTP_MAX_RETRIES}, sleeping {delay:.2f}s")
+                await asyncio.sleep(delay)
+                try:
+                    await async_acquire_upstream_slot(upstream, model)
+                except RateLimitTimeout as e:
+                    breaker.release()
+                    recorded = True
+                    raise e from error
+
+        raise error
+    except BaseException as e:
+        if not recorded:
+            if isinstance(e, Exception):
+                breaker.record_failure()
+            else:
+                breaker.release()
+        raise
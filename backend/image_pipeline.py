@@ -0,0 +1,166 @@
+import base64
+import binascii
+import hashlib
+import io
+import pathlib
+import re
+from html.parser import HTMLParser
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+from PIL import Image, ImageOps
+from config import IMAGE_OPTIMIZE_ENABLED, IMAGE_PRINT_DPI, IMAGE_JPEG_QUALITY
+from artifact_store import get_artifact_store, make_artifact_key
+from assets import prefetch_remote_asset, is_allowed_file
+from metrics import registry
+
+IMAGE_ARTIFACT_KIND = "images"
+# يرفع عند تغيير طريقة المعالجة، فلا تستخدم نسخ معالجة بالطريقة السابقة
+IMAGE_PIPELINE_VERSION = 1
+
+# صفحة A4 بالبوصة: لا فائدة من صورة أكبر من الصفحة كلها بدقة الطباعة
+_PAGE_WIDTH_IN = 210 / 25.4
+_PAGE_HEIGHT_IN = 297 / 25.4
+
+_DATA_URI_RE = re.compile(r'^data:image/[a-z0-9.+-]+;base64,', re.IGNORECASE)
+_SRC_ATTR_RE = re.compile(r'''(\ssrc\s*=\s*)("[^"]*"|'[^']*'|[^\s"'=<>`]+)''', re.IGNORECASE)
+
+IMAGE_RESULTS = registry.counter("image_pipeline_images_total", "Images prepared for rendering by result.", ("result",))
+IMAGE_BYTES = registry.counter("image_pipeline_bytes_total", "Image bytes before (in) and after (out) preparation.", ("direction",))
+
+
+def _has_transparency(image: Image.Image) -> bool:
+    if image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+        # قناة شفافية كلها معتمة لا تمنع JPEG
+        return image.convert("RGBA").getchannel("A").getextrema()[0] < 255
+    return False
+
+
+def _encode_for_print(data: bytes) -> tuple:
+    """
+    يفك الصورة مرة واحدة، ويصغرها لتناسب صفحة A4 بدقة IMAGE_PRINT_DPI، ثم يضغطها:
+    JPEG للصور المعتمة (يضمنه WeasyPrint في PDF كما هو)، و PNG للصور الشفافة.
+    يعيد (البيانات، الامتداد)؛ البيانات الأصلية تعاد إن لم تصغر الصورة ولم تقل بإعادة الضغط.
+    """
+    max_size = (round(_PAGE_WIDTH_IN * IMAGE_PRINT_DPI), round(_PAGE_HEIGHT_IN * IMAGE_PRINT_DPI))
+    with Image.open(io.BytesIO(data)) as image:
+        source_format = (image.format or "").lower()
+        if getattr(image, "is_animated", False):
+            return data, source_format
+        # الحجم الأصلي يقرأ قبل draft، فهو يغير image.size لصور JPEG الكبيرة
+        original_size = image.size
+        # JPEG يفك مباشرة بمقياس أصغر عند الإمكان بدل فك الحجم الكامل ثم التصغير
+        image.draft("RGB", max_size)
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(max_size, Image.LANCZOS)
+        resized = image.size != original_size
+
+        output = io.BytesIO()
+        if _has_transparency(image):
+            image.convert("RGBA").save(output, format="PNG", optimize=True)
+            extension = "png"
+        else:
+            image.convert("RGB").save(output, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True, progressive=True)
+            extension = "jpeg"
+
+    if not resized and len(output.getvalue()) >= len(data) and source_format in ("jpeg", "png"):
+        return data, source_format
+    return output.getvalue(), extension
+
+
+def _read_image_source(url: str) -> bytes | None:
+    if _DATA_URI_RE.match(url):
+        try:
+            return base64.b64decode(url[url.index(',') + 1:], validate=False)
+        except (binascii.Error, ValueError):
+            return None
+    parsed = urlparse(url)
+    if parsed.scheme.lower() == 'file' and is_allowed_file(url2pathname(parsed.path)):
+        try:
+            with open(url2pathname(parsed.path), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+    return None
+
+
+def print_image_uri(url: str) -> str:
+    """
+    يعيد رابط file:// لنسخة من الصورة مجهزة للطباعة، محفوظة في مخزن الملفات ببصمة محتواها،
+    فلا تعاد معالجة الصورة نفسها. يقبل روابط data: و file:// (بعد تنزيل الروابط الخارجية مسبقا)،
+    ويعيد الرابط كما هو لأي رابط آخر أو إن تعذرت المعالجة.
+    """
+    if not IMAGE_OPTIMIZE_ENABLED:
+        return url
+    data = _read_image_source(url)
+    if data is None:
+        return url
+
+    store = get_artifact_store()
+    key = make_artifact_key("image", IMAGE_PIPELINE_VERSION, hashlib.sha256(data).hexdigest(), IMAGE_PRINT_DPI, IMAGE_JPEG_QUALITY)
+    stored = store.find(IMAGE_ARTIFACT_KIND, key)
+    if stored is not None:
+        IMAGE_RESULTS.inc(result="cached")
+        return pathlib.Path(stored["path"]).as_uri()
+
+    try:
+        processed, extension = _encode_for_print(data)
+    except Exception as e:
+        print(f"خطأ في تجهيز الصورة للطباعة: {e}")
+        IMAGE_RESULTS.inc(result="failed")
+        return url
+    name = store.put_bytes(IMAGE_ARTIFACT_KIND, f"{key}.{extension}", processed)
+    IMAGE_RESULTS.inc(result="optimized" if processed is not data else "original")
+    IMAGE_BYTES.inc(len(data), direction="in")
+    IMAGE_BYTES.inc(len(processed), direction="out")
+    return pathlib.Path(store.path_for(IMAGE_ARTIFACT_KIND, name)).as_uri()
+
+
+class _ImageSourceParser(HTMLParser):
+    """
+    يجمع مواضع قيم src في وسوم img دون إعادة تسلسل باقي HTML.
+    """
+    def __init__(self, html: str):
+        super().__init__()
+        # getpos يعد الأسطر بـ \n فقط
+        self._line_offsets = [0]
+        for line in html.split('\n'):
+            self._line_offsets.append(self._line_offsets[-1] + len(line) + 1)
+        self.sources = [] # (بداية القيمة، نهايتها، الرابط)
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'img':
+            return
+        line, column = self.getpos()
+        tag_offset = self._line_offsets[line - 1] + column
+        match = _SRC_ATTR_RE.search(self.get_starttag_text())
+        if match:
+            url = dict(attrs).get('src') or ''
+            self.sources.append((tag_offset + match.start(2), tag_offset + match.end(2), url))
+
+    handle_startendtag = handle_starttag
+
+
+def prepare_html_images(html: str) -> str:
+    """
+    يستبدل روابط الصور داخل النص (data: والروابط الخارجية) بنسخ محلية مجهزة للطباعة.
+    """
+    if not IMAGE_OPTIMIZE_ENABLED or '<img' not in html:
+        return html
+    parser = _ImageSourceParser(html)
+    parser.feed(html)
+    parser.close()
+
+    parts = []
+    position = 0
+    for start, end, url in parser.sources:
+        if not _DATA_URI_RE.match(url) and urlparse(url).scheme.lower() not in ('http', 'https'):
+            continue
+        # الصور الخارجية تنزل مرة واحدة هنا، فلا يحتاج التوليد إلى الشبكة
+        local_url = print_image_uri(prefetch_remote_asset(url))
+        if local_url == url:
+            continue
+        parts.append(html[position:start])
+        parts.append(f'"{local_url}"')
+        position = end
+    parts.append(html[position:])
+    return ''.join(parts)
@@ -0,0 +1,186 @@
+"""
+إعادة التوليد التزايدي: كل جزء من الكتاب (غلاف، فهرس، فصل) يخطط كمستند مستقل، والأجزاء المخططة تحفظ
+في ذاكرة عامل التوليد ليعاد استخدامها عند توليد الكتاب نفسه بعد تعديل بعض فصوله.
+
+الذاكرة لكل عامل، وتضيع عند إعادة تشغيله (كل RENDER_MAX_JOBS_PER_WORKER مهمة)، والمهام توزع على أي عامل
+متفرغ: إعادة الاستخدام مرجحة فقط مع عامل واحد (RENDER_POOL_WORKERS=1 أو 0) أو توجيه ثابت للكتاب إلى عامله.
+أعداد صفحات الأجزاء صغيرة وتحفظ دائما؛ المستندات المخططة كبيرة فتحد بحجم تقديري (INCREMENTAL_RENDER_CACHE_MB).
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from weasyprint import HTML, CSS
+from config import INCREMENTAL_RENDER_CACHE_PARTS, INCREMENTAL_RENDER_CACHE_MB
+from assets import LocalAssetFetcher
+from book_model import split_book_chapters
+from pdf_generator import (
+    _font_config, add_heading_ids, build_back_cover_html, build_cover_html, build_toc_html,
+    get_compiled_stylesheet, style_profile_hash, wrap_book_document
+)
+
+# ترقيم الصفحات في كل جزء يبدأ من موضعه في الكتاب، والمجموع وأرقام الفهرس تكتب كقيم ثابتة
+# لأن counter(pages) و target-counter لا تتجاوز حدود المستند الواحد
+_NUMBERING_CSS = """
+    @page :first {{ counter-reset: page {first_page}; }}
+    .footer::after {{ content: " " counter(page) " من {total_pages}"; }}
+    .toc-list a::after {{ content: leader('.') attr(data-page); }}
+"""
+
+# تقدير ذاكرة المستند المخطط (صناديق التخطيط والنصوص المشكلة) من طول HTML الجزء وعدد صفحاته
+_DOCUMENT_BYTES_PER_CHAR = 64
+_DOCUMENT_BYTES_PER_PAGE = 256 * 1024
+
+
+class _DocumentCache:
+    """
+    أجزاء مخططة (Document) في ذاكرة العامل: (بصمة الجزء، أول صفحة، مجموع الصفحات) -> Document،
+    بحد أقصى لعددها ولحجمها التقديري، تحذف الأقدم استخداما عند تجاوز أي منهما.
+    """
+    def __init__(self, max_bytes: int, max_entries: int):
+        self._entries = OrderedDict()
+        self._max_bytes = max_bytes
+        self._max_entries = max_entries
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, document, estimated_bytes: int):
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            if estimated_bytes > self._max_bytes:
+                return # جزء أكبر من الحد كله لا يحفظ
+            self._entries[key] = (document, estimated_bytes)
+            self._size += estimated_bytes
+            while self._size > self._max_bytes or len(self._entries) > self._max_entries:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._size -= evicted_bytes
+
+
+_documents = _DocumentCache(INCREMENTAL_RENDER_CACHE_MB * 1024 * 1024, INCREMENTAL_RENDER_CACHE_PARTS)
+# عدد صفحات كل جزء لا يتغير بتغير ترقيمه: بصمة الجزء -> عدد الصفحات
+_page_counts = OrderedDict()
+# آخر مجموع صفحات لكل كتاب (بصمة الغلاف)، يستخدم كتخمين عند تخطيط الفصول المعدلة
+_last_totals = OrderedDict()
+
+
+def _remember(cache: OrderedDict, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > INCREMENTAL_RENDER_CACHE_PARTS:
+        cache.popitem(last=False)
+
+
+@lru_cache(maxsize=1024)
+def _chapter_with_ids(chapter_html: str, id_prefix: str) -> tuple:
+    html, toc_entries = add_heading_ids(chapter_html, id_prefix)
+    return html, tuple(toc_entries)
+
+
+def build_book_parts(title: str, script_content: str, cover_image_url: str, back_cover_text: str, settings: dict) -> dict:
+    """
+    يقسم الكتاب إلى أجزاء مستقلة (الغلاف، الفصول، الغلاف الخلفي) لكل منها HTML كامل وبصمة.
+    IDs العناوين مشتقة من بصمة الفصل لا من ترتيبه، فتعديل فصل لا يغير HTML الفصول الأخرى.
+    """
+    profile = style_profile_hash(settings)
+
+    def make_part(kind: str, body_html: str) -> dict:
+        html = wrap_book_document(title, body_html, settings, inline_css=False)
+        return {"kind": kind, "html": html, "key": hashlib.sha256(f"{profile}:{html}".encode("utf-8")).hexdigest()}
+
+    parts = [make_part("cover", build_cover_html(title, cover_image_url))]
+    toc_entries = []
+    seen_hashes = {}
+    for chapter in split_book_chapters(script_content):
+        # فصلان متطابقان يحتاجان IDs مختلفة
+        occurrence = seen_hashes.get(chapter["hash"], 0)
+        seen_hashes[chapter["hash"]] = occurrence + 1
+        id_prefix = f"ch-{chapter['hash'][:12]}-" + (f"{occurrence}-" if occurrence else "")
+        chapter_html, chapter_toc = _chapter_with_ids(chapter["html"], id_prefix)
+        toc_entries.extend(chapter_toc)
+        parts.append(make_part("chapter", f'<div class="content-body">{chapter_html}</div>'))
+    if back_cover_text:
+        parts.append(make_part("back_cover", build_back_cover_html(back_cover_text)))
+
+    return {"title": title, "settings": settings, "parts": parts, "toc_entries": [dict(entry) for entry in toc_entries]}
+
+
+def _layout(html: str, settings: dict, first_page: int, total_pages: int):
+    numbering = CSS(string=_NUMBERING_CSS.format(first_page=first_page, total_pages=total_pages), font_config=_font_config)
+    return HTML(string=html, url_fetcher=LocalAssetFetcher()).render(
+        stylesheets=[get_compiled_stylesheet(settings), numbering], font_config=_font_config)
+
+
+def _part_document(part: dict, settings: dict, first_page: int, total_pages: int):
+    """
+    يعيد تخطيط الجزء المخزن بالترقيم نفسه، أو يخططه من جديد ويخزنه.
+    """
+    key = (part["key"], first_page, total_pages)
+    document = _documents.get(key)
+    if document is None:
+        document = _layout(part["html"], settings, first_page, total_pages)
+        _remember(_page_counts, part["key"], len(document.pages))
+        _documents.put(key, document, len(part["html"]) * _DOCUMENT_BYTES_PER_CHAR + len(document.pages) * _DOCUMENT_BYTES_PER_PAGE)
+    return document
+
+
+def render_book_parts(book: dict, output_path: str) -> int:
+    """
+    يولد ملف PDF من أجزاء الكتاب ويعيد عدد صفحاته. تنفذ في عامل التوليد.
+    الأجزاء غير المتغيرة تعاد من الذاكرة دون تخطيط ما دام موضعها ومجموع الصفحات لم يتغيرا،
+    ولا يخطط الجزء المعدل إلا مرة واحدة إن لم يتغير عدد صفحاته.
+    """
+    settings = book["settings"]
+    parts = book["parts"]
+    book_key = parts[0]["key"]
+    guessed_total = _last_totals.get(book_key, 0)
+
+    # جدول المحتويات يخطط أولا بأرقام وروابط فارغة لمعرفة عدد صفحاته فقط،
+    # فلا يعاد تخطيطه إن تغيرت IDs العناوين دون نصوصها
+    toc_html = build_toc_html([dict(entry, id="") for entry in book["toc_entries"]], {})
+    toc_part = None
+    if toc_html:
+        toc_part = {"kind": "toc", "html": wrap_book_document(book["title"], toc_html, settings, inline_css=False)}
+        toc_part["key"] = hashlib.sha256(f"{style_profile_hash(settings)}:{toc_part['html']}".encode("utf-8")).hexdigest()
+        parts = parts[:1] + [toc_part] + parts[1:]
+
+    # المرور الأول: موضع كل جزء (مجموع صفحات ما قبله)؛ الأجزاء المعروفة لا تخطط
+    first_pages = []
+    next_page = 1
+    for part in parts:
+        first_pages.append(next_page)
+        page_count = _page_counts.get(part["key"])
+        if page_count is None:
+            page_count = len(_part_document(part, settings, next_page, guessed_total).pages)
+        next_page += page_count
+    total_pages = next_page - 1
+    _remember(_last_totals, book_key, total_pages)
+
+    # المرور الثاني: التخطيط النهائي بالترقيم الصحيح (من الذاكرة غالبا)، وأرقام صفحات العناوين للفهرس
+    documents = [None] * len(parts)
+    page_numbers = {}
+    for i, part in enumerate(parts):
+        if part is toc_part:
+            continue
+        documents[i] = _part_document(part, settings, first_pages[i], total_pages)
+        for page_index, page in enumerate(documents[i].pages):
+            for anchor in page.anchors:
+                page_numbers.setdefault(anchor, first_pages[i] + page_index)
+
+    if toc_part is not None:
+        i = parts.index(toc_part)
+        toc_html = wrap_book_document(book["title"], build_toc_html(book["toc_entries"], page_numbers), settings, inline_css=False)
+        documents[i] = _layout(toc_html, settings, first_pages[i], total_pages)
+
+    all_pages = [page for document in documents for page in document.pages]
+    documents[0].copy(all_pages).write_pdf(output_path)
+    print(f"تم توليد ملف PDF بنجاح: {output_path}")
+    return total_pages
@@ -0,0 +1,198 @@
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from config import JOB_WORKERS, JOB_QUEUE_SIZE, JOB_RESULT_TTL
+from metrics import registry
+from rate_limit import with_request_class
+
+
+class JobQueueFull(Exception):
+    """
+    يرفع عندما يمتلئ طابور المهام ولا يمكن قبول مهمة جديدة.
+    """
+
+
+class Job:
+    """
+    سجل مهمة واحدة: حالتها العامة وحالة كل مرحلة والنتيجة أو الخطأ.
+    """
+    def __init__(self, stages: list):
+        self.id = uuid.uuid4().hex
+        self.status = "queued" # queued | running | succeeded | failed
+        self.stages = {name: {"status": "pending", "startedAt": None, "finishedAt": None} for name in stages}
+        self.created_at = time.time()
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.error_status_code = 500
+        self._lock = threading.Lock()
+
+    def update_stage(self, stage: str, status: str):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"status": "pending", "startedAt": None, "finishedAt": None})
+            entry["status"] = status
+            if status == "running":
+                entry["startedAt"] = time.time()
+            else:
+                entry["finishedAt"] = time.time()
+
+    def mark_running(self):
+        with self._lock:
+            self.status = "running"
+
+    def mark_succeeded(self, result):
+        with self._lock:
+            self.status = "succeeded"
+            self.result = result
+            self.finished_at = time.time()
+
+    def mark_failed(self, error: Exception):
+        with self._lock:
+            self.status = "failed"
+            self.error = getattr(error, "message", None) or str(error)
+            self.error_status_code = getattr(error, "status_code", 500)
+            self.finished_at = time.time()
+            # أي مرحلة كانت قيد التنفيذ لحظة الفشل تعتبر فاشلة
+            for entry in self.stages.values():
+                if entry["status"] == "running":
+                    entry["status"] = "failed"
+                    entry["finishedAt"] = self.finished_at
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "jobId": self.id,
+                "status": self.status,
+                "stages": {name: dict(entry) for name, entry in self.stages.items()},
+                "createdAt": self.created_at,
+                "finishedAt": self.finished_at,
+                "error": self.error,
+            }
+
+
+class JobBackend(ABC):
+    """
+    الواجهة التي يجب أن ينفذها أي منفذ مهام (داخل العملية، طابور خارجي، أو بديل محلي للاختبارات).
+    """
+    @abstractmethod
+    def submit(self, func, *args, stages: list = None) -> Job:
+        """
+        يجدول func(*args, on_stage=...) ويعيد سجل المهمة فورا.
+        """
+
+    @abstractmethod
+    def get(self, job_id: str) -> Job | None:
+        """
+        يعيد سجل المهمة بهويتها، أو None إن لم توجد أو انتهت صلاحية نتيجتها.
+        """
+
+    def shutdown(self):
+        pass
+
+    @staticmethod
+    def _run(job: Job, func, args):
+        job.mark_running()
+        try:
+            job.mark_succeeded(func(*args, on_stage=job.update_stage))
+        except Exception as e:
+            print(f"Error in background job {job.id}: {e}")
+            job.mark_failed(e)
+
+
+class InProcessJobBackend(JobBackend):
+    """
+    منفذ مهام داخل العملية نفسها باستخدام مجموعة خيوط محدودة الحجم.
+    """
+    def __init__(self, max_workers: int = JOB_WORKERS, max_queue_size: int = JOB_QUEUE_SIZE, result_ttl: int = JOB_RESULT_TTL):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="book-job")
+        self._max_workers = max_workers
+        self._max_queue_size = max_queue_size
+        self._result_ttl = result_ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _purge_expired(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and now - job.finished_at > self._result_ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def submit(self, func, *args, stages: list = None) -> Job:
+        job = Job(stages or [])
+        with self._lock:
+            self._purge_expired()
+            active = sum(1 for j in self._jobs.values() if not j.finished)
+            if active >= self._max_workers + self._max_queue_size:
+                raise JobQueueFull("طابور المهام ممتلئ، حاول مرة أخرى لاحقا.")
+            self._jobs[job.id] = job
+        self._executor.submit(with_request_class(self._run), job, func, args)
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class InlineJobBackend(JobBackend):
+    """
+    بديل محلي ينفذ المهمة فورا داخل submit، مناسب للاختبارات.
+    """
+    def __init__(self):
+        self._jobs = {}
+
+    def submit(self, func, *args, stages: list = None) -> Job:
+        job = Job(stages or [])
+        self._jobs[job.id] = job
+        self._run(job, func, args)
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        return self._jobs.get(job_id)
+
+
+_job_backend = None
+_job_backend_lock = threading.Lock()
+
+
+def get_job_backend() -> JobBackend:
+    """
+    يعيد منفذ المهام الحالي، وينشئ المنفذ الافتراضي داخل العملية عند أول استخدام.
+    """
+    global _job_backend
+    with _job_backend_lock:
+        if _job_backend is None:
+            _job_backend = InProcessJobBackend()
+        return _job_backend
+
+
+def set_job_backend(backend: JobBackend):
+    """
+    يستبدل منفذ المهام (مثلا ببديل طابور محلي في الاختبارات).
+    """
+    global _job_backend
+    with _job_backend_lock:
+        if _job_backend is not None and _job_backend is not backend:
+            _job_backend.shutdown()
+        _job_backend = backend
+
+
+def _pending_jobs() -> int:
+    backend = _job_backend
+    return backend.pending_count() if isinstance(backend, InProcessJobBackend) else 0
+
+
+registry.callback("book_jobs_pending", "Background book jobs queued or running.", _pending_jobs)
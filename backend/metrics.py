@@ -0,0 +1,199 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from config import METRICS_ENABLED, METRICS_JSON_LOGS
+
+# حدود فئات المدد (بالثواني) من أجزاء الثانية حتى توليد الكتب الكبيرة
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple((name, labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            return [f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self) -> list:
+        with self._lock:
+            return [f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0] # (عدادات الفئات، المجموع، العدد)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> list:
+        lines = []
+        with self._lock:
+            for key, (bucket_counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class _CallbackMetric(_Metric):
+    """
+    مقياس تحسب قيمه عند القراءة فقط (مثل طول الطوابير)، فلا كلفة له على مسار الطلبات.
+    func تعيد رقما، أو قائمة من (قاموس التسميات، القيمة).
+    """
+    def __init__(self, name: str, documentation: str, type_name: str, func):
+        super().__init__(name, documentation)
+        self.type_name = type_name
+        self._func = func
+
+    def render(self) -> list:
+        try:
+            samples = self._func()
+        except Exception as e:
+            print(f"Warning: metric {self.name} could not be collected: {e}")
+            return []
+        if isinstance(samples, (int, float)):
+            samples = [({}, samples)]
+        return [f"{self.name}{_format_labels(tuple(labels.items()))} {value}" for labels, value in samples]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DURATION_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, func, type_name: str = "gauge"):
+        self._register(_CallbackMetric(name, documentation, type_name, func))
+
+    def render(self) -> str:
+        """
+        كل المقاييس بصيغة نص Prometheus (text/plain; version=0.0.4).
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram("book_stage_duration_seconds", "Duration of book pipeline stages.", ("stage", "outcome"))
+BOOK_PAGES = registry.histogram("book_rendered_pages", "Page count of rendered book PDFs.", buckets=(1, 5, 10, 25, 50, 100, 200, 350, 500, 1000))
+UPSTREAM_SECONDS = registry.histogram("upstream_request_duration_seconds", "Duration of each upstream HTTP attempt.", ("upstream", "model"))
+# انتظار الطلب في طابور حد المعدل قبل إرساله، منفصلا عن زمن الخدمة نفسها
+UPSTREAM_QUEUE_SECONDS = registry.histogram("upstream_queue_wait_seconds", "Time upstream calls waited for a rate limit slot before being sent.", ("upstream", "model", "priority"))
+UPSTREAM_REQUESTS = registry.counter("upstream_requests_total", "Upstream HTTP attempts by status code or error.", ("upstream", "model", "status"))
+UPSTREAM_BYTES = registry.counter("upstream_bytes_total", "Bytes sent to and received from upstream services.", ("upstream", "model", "direction"))
+BATCH_DEDUPLICATED = registry.counter("batch_deduplicated_requests_total", "AI sub-requests shared between books of a batch instead of repeated.", ("kind",))
+HTTP_SECONDS = registry.histogram("http_request_duration_seconds", "Duration of Flask requests until the response is returned.", ("endpoint", "method", "status"))
+
+
+def log_event(event: str, **fields):
+    """
+    يكتب سطر JSON منظما عند تفعيل METRICS_JSON_LOGS.
+    """
+    if METRICS_JSON_LOGS:
+        print(json.dumps({"ts": round(time.time(), 3), "event": event, **fields}, ensure_ascii=False), flush=True)
+
+
+@contextmanager
+def span(histogram: Histogram, **labels):
+    """
+    يقيس مدة الكتلة ويسجلها في histogram مع outcome=ok أو error.
+    الحقول المضافة إلى القاموس المعاد تظهر في سجل JSON فقط (لا تصبح تسميات).
+    """
+    fields = {}
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield fields
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        if "outcome" in histogram.labelnames:
+            histogram.observe(duration, outcome=outcome, **labels)
+        else:
+            histogram.observe(duration, **labels)
+        log_event("span", name=histogram.name, duration_ms=round(duration * 1000, 2), outcome=outcome, **labels, **fields)
@@ -1,120 +1,115 @@
 from weasyprint import HTML, CSS
+from weasyprint.text.fonts import FontConfiguration
+import hashlib
 import os
 import re
-from bs4 import BeautifulSoup # لاستخلاص وتحليل HTML بشكل موثوق
+from functools import lru_cache
+from html.parser import HTMLParser
+from assets import FONT_FACE_CSS, LocalAssetFetcher
 
-def generate_pdf_from_html(html_content: str, output_path: str):
+# إعدادات الخطوط مشتركة بين أوراق الأنماط المحللة مسبقا والتوليد، حتى تعمل قواعد @font-face
+_font_config = FontConfiguration()
+
+def generate_pdf_from_html(html_content: str, output_path: str, settings: dict = None) -> int:
     """
-    يولد ملف PDF من محتوى HTML باستخدام WeasyPrint.
+    يولد ملف PDF من محتوى HTML باستخدام WeasyPrint ويعيد عدد صفحاته.
+    عند تمرير settings تطبق ورقة الأنماط المحللة مسبقا (لـ HTML المنشأ بـ inline_css=False).
     """
     try:
-        HTML(string=html_content).write_pdf(output_path)
+        stylesheets = [get_compiled_stylesheet(settings)] if settings is not None else None
+        # جالب الأصول المحلية يمنع أي اتصال شبكي أثناء التوليد (خطوط، صور، أغلفة)
+        document = HTML(string=html_content, url_fetcher=LocalAssetFetcher()).render(stylesheets=stylesheets, font_config=_font_config)
+        document.write_pdf(output_path)
         print(f"تم توليد ملف PDF بنجاح: {output_path}")
+        return len(document.pages)
     except Exception as e:
         print(f"خطأ أثناء توليد ملف PDF: {e}")
         raise
 
-def create_book_html(title: str, script_content: str, cover_image_url: str, back_cover_text: str, settings: dict) -> str:
+# مفاتيح الإعدادات التي تؤثر في ورقة الأنماط مع قيمها الافتراضية
+STYLE_SETTING_DEFAULTS = {
+    'textColor': '#000000',
+    'backgroundColor': '#ffffff',
+    'fontFamily': 'Inter, Arial, sans-serif',
+    'fontSize': '12pt',
+    'lineHeight': '1.5',
+    'textAlign': 'right',
+    'titleColor': '#333333',
+    'titleFontSize': '36pt',
+    'pageMarginTop': '20mm',
+    'pageMarginBottom': '20mm',
+    'pageMarginLeft': '20mm',
+    'pageMarginRight': '20mm',
+    'paragraphSpacing': '1em',
+    'paragraphIndent': '1.5em',
+    'heading1FontSize': '24pt',
+    'heading2FontSize': '18pt',
+    'headingColor': '#444444',
+    'heading1Alignment': 'center',
+    'heading2Alignment': 'right',
+    'coverWidth': '80%',
+    'coverHeight': '70%',
+    'coverBorderRadius': '15px',
+    'coverShadow': '0 10px 20px rgba(0,0,0,0.25)',
+    'imageAlignment': 'center',
+    'headerFontSize': '10pt',
+    'footerFontSize': '10pt',
+    'headerColor': '#888',
+    'footerColor': '#888',
+    'backCoverFontSize': '12pt',
+    'backCoverTextColor': '#000000',
+    'backCoverBackgroundColor': '#ffffff',
+}
+
+def normalize_style_settings(settings: dict) -> tuple:
     """
-    ينشئ محتوى HTML لكتاب، مع تطبيق الإعدادات.
+    يختزل الإعدادات إلى ملف أنماط ثابت: المفاتيح المؤثرة في CSS فقط بعد تطبيق القيم الافتراضية.
+    إعدادان يعطيان ورقة الأنماط نفسها يعطيان الملف نفسه.
     """
-    # تطبيق الإعدادات من الواجهة الأمامية
-    text_color = settings.get('textColor', '#000000')
-    background_color = settings.get('backgroundColor', '#ffffff')
-    font_family = settings.get('fontFamily', 'Inter, Arial, sans-serif')
-    font_size = settings.get('fontSize', '12pt')
-    line_height = settings.get('lineHeight', '1.5')
-    text_align = settings.get('textAlign', 'right')
-    title_color = settings.get('titleColor', '#333333')
-    title_font_size = settings.get('titleFontSize', '36pt')
-    page_margin_top = settings.get('pageMarginTop', '20mm')
-    page_margin_bottom = settings.get('pageMarginBottom', '20mm')
-    page_margin_left = settings.get('pageMarginLeft', '20mm')
-    page_margin_right = settings.get('pageMarginRight', '20mm')
-    paragraph_spacing = settings.get('paragraphSpacing', '1em')
-    paragraph_indent = settings.get('paragraphIndent', '1.5em')
-    heading1_font_size = settings.get('heading1FontSize', '24pt')
-    heading2_font_size = settings.get('heading2FontSize', '18pt')
-    heading_color = settings.get('headingColor', '#444444')
-    heading1_align = settings.get('heading1Alignment', 'center')
-    heading2_align = settings.get('heading2Alignment', 'right')
-    cover_width = settings.get('coverWidth', '80%')
-    cover_height = settings.get('coverHeight', '70%')
-    cover_border_radius = settings.get('coverBorderRadius', '15px')
-    cover_shadow = settings.get('coverShadow', '0 10px 20px rgba(0,0,0,0.25)')
-    header_text = settings.get('headerText', title)
-    footer_text = settings.get('footerText', 'صانع الكتب الذكي')
-    image_alignment = settings.get('imageAlignment', 'center')
-    header_font_size = settings.get('headerFontSize', '10pt')
-    footer_font_size = settings.get('footerFontSize', '10pt')
-    header_color = settings.get('headerColor', '#888')
-    footer_color = settings.get('footerColor', '#888')
-    back_cover_font_size = settings.get('backCoverFontSize', '12pt')
-    back_cover_text_color = settings.get('backCoverTextColor', '#000000')
-    back_cover_background_color = settings.get('backCoverBackgroundColor', '#ffffff')
-
+    return tuple(
+        (key, str(settings.get(key, default)).strip())
+        for key, default in STYLE_SETTING_DEFAULTS.items()
+    )
 
-    # Prepare cover image HTML string
-    cover_image_html = ""
-    if cover_image_url:
-        cover_image_html = f'<img src="{cover_image_url}" class="cover-image" alt="Book Cover" />'
+def style_profile_hash(settings: dict) -> str:
+    return hashlib.sha256(repr(normalize_style_settings(settings)).encode('utf-8')).hexdigest()
 
-    # استخدام BeautifulSoup لاستخلاص العناوين وإضافة IDs بشكل موثوق
-    soup = BeautifulSoup(script_content, 'html.parser')
-    toc_entries = []
-    
-    # إضافة IDs للعناوين واستخراجها لجدول المحتويات
-    for i, heading in enumerate(soup.find_all(['h1', 'h2', 'h3'])):
-        # إنشاء ID فريد إذا لم يكن موجودًا
-        if not heading.has_attr('id'):
-            # تنظيف النص لجعله جزءا من ID صالح
-            heading_id_text = re.sub(r'[^a-zA-Z0-9_]', '', heading.get_text().strip())
-            heading_id = f"section-{i}-{heading_id_text[:30]}" # تحديد طول ID لتجنب الطول الزائد
-            heading['id'] = heading_id
-        else:
-            heading_id = heading['id']
-            
-        level = int(heading.name[1]) # e.g., 'h1' -> 1, 'h2' -> 2
-        toc_entries.append({
-            'level': level,
-            'text': heading.get_text().strip(),
-            'id': heading_id
-        })
-    
-    script_content_with_ids = str(soup) # الحصول على HTML المحدث مع IDs
+@lru_cache(maxsize=64)
+def _build_stylesheet(profile: tuple) -> str:
+    settings = dict(profile)
+    text_color = settings['textColor']
+    background_color = settings['backgroundColor']
+    font_family = settings['fontFamily']
+    font_size = settings['fontSize']
+    line_height = settings['lineHeight']
+    text_align = settings['textAlign']
+    title_color = settings['titleColor']
+    title_font_size = settings['titleFontSize']
+    page_margin_top = settings['pageMarginTop']
+    page_margin_bottom = settings['pageMarginBottom']
+    page_margin_left = settings['pageMarginLeft']
+    page_margin_right = settings['pageMarginRight']
+    paragraph_spacing = settings['paragraphSpacing']
+    paragraph_indent = settings['paragraphIndent']
+    heading1_font_size = settings['heading1FontSize']
+    heading2_font_size = settings['heading2FontSize']
+    heading_color = settings['headingColor']
+    heading1_align = settings['heading1Alignment']
+    heading2_align = settings['heading2Alignment']
+    cover_width = settings['coverWidth']
+    cover_height = settings['coverHeight']
+    cover_border_radius = settings['coverBorderRadius']
+    cover_shadow = settings['coverShadow']
+    image_alignment = settings['imageAlignment']
+    header_font_size = settings['headerFontSize']
+    footer_font_size = settings['footerFontSize']
+    header_color = settings['headerColor']
+    footer_color = settings['footerColor']
+    back_cover_font_size = settings['backCoverFontSize']
+    back_cover_text_color = settings['backCoverTextColor']
+    back_cover_background_color = settings['backCoverBackgroundColor']
 
-    toc_html = ""
-    if toc_entries:
-        toc_html = """
-        <div class="page table-of-contents">
-            <h1 class="toc-title">جدول المحتويات</h1>
-            <ul class="toc-list">
-        """
-        for entry in toc_entries:
-            indent_class = ""
-            if entry['level'] == 1:
-                indent_class = "toc-level-1"
-            elif entry['level'] == 2:
-                indent_class = "toc-level-2"
-            elif entry['level'] == 3:
-                indent_class = "toc-level-3"
-            
-            # استخدام target-counter و leader لتنسيق احترافي
-            toc_html += f'<li class="{indent_class}"><a href="#{entry["id"]}">{entry["text"]}</a></li>'
-        toc_html += """
-            </ul>
-        </div>
-        """
-    
-    # قالب HTML الرئيسي
-    html_template = f"""
-    <!DOCTYPE html>
-    <html lang="ar" dir="rtl">
-    <head>
-        <meta charset="UTF-8">
-        <title>{title}</title>
-        <link href="[https://fonts.googleapis.com/css2?family=Amiri:wght@400;700&family=Inter:wght@400;600;700&display=swap](https://fonts.googleapis.com/css2?family=Amiri:wght@400;700&family=Inter:wght@400;600;700&display=swap)" rel="stylesheet">
-        <style>
+    return FONT_FACE_CSS + f"""
             @page {{
                 size: A4;
                 margin-top: {page_margin_top};
@@ -367,23 +362,194 @@ def create_book_html(title: str, script_content: str, cover_image_url: str, back
                 text-align: center;
                 max-width: 150mm;
             }}
-        </style>
-    </head>
-    <body>
-        <div class="header">{header_text}</div>
-        <div class="footer">{footer_text}</div>
+        """
+
+def build_book_stylesheet(settings: dict) -> str:
+    """
+    يعيد نص CSS الخاص بالكتاب، مبنيا مرة واحدة لكل ملف أنماط ومخزنا مؤقتا.
+    """
+    return _build_stylesheet(normalize_style_settings(settings))
+
+@lru_cache(maxsize=64)
+def _compile_stylesheet(profile: tuple) -> CSS:
+    return CSS(string=_build_stylesheet(profile), font_config=_font_config, url_fetcher=LocalAssetFetcher())
+
+def get_compiled_stylesheet(settings: dict) -> CSS:
+    """
+    يعيد كائن weasyprint.CSS محللا مسبقا لملف الأنماط، فلا يعاد تحليل CSS للكتب ذات الإعدادات المتكررة.
+    """
+    return _compile_stylesheet(normalize_style_settings(settings))
+
+class _HeadingIdParser(HTMLParser):
+    """
+    يمر على HTML مرة واحدة: يجمع نص كل عنوان h1-h3 ويحدد مواضع إدراج IDs في وسوم البداية،
+    دون بناء شجرة أو إعادة تسلسل باقي المحتوى.
+    """
+    HEADING_TAGS = ('h1', 'h2', 'h3')
+
+    def __init__(self, html: str, id_prefix: str):
+        super().__init__()
+        self._id_prefix = id_prefix
+        # getpos يعد الأسطر بـ \n فقط، بخلاف splitlines التي تقسم أيضا عند U+2028 و U+0085 وغيرهما
+        self._line_offsets = [0]
+        for line in html.split('\n'):
+            self._line_offsets.append(self._line_offsets[-1] + len(line) + 1)
+        self._open_headings = [] # العناوين المفتوحة: (ترتيب العنوان، المدخل، أجزاء النص)
+        self.toc_entries = []
+        self.insertions = [] # (موضع نهاية وسم البداية، المدخل) للعناوين التي لا تملك ID
+
+    def _offset(self) -> int:
+        line, column = self.getpos()
+        return self._line_offsets[line - 1] + column
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in self.HEADING_TAGS:
+            return
+        existing_id = None
+        for name, value in attrs:
+            if name == 'id':
+                existing_id = value or ''
+        entry = {'level': int(tag[1]), 'text': '', 'id': existing_id}
+        self.toc_entries.append(entry)
+        if existing_id is None:
+            start_tag = self.get_starttag_text()
+            end = self._offset() + len(start_tag) - (2 if start_tag.endswith('/>') else 1)
+            self.insertions.append((end, entry))
+        self._open_headings.append((len(self.toc_entries) - 1, entry, []))
+
+    def handle_startendtag(self, tag, attrs):
+        # <h1/> عنوان فارغ كما يعامله BeautifulSoup
+        self.handle_starttag(tag, attrs)
+        self.handle_endtag(tag)
+
+    def handle_data(self, data):
+        for _, _, text_parts in self._open_headings:
+            text_parts.append(data)
+
+    def handle_endtag(self, tag):
+        if tag not in self.HEADING_TAGS:
+            return
+        for i in range(len(self._open_headings) - 1, -1, -1):
+            if self._open_headings[i][1]['level'] == int(tag[1]):
+                for heading in self._open_headings[i:]:
+                    self._finish(*heading)
+                del self._open_headings[i:]
+                break
+
+    def _finish(self, index: int, entry: dict, text_parts: list):
+        entry['text'] = ''.join(text_parts).strip()
+        if entry['id'] is None:
+            # تنظيف النص لجعله جزءا من ID صالح
+            heading_id_text = re.sub(r'[^a-zA-Z0-9_]', '', entry['text'])
+            entry['id'] = f"{self._id_prefix}{index}-{heading_id_text[:30]}" # تحديد طول ID لتجنب الطول الزائد
 
+    def close(self):
+        super().close()
+        for heading in self._open_headings:
+            self._finish(*heading)
+        self._open_headings = []
+
+def add_heading_ids(script_content: str, id_prefix: str = "section-") -> tuple:
+    """
+    يضيف IDs للعناوين h1-h3 ويستخرجها لجدول المحتويات في مرور واحد على النص.
+    يعيد (HTML المحدث، قائمة مدخلات جدول المحتويات)؛ باقي HTML يبقى كما هو حرفيا.
+    """
+    parser = _HeadingIdParser(script_content, id_prefix)
+    parser.feed(script_content)
+    parser.close()
+
+    pieces = []
+    position = 0
+    for offset, entry in parser.insertions:
+        pieces.append(script_content[position:offset])
+        pieces.append(f' id="{entry["id"]}"')
+        position = offset
+    pieces.append(script_content[position:])
+    return ''.join(pieces), parser.toc_entries
+
+def build_toc_html(toc_entries: list, page_numbers: dict = None) -> str:
+    """
+    يبني صفحة جدول المحتويات.
+    page_numbers (ID -> رقم الصفحة) يستخدم عند توليد الفصول كمستندات منفصلة، حيث لا يصل target-counter إلى العناوين.
+    """
+    if not toc_entries:
+        return ""
+    toc_html = """
+        <div class="page table-of-contents">
+            <h1 class="toc-title">جدول المحتويات</h1>
+            <ul class="toc-list">
+        """
+    for entry in toc_entries:
+        indent_class = ""
+        if entry['level'] == 1:
+            indent_class = "toc-level-1"
+        elif entry['level'] == 2:
+            indent_class = "toc-level-2"
+        elif entry['level'] == 3:
+            indent_class = "toc-level-3"
+        
+        # استخدام target-counter و leader لتنسيق احترافي
+        page_attr = f' data-page="{page_numbers.get(entry["id"], "")}"' if page_numbers is not None else ""
+        toc_html += f'<li class="{indent_class}"><a href="#{entry["id"]}"{page_attr}>{entry["text"]}</a></li>'
+    toc_html += """
+            </ul>
+        </div>
+        """
+    return toc_html
+
+def build_cover_html(title: str, cover_image_url: str) -> str:
+    # Prepare cover image HTML string
+    cover_image_html = ""
+    if cover_image_url:
+        cover_image_html = f'<img src="{cover_image_url}" class="cover-image" alt="Book Cover" />'
+    return f"""
         <div class="page cover-page">
             <h1 class="book-title">{title}</h1>
             {cover_image_html}
             <p class="author">تأليف: صانع الكتب الذكي</p>
-        </div>
-        {toc_html if toc_html else ''}
-        <div class="content-body">
-            {script_content_with_ids}
-        </div>
-        {f'<div class="page back-cover-page"><p class="back-cover-text">{back_cover_text}</p></div>' if back_cover_text else ''}
+        </div>"""
+
+def build_back_cover_html(back_cover_text: str) -> str:
+    return f'<div class="page back-cover-page"><p class="back-cover-text">{back_cover_text}</p></div>' if back_cover_text else ''
+
+def wrap_book_document(title: str, body_html: str, settings: dict, inline_css: bool = True) -> str:
+    """
+    يضع جسم الكتاب (أو جزءا منه) في قالب HTML الرئيسي مع الترويسة والتذييل.
+    """
+    # نصوص الترويسة والتذييل جزء من المحتوى، أما باقي الإعدادات فتطبق عبر ورقة الأنماط
+    header_text = settings.get('headerText', title)
+    footer_text = settings.get('footerText', 'صانع الكتب الذكي')
+    style_html = f"<style>{build_book_stylesheet(settings)}</style>" if inline_css else ""
+
+    # قالب HTML الرئيسي
+    return f"""
+    <!DOCTYPE html>
+    <html lang="ar" dir="rtl">
+    <head>
+        <meta charset="UTF-8">
+        <title>{title}</title>
+        {style_html}
+    </head>
+    <body>
+        <div class="header">{header_text}</div>
+        <div class="footer">{footer_text}</div>
+{body_html}
     </body>
     </html>
     """
-    return html_template
\ No newline at end of file
+
+def create_book_html(title: str, script_content: str, cover_image_url: str, back_cover_text: str, settings: dict, inline_css: bool = True) -> str:
+    """
+    ينشئ محتوى HTML لكتاب، مع تطبيق الإعدادات.
+    مع inline_css=False لا تضمن الأنماط في الصفحة، ويجب تمرير settings إلى generate_pdf_from_html
+    لتطبيق ورقة الأنماط المحللة مسبقا.
+    """
+    script_content_with_ids, toc_entries = add_heading_ids(script_content)
+    body_html = f"""
+        {build_cover_html(title, cover_image_url)}
+        {build_toc_html(toc_entries)}
+        <div class="content-body">
+            {script_content_with_ids}
+        </div>
+        {build_back_cover_html(back_cover_text)}"""
+    return wrap_book_document(title, body_html, settings, inline_css)
@@ -0,0 +1,254 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from config import (
+    GEMINI_REQUESTS_PER_MINUTE, IMAGEN_REQUESTS_PER_MINUTE, UPSTREAM_MODEL_RATE_LIMITS, RATE_LIMIT_BURST,
+    RATE_LIMIT_MAX_WAIT, RATE_LIMIT_INTERACTIVE_WEIGHT
+)
+from metrics import UPSTREAM_QUEUE_SECONDS, registry
+
+# مسارات يتعامل معها المستخدم مباشرة وينتظر ردها؛ طلباتها تسبق تنسيق الكتب وتوليدها
+INTERACTIVE_PATHS = {"/chat", "/chat/stream", "/suggest-style", "/generate-cover-descriptions"}
+
+PRIORITY_WEIGHTS = {"interactive": RATE_LIMIT_INTERACTIVE_WEIGHT, "bulk": 1.0}
+
+RATE_LIMIT_TIMEOUTS = registry.counter("upstream_rate_limit_timeouts_total", "Upstream calls that gave up waiting in the rate limit queue.",
+                                       ("upstream", "model", "priority"))
+
+# (هوية العميل، الأولوية) للطلب الجاري؛ يضبط في before_request وينتقل مع المهام عبر with_request_class
+_request_class = contextvars.ContextVar("upstream_request_class", default=("anonymous", "bulk"))
+
+
+class RateLimitTimeout(Exception):
+    """
+    يرفع عندما ينتظر الطلب في طابور المعدل أكثر من RATE_LIMIT_MAX_WAIT.
+    """
+
+
+def set_request_class(client_id: str, priority: str):
+    _request_class.set((client_id or "anonymous", priority if priority in PRIORITY_WEIGHTS else "bulk"))
+
+
+def request_class_for(path: str, client_id: str) -> tuple:
+    return client_id, "interactive" if path in INTERACTIVE_PATHS else "bulk"
+
+
+def with_request_class(fn):
+    """
+    يغلف fn لتعمل بهوية العميل وأولويته الحالية حين تنفذ في خيط آخر (منفذ المراحل أو المهام الخلفية).
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+class _Waiter:
+    def __init__(self, event: threading.Event = None, loop=None, future=None):
+        self.event = event
+        self.loop = loop
+        self.future = future
+        self.granted = False
+        self.cancelled = False
+
+    def grant(self):
+        self.granted = True
+        if self.event is not None:
+            self.event.set()
+            return
+        try:
+            self.loop.call_soon_threadsafe(_resolve_future, self.future)
+        except RuntimeError:
+            pass # الحلقة أغلقت؛ لا أحد ينتظر
+
+
+def _resolve_future(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class FairRateLimiter:
+    """
+    دلو رموز (rate طلب في الدقيقة، سعة burst) لنموذج واحد. عند نفاد الرموز ينتظر الطلب في طابور عادل موزون
+    (self-clocked fair queueing): لكل (عميل، أولوية) تدفق، ويأخذ كل طلب وسما = max(الزمن الافتراضي، وسم طلبه السابق)
+    + 1/الوزن، وتمنح الرموز بترتيب الوسوم. فلا يحجز مستخدم واحد الحصة بسيل طلبات، والطلب التفاعلي يتقدم على التنسيق.
+    """
+    def __init__(self, name: str, requests_per_minute: float, burst: int):
+        self.name = name
+        self._rate = requests_per_minute / 60.0
+        self._capacity = float(max(1, burst))
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._queue = [] # (وسم، ترتيب الوصول، المنتظر)
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._finish_tags = {}
+        self._dispatcher = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def _take_now(self) -> bool:
+        self._refill()
+        if not self._queue and self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def _enqueue(self, waiter: _Waiter, client_id: str, priority: str):
+        flow = (client_id, priority)
+        tag = max(self._virtual_time, self._finish_tags.get(flow, 0.0)) + 1.0 / PRIORITY_WEIGHTS[priority]
+        self._finish_tags[flow] = tag
+        heapq.heappush(self._queue, (tag, next(self._sequence), waiter))
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True, name=f"rate-limit-{self.name}")
+            self._dispatcher.start()
+        self._cond.notify()
+
+    def _dispatch_loop(self):
+        with self._cond:
+            while True:
+                while self._queue and self._queue[0][2].cancelled:
+                    heapq.heappop(self._queue)
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                self._refill()
+                if self._tokens < 1:
+                    self._cond.wait((1 - self._tokens) / self._rate)
+                    continue
+                tag, _, waiter = heapq.heappop(self._queue)
+                self._tokens -= 1
+                self._virtual_time = tag
+                waiter.grant()
+                if len(self._finish_tags) > 1024:
+                    # التدفقات التي تجاوزها الزمن الافتراضي لا أثر لوسومها
+                    self._finish_tags = {flow: tag for flow, tag in self._finish_tags.items() if tag > self._virtual_time}
+
+    def acquire(self, client_id: str, priority: str, timeout: float) -> float:
+        """
+        ينتظر رمزا ويعيد مدة الانتظار بالثواني، أو يرفع RateLimitTimeout.
+        """
+        started = time.monotonic()
+        with self._cond:
+            if self._take_now():
+                return 0.0
+            waiter = _Waiter(event=threading.Event())
+            self._enqueue(waiter, client_id, priority)
+        if not waiter.event.wait(timeout):
+            with self._cond:
+                if not waiter.granted:
+                    waiter.cancelled = True
+                    raise RateLimitTimeout(f"تجاوز طلب {self.name} مدة الانتظار في طابور حد المعدل.")
+        return time.monotonic() - started
+
+    async def acquire_async(self, client_id: str, priority: str, timeout: float) -> float:
+        """
+        مثل acquire دون حجز حلقة الأحداث. إلغاء الطلب بعد منحه الرمز يعيد الرمز للدلو.
+        """
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self._take_now():
+                return 0.0
+            waiter = _Waiter(loop=loop, future=loop.create_future())
+            self._enqueue(waiter, client_id, priority)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._cond:
+                if waiter.granted:
+                    self._tokens = min(self._capacity, self._tokens + 1)
+                    self._cond.notify()
+                waiter.cancelled = True
+            if isinstance(e, asyncio.TimeoutError):
+                raise RateLimitTimeout(f"تجاوز طلب {self.name} مدة الانتظار في طابور حد المعدل.")
+            raise
+        return time.monotonic() - started
+
+    def drain(self):
+        """
+        يفرغ الدلو بعد رد 429: الطلبات التالية تنتظر إعادة الملء بدل تكرار الرفض.
+        """
+        with self._cond:
+            self._refill()
+            self._tokens = min(self._tokens, 0.0)
+
+    def waiting(self) -> int:
+        with self._cond:
+            return sum(1 for _, _, waiter in self._queue if not waiter.cancelled)
+
+
+def _model_limits() -> dict:
+    limits = {}
+    for item in UPSTREAM_MODEL_RATE_LIMITS.split(","):
+        model, _, rate = item.partition("=")
+        if model.strip() and rate.strip():
+            limits[model.strip()] = float(rate)
+    return limits
+
+
+_MODEL_LIMITS = _model_limits()
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_upstream_limiter(upstream: str, model: str) -> FairRateLimiter | None:
+    """
+    محدد المعدل لنموذج خدمة ما، أو None إن كان الحد معطلا (0).
+    """
+    key = (upstream, model)
+    with _limiters_lock:
+        if key not in _limiters:
+            default_rate = IMAGEN_REQUESTS_PER_MINUTE if upstream == "imagen" else GEMINI_REQUESTS_PER_MINUTE
+            rate = _MODEL_LIMITS.get(model, default_rate)
+            _limiters[key] = FairRateLimiter(f"{upstream}/{model}", rate, RATE_LIMIT_BURST) if rate > 0 else None
+        return _limiters[key]
+
+
+def acquire_upstream_slot(upstream: str, model: str):
+    """
+    ينتظر دور الطلب الجاري (بهوية عميله وأولويته) قبل إرسال طلب للخدمة، ويسجل زمن الانتظار منفصلا عن زمن الخدمة.
+    """
+    limiter = get_upstream_limiter(upstream, model)
+    if limiter is None:
+        return
+    client_id, priority = _request_class.get()
+    try:
+        waited = limiter.acquire(client_id, priority, RATE_LIMIT_MAX_WAIT)
+    except RateLimitTimeout:
+        RATE_LIMIT_TIMEOUTS.inc(upstream=upstream, model=model, priority=priority)
+        raise
+    UPSTREAM_QUEUE_SECONDS.observe(waited, upstream=upstream, model=model, priority=priority)
+
+
+async def async_acquire_upstream_slot(upstream: str, model: str):
+    limiter = get_upstream_limiter(upstream, model)
+    if limiter is None:
+        return
+    client_id, priority = _request_class.get()
+    try:
+        waited = await limiter.acquire_async(client_id, priority, RATE_LIMIT_MAX_WAIT)
+    except RateLimitTimeout:
+        RATE_LIMIT_TIMEOUTS.inc(upstream=upstream, model=model, priority=priority)
+        raise
+    UPSTREAM_QUEUE_SECONDS.observe(waited, upstream=upstream, model=model, priority=priority)
+
+
+def penalize_upstream(upstream: str, model: str):
+    limiter = get_upstream_limiter(upstream, model)
+    if limiter is not None:
+        limiter.drain()
+
+
+def _waiting_samples() -> list:
+    with _limiters_lock:
+        limiters = [(key, limiter) for key, limiter in _limiters.items() if limiter is not None]
+    return [({"upstream": upstream, "model": model}, limiter.waiting()) for (upstream, model), limiter in limiters]
+
+
+registry.callback("upstream_rate_limit_waiting", "Upstream calls waiting in the rate limit queue.", _waiting_samples)
@@ -0,0 +1,197 @@
+import multiprocessing
+import queue
+import threading
+import time
+from config import (
+    RENDER_POOL_WORKERS, RENDER_QUEUE_SIZE, RENDER_TIMEOUT,
+    RENDER_MAX_JOBS_PER_WORKER, RENDER_MEMORY_LIMIT_MB, RENDER_RETRY_AFTER
+)
+from metrics import registry
+
+
+class RenderQueueFull(Exception):
+    """
+    يرفع عندما يمتلئ طابور التوليد، ويجب أن يقابله رد 503 مع Retry-After.
+    """
+    def __init__(self, message: str, retry_after: int = RENDER_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RenderTimeout(Exception):
+    """
+    يرفع عندما تتجاوز مهمة التوليد مهلتها؛ يقتل العامل ويستبدل بآخر.
+    """
+
+
+class RenderWorkerError(Exception):
+    """
+    يرفع عند فشل المهمة داخل العامل أو موته (مثلا عند تجاوز حد الذاكرة).
+    """
+
+
+def _worker_main(conn, memory_limit_mb: int):
+    """
+    حلقة عامل التوليد: يحمل WeasyPrint والخطوط مرة واحدة ثم ينفذ المهام الواردة عبر الأنبوب.
+    """
+    if memory_limit_mb:
+        try:
+            import resource
+            limit = memory_limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError) as e:
+            print(f"Warning: could not apply render worker memory limit: {e}")
+
+    # التحميل المسبق: استيراد WeasyPrint وتهيئة الخطوط قبل أول مهمة
+    import pdf_generator # noqa: F401
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        func, args = job
+        try:
+            conn.send(("ok", func(*args)))
+        except MemoryError:
+            conn.send(("fatal", "تجاوزت عملية التوليد حد الذاكرة المسموح."))
+            return # عامل استنفد ذاكرته لا يعاد استخدامه
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, context, memory_limit_mb: int):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, memory_limit_mb), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs_done = 0
+
+    def stop(self, graceful: bool = True):
+        if graceful and self.process.is_alive():
+            try:
+                self.conn.send(None)
+                self.process.join(timeout=5)
+            except (OSError, BrokenPipeError):
+                pass
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class RenderPool:
+    """
+    مجموعة عمليات دائمة لتوليد PDF خارج قفل GIL:
+    طابور محدود (امتلاؤه يرفع RenderQueueFull)، مهلة لكل مهمة، حد ذاكرة لكل عامل،
+    واستبدال العامل بعد عدد محدد من المهام.
+    """
+    def __init__(self, workers: int = RENDER_POOL_WORKERS, max_queue_size: int = RENDER_QUEUE_SIZE,
+                 timeout: float = RENDER_TIMEOUT, max_jobs_per_worker: int = RENDER_MAX_JOBS_PER_WORKER,
+                 memory_limit_mb: int = RENDER_MEMORY_LIMIT_MB):
+        # spawn بدل fork: لا نرث خيوط Flask وأقفالها في العمليات الفرعية
+        self._context = multiprocessing.get_context("spawn")
+        self._timeout = timeout
+        self._max_jobs_per_worker = max_jobs_per_worker
+        self._memory_limit_mb = memory_limit_mb
+        self._slots = threading.BoundedSemaphore(workers + max_queue_size)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._idle = queue.Queue()
+        for _ in range(workers):
+            self._idle.put(_Worker(self._context, memory_limit_mb))
+
+    def _replace(self, worker: _Worker, graceful: bool):
+        worker.stop(graceful=graceful)
+        self._idle.put(_Worker(self._context, self._memory_limit_mb))
+
+    def queue_depth(self) -> int:
+        """
+        عدد المهام قيد التنفيذ أو في الانتظار.
+        """
+        with self._lock:
+            return self._in_flight
+
+    def run(self, func, *args, timeout: float = None):
+        """
+        ينفذ func(*args) في أحد العمال وينتظر النتيجة. func يجب أن تكون دالة على مستوى وحدة (قابلة للتسلسل).
+        """
+        if not self._slots.acquire(blocking=False):
+            raise RenderQueueFull("طابور توليد ملفات PDF ممتلئ، حاول مرة أخرى بعد قليل.")
+        with self._lock:
+            self._in_flight += 1
+        deadline = time.monotonic() + (timeout or self._timeout)
+        try:
+            try:
+                worker = self._idle.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise RenderTimeout("انتهت مهلة انتظار عامل توليد PDF متاح.")
+
+            try:
+                worker.conn.send((func, args))
+                if not worker.conn.poll(max(0.0, deadline - time.monotonic())):
+                    # لا يمكن إيقاف WeasyPrint من الخارج إلا بقتل العملية
+                    self._replace(worker, graceful=False)
+                    raise RenderTimeout("تجاوز توليد ملف PDF المهلة المحددة.")
+                status, payload = worker.conn.recv()
+            except (EOFError, OSError, BrokenPipeError):
+                self._replace(worker, graceful=False)
+                raise RenderWorkerError("توقف عامل توليد PDF بشكل غير متوقع (ربما تجاوز حد الذاكرة).")
+
+            worker.jobs_done += 1
+            if status == "fatal" or not worker.process.is_alive():
+                self._replace(worker, graceful=False)
+            elif worker.jobs_done >= self._max_jobs_per_worker:
+                # تدوير العامل بعد N مهمة لتحرير الذاكرة المتراكمة
+                self._replace(worker, graceful=True)
+            else:
+                self._idle.put(worker)
+
+            if status != "ok":
+                raise RenderWorkerError(payload)
+            return payload
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def shutdown(self):
+        while True:
+            try:
+                self._idle.get_nowait().stop(graceful=True)
+            except queue.Empty:
+                return
+
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def get_render_pool() -> RenderPool | None:
+    """
+    يعيد مجموعة عمال التوليد المشتركة (تنشأ عند أول استخدام)، أو None إذا كان RENDER_POOL_WORKERS = 0.
+    """
+    global _render_pool
+    if RENDER_POOL_WORKERS <= 0:
+        return None
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = RenderPool()
+        return _render_pool
+
+
+def run_render_job(func, *args):
+    """
+    ينفذ مهمة توليد في مجموعة العمال إن كانت مفعلة، وإلا في الخيط الحالي.
+    """
+    pool = get_render_pool()
+    if pool is None:
+        return func(*args)
+    return pool.run(func, *args)
+
+
+registry.callback("render_queue_depth", "PDF render jobs running or waiting for a worker.",
+                  lambda: _render_pool.queue_depth() if _render_pool is not None else 0)
@@ -0,0 +1,102 @@
+import re
+
+# رقم الفصل بعد الكلمة المفتاحية: أرقام (لاتينية أو عربية)، أرقام رومانية، أو ترتيب بالكلمات
+_HEADING_NUMBER = (
+    r'(?:\d+|(?-i:[IVXLCDM]+)'
+    r'|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve'
+    r'|first|second|third|fourth|fifth|sixth|seventh|eighth|ninth|tenth'
+    r'|ال(?:أول|اول|ثاني|ثالث|رابع|خامس|سادس|سابع|ثامن|تاسع|عاشر|حادي)[ىة]?)'
+)
+# أسطر تبدأ فصلا جديدا في النص الخام: عناوين Markdown، وسم <h1>، أو سطر قصير بشكل عنوان
+# "الفصل/الباب/الجزء <رقم> ..." أو "Chapter/Part <رقم> ..." (حتى 80 حرفا، بلا علامات نهاية جملة)،
+# فلا تعد جملة عادية مثل "Part of the reason..." بداية فصل
+_CHAPTER_LINE_RE = re.compile(
+    r'^\s*(?:#\s+\S|<h1[\s>])'
+    r'|^(?=.{1,80}$)\s*(?:الفصل|الباب|الجزء|chapter|part)\s+' + _HEADING_NUMBER + r'(?!\w)\s*[:.\-–—)]?[^.!?؟;؛]*$',
+    re.IGNORECASE
+)
+_TAG_RE = re.compile(r'<[^>]+>')
+_PARAGRAPH_SPLIT_RE = re.compile(r'\n\s*\n')
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?؟。])\s+')
+
+
+def _clean_title(line: str) -> str:
+    return _TAG_RE.sub('', line).lstrip('#').strip()
+
+
+def split_into_chapters(raw_script: str) -> list:
+    """
+    يقسم النص الخام إلى فصول على أسطر العناوين الرئيسية.
+    يعيد قائمة من {"title": ..., "text": ...}؛ النص الذي يسبق أول فصل يكون بعنوان فارغ.
+    """
+    chapters = []
+    current_title = ""
+    current_lines = []
+    for line in raw_script.splitlines(keepends=True):
+        if _CHAPTER_LINE_RE.match(line) and ''.join(current_lines).strip():
+            chapters.append({"title": current_title, "text": ''.join(current_lines)})
+            current_lines = []
+        if _CHAPTER_LINE_RE.match(line):
+            current_title = _clean_title(line)
+        current_lines.append(line)
+    if ''.join(current_lines).strip():
+        chapters.append({"title": current_title, "text": ''.join(current_lines)})
+    return chapters
+
+
+def _split_oversized(paragraph: str, max_chars: int) -> list:
+    """
+    يقسم فقرة أطول من الحد على حدود الأسطر ثم الجمل، وأخيرا قطعا صريحا.
+    """
+    pieces = []
+    for unit in paragraph.splitlines() if '\n' in paragraph.strip() else _SENTENCE_SPLIT_RE.split(paragraph):
+        while len(unit) > max_chars:
+            pieces.append(unit[:max_chars])
+            unit = unit[max_chars:]
+        if unit.strip():
+            pieces.append(unit)
+    return _pack(pieces, max_chars, separator='\n' if '\n' in paragraph.strip() else ' ')
+
+
+def _pack(units: list, max_chars: int, separator: str) -> list:
+    """
+    يجمع وحدات نصية متتالية في أجزاء لا يتجاوز كل منها max_chars.
+    """
+    packed = []
+    current = ""
+    for unit in units:
+        candidate = f"{current}{separator}{unit}" if current else unit
+        if current and len(candidate) > max_chars:
+            packed.append(current)
+            current = unit
+        else:
+            current = candidate
+    if current.strip():
+        packed.append(current)
+    return packed
+
+
+def split_script_into_chunks(raw_script: str, max_chars: int) -> list:
+    """
+    يقسم مخطوطة كاملة إلى أجزاء للتنسيق المتوازي، على حدود الفصول ثم الفقرات.
+    كل جزء: {"index", "text", "chapter_title", "continues_chapter"}،
+    حيث continues_chapter يعني أن الجزء يكمل فصلا بدأ في جزء سابق (لا يبدأ بعنوانه).
+    """
+    chunks = []
+    for chapter in split_into_chapters(raw_script):
+        paragraphs = []
+        for paragraph in _PARAGRAPH_SPLIT_RE.split(chapter["text"]):
+            if not paragraph.strip():
+                continue
+            if len(paragraph) > max_chars:
+                paragraphs.extend(_split_oversized(paragraph, max_chars))
+            else:
+                paragraphs.append(paragraph)
+        for position, text in enumerate(_pack(paragraphs, max_chars, separator='\n\n')):
+            chunks.append({
+                "index": len(chunks),
+                "text": text,
+                "chapter_title": chapter["title"],
+                "continues_chapter": position > 0,
+            })
+    return chunks
@@ -0,0 +1,96 @@
+import asyncio
+import threading
+import weakref
+from metrics import registry
+
+SINGLE_FLIGHT_CALLS = registry.counter(
+    "single_flight_calls_total",
+    "Upstream calls by group: executed, or shared with an identical call already in flight (a saved upstream call).",
+    ("group", "result")
+)
+
+
+# كل مجموعات الدمج، لمقياس الاستدعاءات الجارية
+_groups = []
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _forget_task(calls: dict, key: str, task: asyncio.Task):
+    calls.pop(key, None)
+    if not task.cancelled():
+        task.exception() # يعد الاستثناء مقروءا وإن ألغي كل المنتظرين، فلا تحذر asyncio منه
+
+
+class SingleFlight:
+    """
+    يدمج الاستدعاءات المتزامنة المتطابقة داخل العملية: أول مستدع بمفتاح ما ينفذ الطلب،
+    ومن يصل بالمفتاح نفسه قبل انتهائه ينتظر ويأخذ النتيجة نفسها أو الاستثناء نفسه، دون طلب ثان.
+    لا يحفظ شيئا بعد انتهاء الطلب (ذلك دور الذاكرة المؤقتة).
+    """
+    def __init__(self, group: str):
+        self.group = group
+        self._lock = threading.Lock()
+        self._calls = {}
+        # الاستدعاءات غير المتزامنة لكل حلقة أحداث: مهام asyncio مرتبطة بالحلقة التي أنشأتها
+        self._async_calls = weakref.WeakKeyDictionary()
+        _groups.append(self)
+
+    def do(self, key: str, fn, *args, **kwargs):
+        """
+        ينفذ fn(*args, **kwargs) أو ينضم لتنفيذ جار بالمفتاح نفسه، ويعيد نتيجته.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            SINGLE_FLIGHT_CALLS.inc(group=self.group, result="shared")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        SINGLE_FLIGHT_CALLS.inc(group=self.group, result="executed")
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key: str, coroutine_fn, *args, **kwargs):
+        """
+        مثل do لدوال async. الطلب ينفذ في مهمة مستقلة، فإلغاء أحد المنتظرين (مثل انقطاع اتصال عميله)
+        لا يلغيه على الباقين.
+        """
+        loop = asyncio.get_running_loop()
+        calls = self._async_calls.setdefault(loop, {})
+        task = calls.get(key)
+        if task is not None:
+            SINGLE_FLIGHT_CALLS.inc(group=self.group, result="shared")
+        else:
+            SINGLE_FLIGHT_CALLS.inc(group=self.group, result="executed")
+            task = calls[key] = loop.create_task(coroutine_fn(*args, **kwargs))
+            task.add_done_callback(lambda finished: _forget_task(calls, key, finished))
+        return await asyncio.shield(task)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            count = len(self._calls)
+        return count + sum(len(calls) for calls in list(self._async_calls.values()))
+
+
+registry.callback("single_flight_in_flight", "Deduplicated upstream calls currently in flight.",
+                  lambda: [({"group": group.group}, group.in_flight()) for group in _groups])
@@ -0,0 +1,184 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+import numpy as np
+from config import (
+    STYLE_INDEX_ENABLED, STYLE_INDEX_PATH, STYLE_INDEX_DIMENSIONS, STYLE_INDEX_MAX_ENTRIES, STYLE_INDEX_SIMILARITY_THRESHOLD
+)
+from metrics import registry
+
+# حركات التشكيل والتطويل لا تغير معنى الوصف
+_ARABIC_MARKS_RE = re.compile(r'[\u064B-\u065F\u0670\u0640]')
+_ALEF_RE = re.compile(r'[\u0622\u0623\u0625]')
+_WORD_RE = re.compile(r'\w+')
+
+STYLE_INDEX_LOOKUPS = registry.counter("style_index_lookups_total", "Style suggestion index lookups by result.", ("result",))
+STYLE_INDEX_SECONDS = registry.histogram("style_index_lookup_seconds", "Time to search the style suggestion index.",
+                                         buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+STYLE_INDEX_SIMILARITY = registry.histogram("style_index_best_similarity", "Best cosine similarity found for each lookup.",
+                                            buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 1.0))
+
+
+def _normalize(text: str) -> str:
+    text = _ARABIC_MARKS_RE.sub('', text.lower())
+    text = _ALEF_RE.sub('\u0627', text).replace('\u0629', '\u0647').replace('\u0649', '\u064a')
+    return ' '.join(_WORD_RE.findall(text))
+
+
+def _features(text: str) -> list:
+    """
+    كلمات الوصف ومقاطع من 3 إلى 5 أحرف داخل كل كلمة، فتتشابه الأوصاف رغم اختلاف الصيغ (رواية/روايات).
+    """
+    features = []
+    for word in _normalize(text).split():
+        features.append(f"w:{word}")
+        padded = f" {word} "
+        for n in (3, 4, 5):
+            features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return features
+
+
+def vectorize(text: str, dimensions: int) -> np.ndarray:
+    """
+    متجه تكرار المقاطع (log(1+tf)) بعد تجزئتها إلى dimensions خانة (hashing trick)، دون قاموس.
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for feature in _features(text):
+        vector[zlib.crc32(feature.encode('utf-8')) % dimensions] += 1.0
+    np.log1p(vector, out=vector)
+    return vector
+
+
+class StyleSuggestionIndex:
+    """
+    فهرس أوصاف الكتب السابقة وإعدادات التصميم المقترحة لها. الوصف الجديد يقارن بكل الأوصاف
+    (تشابه جيب التمام بأوزان TF-IDF) في عملية مصفوفية واحدة، فإن تجاوز التشابه الحد تعاد إعداداته
+    دون طلب Gemini. الأوصاف تحفظ في SQLite وتعاد المتجهات منها عند التشغيل.
+    """
+    def __init__(self, db_path: str, dimensions: int, max_entries: int, threshold: float):
+        self._dimensions = dimensions
+        self._max_entries = max_entries
+        self._threshold = threshold
+        self._lock = threading.Lock()
+        self._ids = []
+        self._settings = []
+        self._last_used = []
+        self._matrix = np.zeros((0, dimensions), dtype=np.float32)
+        self._document_frequency = np.zeros(dimensions, dtype=np.float32)
+        self._weights = None # (مربعات IDF، أطوال المتجهات الموزونة) تحسب عند أول بحث بعد كل تغيير
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS style_suggestions ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, description TEXT NOT NULL, settings TEXT NOT NULL,"
+            " created_at REAL NOT NULL, last_used_at REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.commit()
+
+        rows = self._db.execute(
+            "SELECT id, description, settings, last_used_at FROM style_suggestions ORDER BY last_used_at DESC LIMIT ?", (max_entries,)
+        ).fetchall()
+        vectors = []
+        for row_id, description, settings, last_used_at in rows:
+            vectors.append(vectorize(description, dimensions))
+            self._ids.append(row_id)
+            self._settings.append(json.loads(settings))
+            self._last_used.append(last_used_at)
+        if vectors:
+            self._matrix = np.vstack(vectors)
+            self._document_frequency = (self._matrix > 0).sum(axis=0).astype(np.float32)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _idf(self) -> np.ndarray:
+        return np.log((1.0 + len(self._ids)) / (1.0 + self._document_frequency)) + 1.0
+
+    def lookup(self, description: str) -> dict | None:
+        """
+        يعيد نسخة من إعدادات أقرب وصف سابق إن تجاوز تشابهه الحد، وإلا None.
+        """
+        started = time.perf_counter()
+        query = vectorize(description, self._dimensions)
+        with self._lock:
+            best_index, best_score = None, 0.0
+            if self._ids and query.any():
+                # أوزان IDF تطبق عند البحث، فلا تعدل المتجهات المخزنة عند إضافة وصف
+                if self._weights is None:
+                    idf_squared = self._idf() ** 2
+                    self._weights = (idf_squared, np.sqrt((self._matrix ** 2) @ idf_squared))
+                idf_squared, row_norms = self._weights
+                scores = self._matrix @ (query * idf_squared)
+                scores /= np.maximum(row_norms * math.sqrt(float((query ** 2) @ idf_squared)), 1e-12)
+                best_index = int(np.argmax(scores))
+                best_score = float(scores[best_index])
+            result = None
+            if best_index is not None and best_score >= self._threshold:
+                result = dict(self._settings[best_index])
+                self._last_used[best_index] = time.time()
+                self._db.execute("UPDATE style_suggestions SET hits = hits + 1, last_used_at = ? WHERE id = ?",
+                                 (self._last_used[best_index], self._ids[best_index]))
+                self._db.commit()
+
+        STYLE_INDEX_SECONDS.observe(time.perf_counter() - started)
+        if self._ids:
+            STYLE_INDEX_SIMILARITY.observe(best_score)
+        STYLE_INDEX_LOOKUPS.inc(result="hit" if result is not None else "miss")
+        return result
+
+    def add(self, description: str, settings: dict):
+        """
+        يضيف وصفا وإعداداته، ويحذف الأقدم استخداما إن تجاوز الفهرس max_entries.
+        """
+        vector = vectorize(description, self._dimensions)
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO style_suggestions (description, settings, created_at, last_used_at) VALUES (?, ?, ?, ?)",
+                (description, json.dumps(settings, ensure_ascii=False), now, now)
+            )
+            self._ids.append(cursor.lastrowid)
+            self._settings.append(dict(settings))
+            self._last_used.append(now)
+            self._matrix = np.vstack([self._matrix, vector])
+            self._document_frequency += vector > 0
+            self._weights = None
+
+            while len(self._ids) > self._max_entries:
+                oldest = int(np.argmin(self._last_used))
+                self._db.execute("DELETE FROM style_suggestions WHERE id = ?", (self._ids[oldest],))
+                self._document_frequency -= self._matrix[oldest] > 0
+                self._matrix = np.delete(self._matrix, oldest, axis=0)
+                del self._ids[oldest], self._settings[oldest], self._last_used[oldest]
+            self._db.commit()
+
+
+_style_index = None
+_style_index_lock = threading.Lock()
+
+
+def get_style_index() -> StyleSuggestionIndex | None:
+    """
+    يعيد فهرس الاقتراحات المشترك، أو None إذا كان معطلا من الإعدادات.
+    """
+    global _style_index
+    if not STYLE_INDEX_ENABLED:
+        return None
+    with _style_index_lock:
+        if _style_index is None:
+            _style_index = StyleSuggestionIndex(STYLE_INDEX_PATH, STYLE_INDEX_DIMENSIONS, STYLE_INDEX_MAX_ENTRIES,
+                                                STYLE_INDEX_SIMILARITY_THRESHOLD)
+        return _style_index
+
+
+registry.callback("style_index_entries", "Descriptions held in the style suggestion index.",
+                  lambda: len(_style_index) if _style_index is not None else 0)
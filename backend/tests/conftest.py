@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+# وحدات الخادم مسطحة في backend/ وتستورد بعضها بأسمائها مباشرة
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# مجلد التحميل نسبي في config.py: الاختبارات تعمل في مجلد مؤقت، بلا مفاتيح API ولا ذاكرة مؤقتة على القرص
+os.chdir(tempfile.mkdtemp(prefix="book-creator-tests-"))
+os.environ.update({
+    "GEMINI_API_KEY": "",
+    "IMAGEN_API_KEY": "",
+    "AI_CACHE_ENABLED": "false",
+    "STYLE_INDEX_ENABLED": "false",
+    "RENDER_POOL_WORKERS": "0",
+})
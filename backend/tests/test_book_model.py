@@ -0,0 +1,14 @@
+import pytest
+from book_model import split_book_chapters
+
+
+@pytest.mark.parametrize("separator", ["\u2028", "\u0085", "\x0c", "\x0b", "\r", "\r\n"])
+def test_line_separators_do_not_shift_boundaries(separator):
+    html = f'<div dir="rtl"><p>a{separator}b</p>\n<h1>One</h1><p>x{separator}y</p>\n<h1>Two</h1><p>z</p></div>'
+    chapters = split_book_chapters(html)
+
+    assert [chapter["html"] for chapter in chapters] == [
+        f'<div dir="rtl"><p>a{separator}b</p>\n</div>',
+        f'<div dir="rtl"><h1>One</h1><p>x{separator}y</p>\n</div>',
+        '<div dir="rtl"><h1>Two</h1><p>z</p></div>',
+    ]
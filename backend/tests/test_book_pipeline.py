@@ -0,0 +1,29 @@
+import base64
+import io
+from PIL import Image
+from book_pipeline import book_spec_from_request, run_book_pipeline
+
+
+def _cover_data_uri() -> str:
+    buffer = io.BytesIO()
+    Image.new("RGB", (60, 90), "navy").save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def _spec(**fields) -> dict:
+    return book_spec_from_request({"bookScript": "# الفصل الأول\n\nنص الكتاب.", "ebookTitle": "كتاب",
+                                   "userProvidedCoverUrl": _cover_data_uri(), **fields})
+
+
+def test_unformatted_book_is_not_reused():
+    # بلا مفتاح Gemini يغلف النص دون تنسيق: لا يحفظ الكتاب باسم بصمة المواصفات
+    first = run_book_pipeline(_spec())
+    second = run_book_pipeline(_spec())
+    assert first["pdfUrl"] != second["pdfUrl"]
+
+
+def test_formatted_book_is_reused():
+    html = "<h1>الفصل الأول</h1><p>نص الكتاب.</p>"
+    first = run_book_pipeline(_spec(formattedHtml=html))
+    second = run_book_pipeline(_spec(formattedHtml=html))
+    assert first["pdfUrl"] == second["pdfUrl"]
@@ -0,0 +1,29 @@
+import chat_sessions
+from chat_sessions import ChatSession
+from config import CHAT_MAX_SESSION_TURNS, CHAT_RECENT_TURNS
+
+
+def test_summarized_turns_are_dropped(monkeypatch):
+    summarized = []
+    monkeypatch.setattr(chat_sessions, "summarize_chat_turns", lambda summary, turns: summarized.extend(turns) or f"{summary}+{len(turns)}")
+    session = ChatSession("s")
+    for i in range(CHAT_RECENT_TURNS * 3):
+        session.append("user", f"سؤال {i}")
+        session.context()
+        session.append("model", f"جواب {i}")
+
+    assert len(session.turns) <= CHAT_RECENT_TURNS + 1
+    assert session.turns[0]["role"] == "user"
+    assert len(summarized) + len(session.turns) == CHAT_RECENT_TURNS * 6
+    history = session.context()
+    assert session.summary in history[0]["parts"][0]["text"]
+    assert history[2:] == session.turns
+
+
+def test_turns_are_capped_without_summarizing():
+    session = ChatSession("s")
+    for i in range(CHAT_MAX_SESSION_TURNS):
+        session.append("user", f"سؤال {i}")
+        session.append("model", f"جواب {i}")
+    assert len(session.turns) <= CHAT_MAX_SESSION_TURNS
+    assert session.turns[0]["role"] == "user"
@@ -0,0 +1,40 @@
+import pytest
+from pdf_generator import add_heading_ids
+from benchmarks.bench_headings import add_heading_ids_bs4, make_script
+
+SCRIPTS = [
+    "<p>a\u2028b</p>\n<h1>Title</h1>\n<h2>Sub</h2>",
+    "<p>a\u0085b</p>\n<h1>Title</h1>\n<p>c\u2028d\u2029e</p>\n<h2 class=\"x\">Sub</h2>\n<h3>Third</h3>",
+    "<p>form\x0cfeed\x1c\x1d\x1e\x0b</p>\r\n<h1>Title</h1>\r<h2>Sub\u2028line</h2>",
+    "<h1 id=\"kept\">Kept</h1>\u2028<h2>After</h2>",
+    make_script(3),
+]
+
+
+@pytest.mark.parametrize("script", SCRIPTS)
+def test_matches_bs4_reference(script):
+    # BeautifulSoup يعيد تنسيق الوسوم، لذا تقارن المخرجات بعد تمريرها عليه فقط؛
+    # المخرجات الخام تفحصها test_only_inserts_missing_ids
+    bs4 = pytest.importorskip("bs4")
+    html, toc_entries = add_heading_ids(script)
+    expected_html, expected_toc = add_heading_ids_bs4(script)
+    assert toc_entries == expected_toc
+    assert str(bs4.BeautifulSoup(html, 'html.parser')) == expected_html
+
+
+@pytest.mark.parametrize("script", SCRIPTS)
+def test_only_inserts_missing_ids(script):
+    html, toc_entries = add_heading_ids(script)
+    stripped = html
+    for entry in toc_entries:
+        attribute = f' id="{entry["id"]}"'
+        if attribute in script:
+            continue
+        assert html.count(attribute) == 1
+        stripped = stripped.replace(attribute, "", 1)
+    assert stripped == script
+
+
+def test_line_separators_keep_markup_intact():
+    html, _ = add_heading_ids("<p>a\u2028b</p>\n<h1>Title</h1>\n<h2>Sub</h2>")
+    assert html == '<p>a\u2028b</p>\n<h1 id="section-0-Title">Title</h1>\n<h2 id="section-1-Sub">Sub</h2>'
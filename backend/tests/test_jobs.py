@@ -0,0 +1,70 @@
+import time
+import pytest
+import app as app_module
+from jobs import InlineJobBackend, InProcessJobBackend, JobBackend, set_job_backend
+
+# بمفاتيح run_book_pipeline ومفردات حالات مراحلها
+BOOK_RESULT = {"pdfUrl": "/download-pdf/book.pdf", "coverUrl": "/covers/cover.png", "message": "تم توليد الكتاب بنجاح!"}
+
+
+def _fake_pipeline(spec, on_stage=None):
+    for stage in app_module.BOOK_STAGES:
+        on_stage(stage, "running")
+        on_stage(stage, "done")
+    return dict(BOOK_RESULT, title=spec["ebookTitle"])
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app_module, "run_book_pipeline", _fake_pipeline)
+    yield app_module.app.test_client()
+    set_job_backend(InProcessJobBackend())
+
+
+def _submit(client):
+    response = client.post('/generate-book', json={"bookScript": "# فصل\n\nنص", "ebookTitle": "كتاب", "async": True})
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body["statusUrl"] == f"/jobs/{body['jobId']}"
+    return body
+
+
+def test_job_backend_is_abstract():
+    with pytest.raises(TypeError):
+        JobBackend()
+
+
+def test_async_generate_book_inline(client):
+    set_job_backend(InlineJobBackend())
+    body = _submit(client)
+
+    status = client.get(body["statusUrl"]).get_json()
+    assert status["status"] == "succeeded"
+    assert set(status["stages"]) == set(app_module.BOOK_STAGES)
+    assert all(stage["status"] == "done" for stage in status["stages"].values())
+
+    result = client.get(body["resultUrl"])
+    assert result.status_code == 200
+    assert result.get_json()["title"] == "كتاب"
+    assert result.get_json()["pdfUrl"] == "/download-pdf/book.pdf"
+    # رابط الغلاف المحفوظ على الخادم يعاد كاملا لتعرضه الواجهة مباشرة
+    assert result.get_json()["coverUrl"] == "http://localhost/covers/cover.png"
+
+
+def test_async_generate_book_polling(client):
+    set_job_backend(InProcessJobBackend(max_workers=1))
+    body = _submit(client)
+
+    deadline = time.monotonic() + 10
+    while (status := client.get(body["statusUrl"]).get_json()["status"]) in ("queued", "running"):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert status == "succeeded"
+    result = client.get(body["resultUrl"]).get_json()
+    assert result["title"] == "كتاب"
+    assert result["coverUrl"] == "http://localhost/covers/cover.png"
+
+
+def test_unknown_job(client):
+    assert client.get('/jobs/missing').status_code == 404
+    assert client.get('/jobs/missing/result').status_code == 404
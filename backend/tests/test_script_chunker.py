@@ -0,0 +1,51 @@
+import pytest
+from script_chunker import _CHAPTER_LINE_RE, split_into_chapters, split_script_into_chunks
+
+HEADINGS = [
+    "# The Beginning",
+    "<h1>Title</h1>",
+    "Chapter 1",
+    "Chapter 12: The Storm",
+    "CHAPTER IV. Homecoming",
+    "Part Two — The Return",
+    "Chapter one",
+    "الفصل الأول",
+    "الفصل 3: البحر",
+    "الباب الثاني",
+    "الجزء الثالث - العودة",
+]
+
+PROSE = [
+    "Part of the reason he left was the storm.",
+    "Part of the reason",
+    "Chapter and verse were quoted at length",
+    "Parts of the ship were missing.",
+    "Chapter 3 ends with a twist, as expected.",
+    "Partly cloudy skies greeted them",
+    "الجزء الأكبر من المدينة كان مظلما.",
+    "الفصل بين الأمرين صعب",
+    "Chapter 7 " + "is remembered for the long journey across the northern mountains and valleys",
+]
+
+
+@pytest.mark.parametrize("line", HEADINGS)
+def test_heading_lines(line):
+    assert _CHAPTER_LINE_RE.match(line + "\n")
+
+
+@pytest.mark.parametrize("line", PROSE)
+def test_prose_lines_are_not_headings(line):
+    assert not _CHAPTER_LINE_RE.match(line + "\n")
+
+
+def test_prose_line_does_not_split_chapter():
+    script = "Chapter 1\n\nThe sea was calm.\nPart of the reason he left was the storm.\n\nChapter 2\n\nMore."
+    chapters = split_into_chapters(script)
+    assert [chapter["title"] for chapter in chapters] == ["Chapter 1", "Chapter 2"]
+
+
+def test_continuation_title_is_the_heading():
+    paragraph = "Part of the reason he left was the storm and the sea " * 10
+    chunks = split_script_into_chunks("Chapter 1\n\n" + "\n\n".join([paragraph] * 6), 1200)
+    assert len(chunks) > 1
+    assert all(chunk["chapter_title"] == "Chapter 1" for chunk in chunks)
@@ -0,0 +1,181 @@
+import html
+import math
+import re
+from collections import Counter
+from config import GEMINI_INPUT_TOKEN_LIMIT
+from script_chunker import split_into_chapters, _CHAPTER_LINE_RE, _PARAGRAPH_SPLIT_RE, _SENTENCE_SPLIT_RE, _TAG_RE, _split_oversized
+
+# رموز تترك لرد النموذج وهوامش التقدير عند حساب الميزانية من حد المدخلات
+_RESPONSE_RESERVE_TOKENS = 1024
+
+# الفقرات الأطول من هذا تقسم قبل التقييم، فلا يستهلك نص بلا فواصل الميزانية كلها في مقطع واحد
+_MAX_UNIT_CHARS = 1200
+# أقصى رموز لمقطع واحد مختار لكثافة معلوماته، وأقل ميزانية يستحق معها إضافة مقطع
+_MAX_BODY_TOKENS = 160
+_MIN_UNIT_TOKENS = 24
+
+_HEADING_TAG_RE = re.compile(r'<h([1-3])[^>]*>(.*?)</h\1>', re.IGNORECASE | re.DOTALL)
+_BLOCK_TAG_RE = re.compile(r'</?(?:p|div|li|ul|ol|blockquote|section|article|h[4-6]|table|tr)[^>]*>|<br\s*/?>', re.IGNORECASE)
+_TERM_RE = re.compile(r'\w{3,}')
+
+_OMISSION = "[...]"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    تقدير محلي لعدد الرموز دون tokenizer النموذج: نحو 4 أحرف لاتينية للرمز، ونحو 2.5 حرف للعربية وغيرها.
+    عدد الأحرف غير اللاتينية يقدر من فرق طول UTF-8، فالتقدير سريع حتى لكتاب كامل.
+    """
+    if not text:
+        return 0
+    non_ascii = min(len(text), len(text.encode('utf-8')) - len(text))
+    return math.ceil((len(text) - non_ascii) / 4 + non_ascii / 2.5)
+
+
+def prompt_budget(requested_tokens: int, instructions: str) -> int:
+    """
+    ميزانية المقتطف في طلب: المطلوبة، دون تجاوز حد مدخلات النموذج بعد التعليمات ومساحة الرد.
+    """
+    available = GEMINI_INPUT_TOKEN_LIMIT - estimate_tokens(instructions) - _RESPONSE_RESERVE_TOKENS
+    return max(0, min(requested_tokens, available))
+
+
+def truncate_to_tokens(text: str, token_budget: int) -> str:
+    """
+    يقص النص ليقارب الميزانية، على حدود الجمل إن أمكن ثم الكلمات.
+    """
+    text = text.strip()
+    if estimate_tokens(text) <= token_budget:
+        return text
+    kept = ""
+    for sentence in _SENTENCE_SPLIT_RE.split(text):
+        candidate = f"{kept} {sentence}".strip()
+        if estimate_tokens(candidate) > token_budget:
+            break
+        kept = candidate
+    if kept:
+        return kept
+    # الجملة الأولى وحدها أطول من الميزانية: قص بعدد الأحرف المقابل ثم الرجوع لآخر كلمة كاملة
+    chars = max(1, int(len(text) * token_budget / estimate_tokens(text)))
+    cut = text[:chars]
+    return (cut.rsplit(' ', 1)[0] if ' ' in cut else cut) + "…"
+
+
+def _plain_text(manuscript: str) -> str:
+    """
+    يحول HTML المنسق (إن كان) إلى نص: العناوين الرئيسية أسطر Markdown تفصل بها الفصول، والكتل فقرات.
+    """
+    if not _TAG_RE.search(manuscript):
+        return manuscript
+    text = _HEADING_TAG_RE.sub(lambda m: f"\n\n{'#' * int(m.group(1))} {_TAG_RE.sub('', m.group(2)).strip()}\n\n", manuscript)
+    text = _BLOCK_TAG_RE.sub("\n\n", text)
+    return html.unescape(_TAG_RE.sub('', text))
+
+
+def _units(text: str) -> list:
+    """
+    وحدات الكتاب بالترتيب: {"position", "kind" (heading/opening/body), "text"}.
+    """
+    units = []
+    for chapter in split_into_chapters(text):
+        body = chapter["text"]
+        if chapter["title"]:
+            units.append({"position": len(units), "kind": "heading", "text": f"# {chapter['title']}"})
+            lines = body.lstrip().split('\n', 1)
+            if _CHAPTER_LINE_RE.match(lines[0]):
+                body = lines[1] if len(lines) > 1 else ""
+        kind = "opening"
+        for paragraph in _PARAGRAPH_SPLIT_RE.split(body):
+            if not paragraph.strip():
+                continue
+            pieces = _split_oversized(paragraph, _MAX_UNIT_CHARS) if len(paragraph) > _MAX_UNIT_CHARS else [paragraph]
+            for piece in pieces:
+                units.append({"position": len(units), "kind": kind, "text": ' '.join(piece.split())})
+                kind = "body"
+    return units
+
+
+def _score_units(units: list):
+    """
+    كثافة المعلومات لكل مقطع: مجموع ندرة (IDF) كلماته المختلفة مقسوما على جذر طوله،
+    فتتقدم المقاطع الغنية بأسماء ومفاهيم خاصة على الحشو والحوار القصير.
+    """
+    terms = [set(_TERM_RE.findall(unit["text"].lower())) for unit in units]
+    document_frequency = Counter(term for unit_terms in terms for term in unit_terms)
+    total = len(units)
+    for unit, unit_terms in zip(units, terms):
+        if len(unit_terms) < 5:
+            unit["score"] = 0.0
+            continue
+        idf = sum(math.log(total / document_frequency[term]) for term in unit_terms)
+        unit["score"] = idf / math.sqrt(len(_TERM_RE.findall(unit["text"])))
+
+
+def _evenly_spaced(items: list, count: int) -> list:
+    if count >= len(items):
+        return items
+    if count <= 1:
+        return items[:max(count, 0)]
+    step = (len(items) - 1) / (count - 1)
+    return [items[round(i * step)] for i in range(count)]
+
+
+def representative_excerpt(manuscript: str, token_budget: int) -> str:
+    """
+    مقتطف مضغوط ممثل للكتاب كله ضمن token_budget: عناوين الفصول، بدايات الفصول،
+    ثم أعلى المقاطع كثافة بالمعلومات من أي مكان في الكتاب، بترتيب ورودها مع [...] مكان المحذوف.
+    النص الذي يتسع للميزانية يعاد كما هو.
+    """
+    text = _plain_text(manuscript).strip()
+    if estimate_tokens(text) <= token_budget:
+        return text
+    units = _units(text)
+    if not units:
+        return truncate_to_tokens(text, token_budget)
+
+    selected = {}
+    remaining = token_budget
+
+    def take(unit, cap: int) -> bool:
+        nonlocal remaining
+        piece = truncate_to_tokens(unit["text"], min(cap, remaining))
+        cost = estimate_tokens(piece)
+        if not piece or cost > remaining:
+            return False
+        selected[unit["position"]] = piece
+        remaining -= cost
+        return True
+
+    # عناوين الفصول (حتى خمس الميزانية): مخطط الكتاب كله بكلفة قليلة
+    headings = [unit for unit in units if unit["kind"] == "heading"]
+    heading_budget = token_budget // 5
+    heading_cost = sum(estimate_tokens(unit["text"]) for unit in headings) or 1
+    for unit in _evenly_spaced(headings, int(len(headings) * min(1.0, heading_budget / heading_cost))):
+        take(unit, heading_budget)
+
+    # بدايات الفصول (حتى خمسي الميزانية)، موزعة بالتساوي إن كثرت الفصول
+    openings = [unit for unit in units if unit["kind"] == "opening"]
+    opening_budget = token_budget * 2 // 5
+    count = min(len(openings), max(1, opening_budget // (_MIN_UNIT_TOKENS * 2)))
+    per_opening = opening_budget // max(1, count)
+    for unit in _evenly_spaced(openings, count):
+        if remaining < _MIN_UNIT_TOKENS:
+            break
+        take(unit, per_opening)
+
+    # الباقي لأكثر المقاطع كثافة بالمعلومات
+    _score_units(units)
+    for unit in sorted(units, key=lambda unit: unit["score"], reverse=True):
+        if remaining < _MIN_UNIT_TOKENS or unit["score"] <= 0:
+            break
+        if unit["position"] not in selected and unit["kind"] != "heading":
+            take(unit, _MAX_BODY_TOKENS)
+
+    pieces = []
+    previous = -1
+    for position in sorted(selected):
+        if position != previous + 1 and units[position]["kind"] != "heading":
+            pieces.append(_OMISSION)
+        pieces.append(selected[position])
+        previous = position
+    return "\n\n".join(pieces)
@@ -14,6 +14,8 @@ const BookCreator = ({ bookScript, setBookScript, settings, setSettings }) => {
   const [successMessage, setSuccessMessage] = useState('');
   const [loadingStyleSuggestion, setLoadingStyleSuggestion] = useState(false);
   const [loadingCoverDescriptions, setLoadingCoverDescriptions] = useState(false); // حالة تحميل أوصاف الغلاف
+  const [formattedDraftId, setFormattedDraftId] = useState(''); // هوية النص المنسق على الخادم، فلا يعاد تنسيقه عند التوليد
+  const [coverDraftId, setCoverDraftId] = useState(''); // هوية أوصاف الغلاف المولدة على الخادم
 
   const {
     textColor, backgroundColor, fontFamily, fontSize, lineHeight, textAlign,
@@ -46,13 +48,14 @@ const BookCreator = ({ bookScript, setBookScript, settings, setSettings }) => {
     }
 
     try {
-      const bookDescription = bookScript.substring(0, 1000) || ebookTitle;
+      // النص كاملا في manuscript: الخادم يأخذ منه مقتطفا ممثلا، ويخدم تحليل واحد النمط وأوصاف الغلاف
+      const requestBody = bookScript ? { manuscript: bookScript } : { bookDescription: ebookTitle };
       const response = await fetch(`${BACKEND_URL}/suggest-style`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ bookDescription }),
+        body: JSON.stringify(requestBody),
       });
 
       const data = await response.json();
@@ -94,6 +97,7 @@ const BookCreator = ({ bookScript, setBookScript, settings, setSettings }) => {
 
       if (response.ok && data.formattedHtml) {
         setBookScript(data.formattedHtml);
+        setFormattedDraftId(data.draftId || '');
         setSuccessMessage('تم تنسيق نص الكتاب بنجاح بواسطة الذكاء الاصطناعي!');
       } else {
         setErrorMessage(data.error || 'فشل الذكاء الاصطناعي في تنسيق النص. يرجى المحاولة مرة أخرى.');
@@ -119,13 +123,14 @@ const BookCreator = ({ bookScript, setBookScript, settings, setSettings }) => {
     }
 
     try {
-      const bookContent = bookScript.substring(0, 5000) || ebookTitle; // إرسال جزء أكبر من النص
+      // النص كاملا، فيمثل المقتطف الكتاب كله لا بدايته
+      const requestBody = bookScript ? { manuscript: bookScript } : { bookContent: ebookTitle };
       const response = await fetch(`${BACKEND_URL}/generate-cover-descriptions`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ bookContent }),
+        body: JSON.stringify(requestBody),
       });
 
       const data = await response.json();
@@ -133,6 +138,7 @@ const BookCreator = ({ bookScript, setBookScript, settings, setSettings }) => {
       if (response.ok && data.front_cover_prompt && data.back_cover_text) {
         setCoverPrompt(data.front_cover_prompt);
         setBackCoverPrompt(data.back_cover_text);
+        setCoverDraftId(data.coverDraftId || '');
         setSuccessMessage('تم توليد أوصاف الغلاف الأمامي والخلفي بنجاح!');
       } else {
         setErrorMessage(data.error || 'فشل في توليد أوصاف الغلاف. يرجى المحاولة مرة أخرى.');
@@ -171,6 +177,8 @@ const BookCreator = ({ bookScript, setBookScript, settings, setSettings }) => {
           coverPrompt,
           userProvidedCoverUrl,
           backCoverText: backCoverPrompt, // إرسال نص الغلاف الخلفي
+          draftId: formattedDraftId, // يتجاهله الخادم إن عدل النص بعد التنسيق
+          coverDraftId,
           settings: settings,
         }),
       });